@@ -2,12 +2,75 @@
 # Desenvolvido por Dione Castro Alves - InNovaIdeia
 # Versão otimizada para execução em qualquer ambiente
 
+import time
+_INICIO_PROCESSO = time.perf_counter()
+
 import os
 import sys
 import sqlite3
 import json
-from datetime import datetime, timedelta
+import csv
+import io
+import struct
+import mmap
+import bisect
+import threading
+from array import array
+from datetime import datetime, timedelta, date, timezone
 import random
+import heapq
+import operator
+import gzip
+import zlib
+import hashlib
+import hmac
+import signal
+import functools
+import math
+import argparse
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FuturoTimeout
+from concurrent.futures.process import BrokenProcessPool
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from urllib.parse import quote
+
+# ===== MEDIÇÃO DE INICIALIZAÇÃO =====
+class MedidorInicializacao:
+    """Registra o tempo de cada etapa de inicialização (relatório em /api/status/inicializacao)"""
+    def __init__(self, inicio):
+        self.inicio = inicio
+        self.etapas = []
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def etapa(self, nome):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.etapas.append((nome, (time.perf_counter() - inicio) * 1000))
+    
+    def relatorio(self):
+        with self._lock:
+            etapas = list(self.etapas)
+        return {
+            'modo': MODO_INICIO,
+            'etapas_ms': [{'etapa': nome, 'ms': round(ms, 2)} for nome, ms in etapas],
+            'desde_inicio_ms': round((time.perf_counter() - self.inicio) * 1000, 2)
+        }
+    
+    def imprimir(self):
+        print(f"⏱️ Inicialização ({MODO_INICIO}):")
+        for item in self.relatorio()['etapas_ms']:
+            print(f"   {item['etapa']:<28} {item['ms']:>9.2f} ms")
+
+# 'rapido' pula a verificação via pip e adia banco/templates para o primeiro uso
+MODO_INICIO = os.getenv('INSIGHTPRO_MODO_INICIO', 'padrao')
+MEDIDOR_INICIO = MedidorInicializacao(_INICIO_PROCESSO)
+MEDIDOR_INICIO.etapas.append(('imports_stdlib', (time.perf_counter() - _INICIO_PROCESSO) * 1000))
 
 # Configuração automática de dependências
 def verificar_dependencias():
@@ -20,284 +83,3246 @@ def verificar_dependencias():
         os.system(f"{sys.executable} -m pip install flask")
         import flask
 
-# Verificar dependências na inicialização
-verificar_dependencias()
+# Verificar dependências na inicialização (em modo rápido o ambiente já deve estar pronto)
+if MODO_INICIO != 'rapido':
+    with MEDIDOR_INICIO.etapa('verificar_dependencias'):
+        verificar_dependencias()
 
-from flask import Flask, render_template_string, request, jsonify
+with MEDIDOR_INICIO.etapa('import_flask'):
+    from flask import Flask, render_template_string, render_template, request, jsonify, Response, stream_with_context
 
 # ===== CONFIGURAÇÕES PORTÁVEIS =====
 class Config:
     # Detecta automaticamente o diretório de execução
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-    DB_PATH = os.path.join(BASE_DIR, 'insightpro.db')
-    SECRET_KEY = 'insightpro-portable-key'
+    DB_PATH = os.getenv('INSIGHTPRO_DB', os.path.join(BASE_DIR, 'insightpro.db'))
+    SECRET_KEY = os.getenv('INSIGHTPRO_SECRET_KEY', 'insightpro-portable-key')
     
     # Configuração para diferentes ambientes
-    HOST = '0.0.0.0' if os.getenv('TERMUX_VERSION') else '127.0.0.1'
+    HOST = os.getenv('INSIGHTPRO_HOST', '0.0.0.0' if os.getenv('TERMUX_VERSION') else '127.0.0.1')
     PORT = int(os.getenv('PORT', 5000))
-    DEBUG = True
+    DEBUG = os.getenv('INSIGHTPRO_DEBUG', '1') == '1'
+    
+    # Ajustes em JSON aplicados sobre estes padrões; recarregados por SIGHUP ou /api/admin/config
+    CONFIG_ARQUIVO = os.getenv('INSIGHTPRO_CONFIG', os.path.join(BASE_DIR, 'insightpro.json'))
+    # Sem token, a administração só aceita requisições locais
+    ADMIN_TOKEN = os.getenv('INSIGHTPRO_ADMIN_TOKEN')
+    
+    # SQLite: espera por travas, perfil de PRAGMAs (PERFIS_PRAGMA) e sobreposições
+    # individuais do perfil (None = valor do perfil)
+    SQLITE_TIMEOUT = 30.0
+    PERFIL_PRAGMA = os.getenv('INSIGHTPRO_PERFIL_PRAGMA', 'equilibrado')
+    PRAGMA_CACHE_SIZE = None      # KiB de cache de páginas por conexão
+    PRAGMA_MMAP_SIZE = None       # bytes mapeados em memória
+    PRAGMA_SYNCHRONOUS = None     # OFF, NORMAL, FULL ou EXTRA
+    
+    # Manutenção do SQLite: optimize + checkpoint do WAL a cada intervalo, ANALYZE completo mais espaçado
+    MANUTENCAO_INTERVALO = int(os.getenv('INSIGHTPRO_MANUTENCAO_INTERVALO', 3600))
+    ANALYZE_INTERVALO = int(os.getenv('INSIGHTPRO_ANALYZE_INTERVALO', 86400))
+    # Linhas amostradas por índice no ANALYZE (PRAGMA analysis_limit); 0 = varredura completa
+    ANALYZE_LIMITE = int(os.getenv('INSIGHTPRO_ANALYZE_LIMITE', 1000))
+    
+    # Janelas do seletor de período do dashboard (em dias) e tamanhos das consultas
+    PERIODOS = {'dia': 1, 'semana': 7, 'mes': 30, 'trimestre': 90}
+    HISTORICO_LIMITE = 30
+    RECENTES_LIMITE = 10
+    EXPORTACAO_LOTE = 500
+    
+    # Réplica somente leitura para consultas analíticas (atualizada via backup API)
+    REPLICA_LEITURA = os.getenv('INSIGHTPRO_REPLICA_LEITURA')
+    REPLICA_INTERVALO = int(os.getenv('INSIGHTPRO_REPLICA_INTERVALO', 30))
+    
+    # Exclusão lógica: tombstones são purgados em lotes após a retenção
+    COMPACTACAO_INTERVALO = int(os.getenv('INSIGHTPRO_COMPACTACAO_INTERVALO', 300))
+    TOMBSTONE_RETENCAO = int(os.getenv('INSIGHTPRO_TOMBSTONE_RETENCAO', 3600))
+    # Log de alterações (CDC): consumidores mais atrasados que isso precisam ressincronizar
+    LOG_ALTERACOES_RETENCAO = int(os.getenv('INSIGHTPRO_LOG_RETENCAO', 30 * 86400))
+    COMPACTACAO_LOTE = 500
+    
+    # Retenção em camadas: brutos por N meses (0 = sem retenção), resumos semanais por
+    # mais M meses, resumos mensais para sempre; brutos vão para arquivos anuais .jsonl.gz
+    RETENCAO_MESES = int(os.getenv('INSIGHTPRO_RETENCAO_MESES', 0))
+    RETENCAO_SEMANAL_MESES = int(os.getenv('INSIGHTPRO_RETENCAO_SEMANAL_MESES', 12))
+    ARQUIVO_DIR = os.getenv('INSIGHTPRO_ARQUIVO_DIR')
+    
+    # Motor de armazenamento: 'sqlite' (arquivo), 'sqlite-memoria' ou 'memoria' (demos/testes)
+    ARMAZENAMENTO = os.getenv('INSIGHTPRO_ARMAZENAMENTO', 'sqlite')
+    
+    # Respostas menores que isso não compensam o custo de compressão
+    COMPRESSAO_MINIMO = 512
+    
+    # Pré-cálculo dos dashboards: espera o fim da rajada de escritas antes de recalcular
+    AGENDADOR_ATIVO = os.getenv('INSIGHTPRO_AGENDADOR', '1') == '1'
+    AGENDADOR_ESPERA_RAJADA = 0.5
+    AGENDADOR_ESPERA_MAXIMA = 5.0
+    AGENDADOR_VERIFICACAO = 5.0
+    
+    # Registros mais recentes mantidos em memória para /api/dados-recentes
+    RECENTES_CAPACIDADE = 50
+    # Intervalo mínimo (ms) entre consultas à versão dos dados para detectar escritas de outros processos
+    RECENTES_VERIFICACAO_MS = 250
+    
+    # Sincronização offline (/api/sync): carga inicial limitada a uma janela de dias e de linhas
+    SYNC_JANELA_DIAS = 90
+    SYNC_MAXIMO_LINHAS = 2000
+    
+    # Ingestão: um registro por dia (upsert) e chaves de idempotência para retentativas
+    UPSERT_DIARIO = os.getenv('INSIGHTPRO_UPSERT_DIARIO', '0') == '1'
+    
+    # Feriados do calendário: CSV "data,nome" com MM-DD (todo ano) ou AAAA-MM-DD
+    FERIADOS_ARQUIVO = os.getenv('INSIGHTPRO_FERIADOS', os.path.join(BASE_DIR, 'feriados.csv'))
+    
+    # Migrações em lotes: linhas por transação e pausa entre lotes (libera o escritor)
+    MIGRACAO_LOTE = 2000
+    MIGRACAO_PAUSA = 0.05
+    IDEMPOTENCIA_RETENCAO = 86400
+    
+    # Token bucket por cliente nos endpoints de escrita (rajada máxima e reposição/segundo)
+    LIMITE_ESCRITA_CAPACIDADE = 20
+    LIMITE_ESCRITA_TAXA = 5.0
+    
+    # Serviço de análise em processos separados (0 = execução local, sem pool)
+    ANALISE_PROCESSOS = int(os.getenv('INSIGHTPRO_ANALISE_PROCESSOS', max(1, (os.cpu_count() or 2) // 2)))
+    ANALISE_FILA_MAXIMA = 32
+    ANALISE_TIMEOUT = 10.0
+    ANALISE_CACHE_TAMANHO = 32
+
+# Mesmo dicionário de Config: a recarga altera o conteúdo, nunca a referência
+PERIODOS = Config.PERIODOS
+
+# Rótulos do seletor do dashboard; períodos sem rótulo aparecem como "Últimos N dias"
+ROTULOS_PERIODO = {'dia': 'Último Dia', 'semana': 'Última Semana', 'mes': 'Último Mês',
+                   'trimestre': 'Último Trimestre', 'ano': 'Último Ano'}
+
+def opcoes_periodo():
+    """(nome, rótulo) de cada período configurado, do mais curto ao mais longo"""
+    return [(nome, ROTULOS_PERIODO.get(nome, f'Últimos {dias} dias'))
+            for nome, dias in sorted(PERIODOS.items(), key=lambda item: item[1])]
+
+# Perfis de PRAGMA aplicados a cada conexão (cache_size em KiB, mmap_size em bytes)
+PERFIS_PRAGMA = {
+    # Cada commit sincronizado no disco: nenhuma transação confirmada se perde em queda de energia
+    'duravel': {'synchronous': 'FULL', 'cache_size': 2048, 'mmap_size': 0,
+                'temp_store': 'DEFAULT', 'wal_autocheckpoint': 1000},
+    # WAL + NORMAL: sem risco de corromper o banco; uma queda pode perder os últimos commits
+    'equilibrado': {'synchronous': 'NORMAL', 'cache_size': 16384, 'mmap_size': 64 * 1024 * 1024,
+                    'temp_store': 'MEMORY', 'wal_autocheckpoint': 1000},
+    # Cargas grandes: checkpoints raros (WAL maior) e cache generoso; a manutenção trunca o WAL
+    'ingestao': {'synchronous': 'NORMAL', 'cache_size': 65536, 'mmap_size': 256 * 1024 * 1024,
+                 'temp_store': 'MEMORY', 'wal_autocheckpoint': 10000},
+}
+
+class Ajuste:
+    """Parâmetro de Config ajustável por arquivo/admin: tipo, limites e se vale sem reinício"""
+    def __init__(self, nome, tipo, minimo=None, maximo=None, opcoes=None, opcional=False, recarregavel=True):
+        self.nome = nome
+        self.tipo = tipo
+        self.minimo = minimo
+        self.maximo = maximo
+        self.opcoes = opcoes
+        self.opcional = opcional
+        self.recarregavel = recarregavel
+    
+    def converter(self, valor):
+        """Valor bruto (JSON ou texto) -> valor tipado; ValueError com a explicação"""
+        if valor is None:
+            if self.opcional:
+                return None
+            raise ValueError('não pode ser nulo')
+        if self.tipo is bool:
+            if isinstance(valor, str):
+                if valor.lower() not in ('1', '0', 'true', 'false'):
+                    raise ValueError('esperado booleano')
+                return valor.lower() in ('1', 'true')
+            return bool(valor)
+        if self.tipo is dict:
+            if not isinstance(valor, dict) or not valor:
+                raise ValueError('esperado objeto não vazio')
+            convertido = {str(k): int(v) for k, v in valor.items()}
+            if any(v < 1 for v in convertido.values()):
+                raise ValueError('valores devem ser inteiros positivos')
+            return convertido
+        if self.tipo in (int, float) and isinstance(valor, bool):
+            raise ValueError('esperado número')
+        try:
+            if self.opcoes and isinstance(valor, str) and valor.upper() in self.opcoes:
+                valor = valor.upper()
+            convertido = self.tipo(valor)
+        except (TypeError, ValueError):
+            raise ValueError(f"esperado {'inteiro' if self.tipo is int else 'número' if self.tipo is float else 'texto'}")
+        if self.tipo is int and isinstance(valor, float) and valor != convertido:
+            raise ValueError('esperado inteiro')
+        if self.minimo is not None and convertido < self.minimo:
+            raise ValueError(f'mínimo {self.minimo}')
+        if self.maximo is not None and convertido > self.maximo:
+            raise ValueError(f'máximo {self.maximo}')
+        if self.opcoes and convertido not in self.opcoes:
+            raise ValueError(f"use {', '.join(self.opcoes)}")
+        return convertido
+
+AJUSTES = {a.nome: a for a in (
+    # Lidos só na inicialização
+    Ajuste('DB_PATH', str, recarregavel=False),
+    Ajuste('SECRET_KEY', str, recarregavel=False),
+    Ajuste('HOST', str, recarregavel=False),
+    Ajuste('PORT', int, 1, 65535, recarregavel=False),
+    Ajuste('DEBUG', bool, recarregavel=False),
+    Ajuste('ANALISE_PROCESSOS', int, 0, 64, recarregavel=False),
+    Ajuste('ANALISE_FILA_MAXIMA', int, 1, 10000, recarregavel=False),
+    Ajuste('COMPACTACAO_INTERVALO', int, 1, recarregavel=False),
+    # Valem na próxima conexão, consulta ou lote
+    Ajuste('SQLITE_TIMEOUT', float, 0.1, 600),
+    Ajuste('PERFIL_PRAGMA', str, opcoes=tuple(PERFIS_PRAGMA)),
+    Ajuste('MANUTENCAO_INTERVALO', int, 60),
+    Ajuste('ANALYZE_INTERVALO', int, 60),
+    Ajuste('ANALYZE_LIMITE', int, 0),
+    Ajuste('PRAGMA_CACHE_SIZE', int, 0, 16 * 1024 * 1024, opcional=True),
+    Ajuste('PRAGMA_MMAP_SIZE', int, 0, 1 << 40, opcional=True),
+    Ajuste('PRAGMA_SYNCHRONOUS', str, opcoes=('OFF', 'NORMAL', 'FULL', 'EXTRA'), opcional=True),
+    Ajuste('PERIODOS', dict),
+    Ajuste('HISTORICO_LIMITE', int, 2, 10000),
+    Ajuste('RECENTES_LIMITE', int, 1, 1000),
+    Ajuste('RECENTES_CAPACIDADE', int, 1, 10000),
+    Ajuste('RECENTES_VERIFICACAO_MS', int, 0, 60000),
+    Ajuste('SYNC_JANELA_DIAS', int, 1, 3650),
+    Ajuste('SYNC_MAXIMO_LINHAS', int, 1, 100000),
+    Ajuste('EXPORTACAO_LOTE', int, 1, 100000),
+    Ajuste('COMPACTACAO_LOTE', int, 1, 100000),
+    Ajuste('MIGRACAO_LOTE', int, 1, 1000000),
+    Ajuste('MIGRACAO_PAUSA', float, 0, 60),
+    Ajuste('TOMBSTONE_RETENCAO', int, 0),
+    Ajuste('LOG_ALTERACOES_RETENCAO', int, 0),
+    Ajuste('RETENCAO_MESES', int, 0),
+    Ajuste('RETENCAO_SEMANAL_MESES', int, 0),
+    Ajuste('REPLICA_INTERVALO', int, 1),
+    Ajuste('COMPRESSAO_MINIMO', int, 0),
+    Ajuste('AGENDADOR_ESPERA_RAJADA', float, 0.01, 60),
+    Ajuste('AGENDADOR_ESPERA_MAXIMA', float, 0.01, 600),
+    Ajuste('AGENDADOR_VERIFICACAO', float, 0.1, 3600),
+    Ajuste('LIMITE_ESCRITA_CAPACIDADE', int, 1, 100000),
+    Ajuste('LIMITE_ESCRITA_TAXA', float, 0.01, 100000),
+    Ajuste('ANALISE_TIMEOUT', float, 0.1, 600),
+    Ajuste('ANALISE_CACHE_TAMANHO', int, 1, 100000),
+)}
+
+# Valores do código + ambiente (antes de qualquer arquivo); base de toda recarga
+PADROES_CONFIG = {nome: getattr(Config, nome) for nome in AJUSTES}
+PADROES_CONFIG['PERIODOS'] = dict(Config.PERIODOS)
+
+# geracao muda a cada recarga aplicada: conexões persistentes reaplicam PRAGMAs
+ESTADO_CONFIG = {'geracao': 0, 'arquivo': None, 'recarregado_em': None, 'sobreposicoes': {}}
+_ouvintes_config = []
+_config_lock = threading.Lock()
+
+def registrar_ouvinte_config(ouvinte):
+    """ouvinte(alterados) após cada recarga; alterados = {nome: (antigo, novo)}"""
+    _ouvintes_config.append(ouvinte)
+
+def validar_configuracao(brutos):
+    """Converte todos os valores; retorna (valores, erros) sem alterar Config"""
+    valores, erros = {}, []
+    for nome, valor in brutos.items():
+        ajuste = AJUSTES.get(nome)
+        if ajuste is None:
+            erros.append(f'{nome}: ajuste desconhecido')
+            continue
+        try:
+            valores[nome] = ajuste.converter(valor)
+        except (TypeError, ValueError) as e:
+            erros.append(f'{nome}: {e}')
+    if not erros:
+        final = {nome: valores.get(nome, getattr(Config, nome)) for nome in AJUSTES}
+        if final['RECENTES_LIMITE'] > final['RECENTES_CAPACIDADE']:
+            erros.append('RECENTES_LIMITE: não pode exceder RECENTES_CAPACIDADE')
+        if 'semana' not in final['PERIODOS']:
+            erros.append("PERIODOS: o período 'semana' (padrão) é obrigatório")
+    return valores, erros
+
+def recarregar_configuracao(sobreposicoes=None, inicial=False):
+    """Padrões < arquivo JSON < sobreposições do admin, validados em bloco (tudo ou nada)
+    
+    Ajustes não recarregáveis só mudam na inicialização; depois disso uma mudança
+    neles é recusada com erro em vez de aplicada pela metade.
+    """
+    with _config_lock:
+        if inicial:
+            # Atribuições feitas em Config antes da inicialização (testes, embutidores) viram padrão
+            PADROES_CONFIG.update({nome: getattr(Config, nome) for nome in AJUSTES})
+            PADROES_CONFIG['PERIODOS'] = dict(Config.PERIODOS)
+        brutos = dict(PADROES_CONFIG)
+        caminho = Config.CONFIG_ARQUIVO
+        if caminho and os.path.exists(caminho):
+            try:
+                with open(caminho, encoding='utf-8') as f:
+                    brutos.update(json.load(f))
+            except Exception as e:
+                print(f"❌ Configuração ignorada ({caminho}): {e}")
+                return {'success': False, 'erros': [f'{caminho}: {e}'], 'alterados': {}}
+        novas_sobreposicoes = dict(ESTADO_CONFIG['sobreposicoes'], **(sobreposicoes or {}))
+        brutos.update(novas_sobreposicoes)
+        
+        valores, erros = validar_configuracao(brutos)
+        alterados = {nome: (getattr(Config, nome), valor) for nome, valor in valores.items()
+                     if getattr(Config, nome) != valor}
+        if not inicial:
+            erros.extend(f'{nome}: exige reinício' for nome in alterados if not AJUSTES[nome].recarregavel)
+        if erros:
+            print(f"❌ Configuração recusada: {'; '.join(erros)}")
+            return {'success': False, 'erros': erros, 'alterados': {}}
+        
+        for nome, (_, valor) in alterados.items():
+            if nome == 'PERIODOS':
+                Config.PERIODOS.clear()
+                Config.PERIODOS.update(valor)
+            else:
+                setattr(Config, nome, valor)
+        ESTADO_CONFIG['sobreposicoes'] = novas_sobreposicoes
+        ESTADO_CONFIG['arquivo'] = caminho if caminho and os.path.exists(caminho) else None
+        ESTADO_CONFIG['recarregado_em'] = datetime.now().isoformat(timespec='seconds')
+        if alterados:
+            ESTADO_CONFIG['geracao'] += 1
+    
+    if alterados and not inicial:
+        print(f"🔧 Configuração recarregada: {', '.join(alterados)}")
+        for ouvinte in list(_ouvintes_config):
+            try:
+                ouvinte(alterados)
+            except Exception as e:
+                print(f"⚠️ Erro em ouvinte de configuração: {e}")
+    return {'success': True, 'erros': [], 'alterados': {n: v[1] for n, v in alterados.items()}}
+
+def configuracao_atual():
+    """Valores efetivos dos ajustes (segredos mascarados) e estado da última recarga"""
+    return {
+        'valores': {nome: ('***' if nome == 'SECRET_KEY' else getattr(Config, nome)) for nome in AJUSTES},
+        'recarregaveis': sorted(nome for nome, a in AJUSTES.items() if a.recarregavel),
+        'arquivo': ESTADO_CONFIG['arquivo'],
+        'recarregado_em': ESTADO_CONFIG['recarregado_em'],
+        'geracao': ESTADO_CONFIG['geracao'],
+    }
+
+def instalar_recarga_por_sinal():
+    """kill -HUP <pid> relê o arquivo de configuração numa thread própria
+    
+    O handler só sinaliza um Event: recarregar_configuracao toma _config_lock (não
+    reentrante) e roda ouvintes que consultam o banco, o que travaria se o sinal
+    chegasse com a thread principal dentro de uma recarga.
+    """
+    if not hasattr(signal, 'SIGHUP'):
+        return False
+    pedido = threading.Event()
+    
+    def loop():
+        while True:
+            pedido.wait()
+            pedido.clear()
+            recarregar_configuracao()
+    
+    threading.Thread(target=loop, name='recarga-config', daemon=True).start()
+    signal.signal(signal.SIGHUP, lambda *_: pedido.set())
+    return True
+
+# ===== SNAPSHOT BINÁRIO (WARM START) =====
+METRICAS = ('vendas', 'despesas', 'lucro', 'crescimento', 'ticket_medio', 'clientes_ativos')
+
+# Métricas derivadas: gravadas junto com cada registro e expostas nos agregados de KPIs
+METRICAS_DERIVADAS = ('margem', 'razao_despesas', 'receita_por_cliente')
+
+# Métricas que somam entre dimensões no mesmo dia; as demais são médias (crescimento, ticket)
+METRICAS_ADITIVAS = ('vendas', 'despesas', 'lucro', 'clientes_ativos')
+
+# Métricas com índices sazonais (dia da semana, mês, feriado) mantidos na escrita
+METRICAS_SAZONAIS = ('vendas', 'lucro')
+
+def calcular_derivadas(vendas, despesas, lucro, clientes_ativos):
+    """(margem %, razão de despesas %, receita por cliente) — fórmula única para escrita e agregados"""
+    return (
+        (lucro / vendas * 100) if vendas > 0 else 0,
+        (despesas / vendas * 100) if vendas > 0 else 0,
+        vendas / clientes_ativos if clientes_ativos > 0 else 0,
+    )
+
+class SnapshotBinario:
+    """Colunas de métricas + somas prefixadas em arquivo mapeável (mmap) por versão de dados
+    
+    Layout (little-endian, blocos alinhados em 8 bytes):
+        cabeçalho | dias int64[n] | ids int64[n]
+        | por métrica: valores float64[n], somas float64[n+1], contagens int64[n+1]
+    Os dias são ordinais (date.toordinal) em ordem crescente, então qualquer janela
+    "data_registro >= limite" é um bisect + duas subtrações.
+    """
+    MAGICO = b'IPSB'
+    FORMATO = 1
+    CABECALHO = struct.Struct('<4sHHqq')
+    
+    def __init__(self, caminho, arquivo, mapa):
+        self.caminho = caminho
+        self._arquivo = arquivo
+        self._mapa = mapa
+        magico, formato, n_metricas, self.versao, self.n = self.CABECALHO.unpack_from(mapa, 0)
+        if magico != self.MAGICO or formato != self.FORMATO or n_metricas != len(METRICAS):
+            raise ValueError('snapshot incompatível')
+        
+        # Visões zero-copy sobre as páginas mapeadas (compartilhadas entre processos)
+        visao = self._visao = memoryview(mapa)
+        n = self.n
+        offset = self.CABECALHO.size
+        offset += -offset % 8
+        
+        def fatiar(tamanho, tipo):
+            nonlocal offset
+            bloco = visao[offset:offset + tamanho * 8].cast(tipo)
+            offset += tamanho * 8
+            return bloco
+        
+        self.dias = fatiar(n, 'q')
+        self.ids = fatiar(n, 'q')
+        self.valores = {}
+        self.somas = {}
+        self.contagens = {}
+        for metrica in METRICAS:
+            self.valores[metrica] = fatiar(n, 'd')
+            self.somas[metrica] = fatiar(n + 1, 'd')
+            self.contagens[metrica] = fatiar(n + 1, 'q')
+    
+    @classmethod
+    def abrir(cls, caminho):
+        """Mapeia um snapshot existente em modo somente leitura"""
+        arquivo = open(caminho, 'rb')
+        try:
+            mapa = mmap.mmap(arquivo.fileno(), 0, access=mmap.ACCESS_READ)
+            return cls(caminho, arquivo, mapa)
+        except Exception:
+            arquivo.close()
+            raise
+    
+    @classmethod
+    def gravar(cls, caminho, versao, linhas):
+        """Grava atomicamente um snapshot a partir de linhas (id, data_registro, *METRICAS)
+        
+        Linhas com data fora de AAAA-MM-DD não têm ordinal: ficam fora do snapshot (com aviso).
+        """
+        ignoradas = 0
+        dias = array('q')
+        ids = array('q')
+        valores = {m: array('d') for m in METRICAS}
+        somas = {m: array('d', [0.0]) for m in METRICAS}
+        contagens = {m: array('q', [0]) for m in METRICAS}
+        
+        for linha in sorted(linhas, key=lambda l: (l[1], l[0])):
+            try:
+                dia = datetime.strptime(linha[1], '%Y-%m-%d').toordinal()
+            except (TypeError, ValueError):
+                ignoradas += 1
+                continue
+            ids.append(linha[0])
+            dias.append(dia)
+            for metrica, valor in zip(METRICAS, linha[2:]):
+                valores[metrica].append(valor if valor is not None else 0.0)
+                somas[metrica].append(somas[metrica][-1] + (valor or 0.0))
+                contagens[metrica].append(contagens[metrica][-1] + (valor is not None))
+        
+        temporario = f"{caminho}.{os.getpid()}.tmp"
+        with open(temporario, 'wb') as f:
+            cabecalho = cls.CABECALHO.pack(cls.MAGICO, cls.FORMATO, len(METRICAS), versao, len(dias))
+            f.write(cabecalho + b'\0' * (-len(cabecalho) % 8))
+            f.write(dias.tobytes())
+            f.write(ids.tobytes())
+            for metrica in METRICAS:
+                f.write(valores[metrica].tobytes())
+                f.write(somas[metrica].tobytes())
+                f.write(contagens[metrica].tobytes())
+        # Leitores com o arquivo antigo mapeado continuam válidos após o replace
+        os.replace(temporario, caminho)
+        if ignoradas:
+            print(f"⚠️ {ignoradas} registros com data inválida fora do snapshot (versão {versao})")
+    
+    def kpis(self, data_limite):
+        """Médias das métricas com data_registro >= data_limite (mesma semântica do AVG)"""
+        inicio = bisect.bisect_left(self.dias, datetime.strptime(data_limite, '%Y-%m-%d').toordinal())
+        resultado = {}
+        for metrica in METRICAS:
+            contagem = self.contagens[metrica][self.n] - self.contagens[metrica][inicio]
+            soma = self.somas[metrica][self.n] - self.somas[metrica][inicio]
+            resultado[metrica] = soma / contagem if contagem else None
+        return resultado
+    
+    def fechar(self):
+        """Libera as visões e desfaz o mapeamento; o snapshot não pode mais ser lido"""
+        for visao in (self.dias, self.ids, *self.valores.values(), *self.somas.values(),
+                      *self.contagens.values(), self._visao):
+            visao.release()
+        self._mapa.close()
+        self._arquivo.close()
+
+# ===== INTERFACE DE ARMAZENAMENTO =====
+class ArmazenamentoBase(ABC):
+    """Contrato comum dos motores de armazenamento usados pelo app
+    
+    Implementações: DatabaseManager (arquivo SQLite), ArmazenamentoSQLiteMemoria
+    (SQLite :memory: com cache compartilhado) e ArmazenamentoMemoria (listas ordenadas).
+    Métodos abstratos: um motor incompleto falha ao ser instanciado, não no meio de uma requisição.
+    """
+    def __init__(self):
+        self._ouvintes = []
+        self.upsert_disponivel = False
+    
+    # --- Leitura ---
+    @abstractmethod
+    def get_versao_dados(self):
+        raise NotImplementedError
+    
+    @abstractmethod
+    def get_kpis(self, periodo='semana', dimensao=None):
+        raise NotImplementedError
+    
+    @abstractmethod
+    def get_historico(self, limite=None, dimensao=None):
+        raise NotImplementedError
+    
+    @abstractmethod
+    def get_dados_recentes(self, limite=None):
+        raise NotImplementedError
+    
+    @abstractmethod
+    def iterar_indicadores(self, inicio=None, fim=None, lote=None):
+        raise NotImplementedError
+    
+    # --- Escrita ---
+    @abstractmethod
+    def registrar_dados(self, vendas, despesas, lucro, crescimento, ticket_medio, clientes_ativos, data_registro,
+                        upsert=False, chave_idempotencia=None):
+        raise NotImplementedError
+    
+    @abstractmethod
+    def deletar_lote(self, ids=None, inicio=None, fim=None):
+        raise NotImplementedError
+    
+    @abstractmethod
+    def inserir_em_massa(self, lotes):
+        """Carga de lotes de tuplas (ordem de COLUNAS_INSERCAO); retorna a quantidade"""
+        raise NotImplementedError
+    
+    @abstractmethod
+    def get_dias_margem_abaixo(self, limite=10.0, inicio=None, fim=None):
+        """Registros com margem < limite (%), da menor para a maior margem"""
+        raise NotImplementedError
+    
+    @abstractmethod
+    def _ler_alteracoes(self, apos, limite):
+        """(entradas do log com seq > apos, menor seq ainda retido, ou o próximo seq se o
+        log foi esvaziado pela retenção; None se nunca houve entradas)"""
+        raise NotImplementedError
+    
+    @abstractmethod
+    def get_ultimo_seq(self):
+        """Maior seq já atribuído no log de alterações (0 se nunca houve entradas)"""
+        raise NotImplementedError
+    
+    @staticmethod
+    def _linha_sincronizacao(registro_id, data_registro, valores):
+        """Registro no formato enviado aos clientes: id, data, METRICAS e derivadas"""
+        linha = {'id': registro_id, 'data_registro': data_registro}
+        linha.update((m, valores.get(m)) for m in METRICAS)
+        linha.update(zip(METRICAS_DERIVADAS, calcular_derivadas(
+            linha['vendas'] or 0, linha['despesas'] or 0, linha['lucro'] or 0, linha['clientes_ativos'] or 0)))
+        return linha
+    
+    def _carga_sincronizacao(self):
+        """Carga inicial: todos os registros de uma janela de datas, com a marca d'água anterior à leitura
+        
+        A janela é de SYNC_JANELA_DIAS, encurtada para caber em ~SYNC_MAXIMO_LINHAS (dias
+        inteiros). Por ser definida por data, uma exclusão nunca puxa para dentro dela um
+        registro que o cliente não tem.
+        """
+        # Marca lida antes dos dados: alterações concorrentes são reenviadas, nunca perdidas
+        watermark = self.get_ultimo_seq()
+        janela_inicio = (date.today() - timedelta(days=Config.SYNC_JANELA_DIAS)).strftime('%Y-%m-%d')
+        recentes = self.get_dados_recentes(limite=Config.SYNC_MAXIMO_LINHAS)
+        if len(recentes) >= Config.SYNC_MAXIMO_LINHAS:
+            janela_inicio = max(janela_inicio, recentes[-1]['data_registro'])
+        colunas = list(COLUNAS_EXPORTACAO)
+        linhas = [self._linha_sincronizacao(linha[0], linha[colunas.index('data_registro')], dict(zip(colunas, linha)))
+                  for lote in self.iterar_indicadores(inicio=janela_inicio) for linha in lote]
+        return {'success': True, 'reiniciar': True, 'watermark': watermark, 'janela_inicio': janela_inicio,
+                'linhas': linhas, 'inseridos': [], 'atualizados': [], 'deletados': [],
+                'arquivado_ate': None, 'mais': False}
+    
+    def get_sincronizacao(self, desde=0, limite=500):
+        """Delta para clientes com espelho local: o que mudou depois da marca d'água `desde`
+        
+        As entradas do log são compactadas por registro (vale o último estado): inserido e
+        excluído na mesma página some da resposta. desde=0, log já podado (retenção) ou
+        carga em massa no intervalo devolvem reiniciar=True com uma nova carga inicial.
+        """
+        if desde <= 0:
+            return self._carga_sincronizacao()
+        pagina = self.get_alteracoes(desde, limite)
+        if pagina['reiniciar'] or any(e['operacao'] == 'carga_em_massa' for e in pagina['alteracoes']):
+            return self._carga_sincronizacao()
+        
+        estados = {}
+        novos = set()
+        arquivado_ate = None
+        for entrada in pagina['alteracoes']:
+            operacao, registro_id = entrada['operacao'], entrada['registro_id']
+            if operacao == 'arquivado':
+                arquivado_ate = max(arquivado_ate or '', entrada['dados']['fim'])
+            elif operacao in ('inserido', 'atualizado'):
+                if operacao == 'inserido':
+                    novos.add(registro_id)
+                estados[registro_id] = self._linha_sincronizacao(registro_id, entrada['data_registro'], entrada['dados'])
+            elif operacao == 'deletado':
+                if registro_id in novos:
+                    novos.discard(registro_id)
+                    estados.pop(registro_id, None)
+                else:
+                    estados[registro_id] = None
+        
+        return {
+            'success': True,
+            'reiniciar': False,
+            'watermark': pagina['ultimo_seq'],
+            'inseridos': [linha for i, linha in estados.items() if linha and i in novos],
+            'atualizados': [linha for i, linha in estados.items() if linha and i not in novos],
+            'deletados': [i for i, linha in estados.items() if linha is None],
+            'arquivado_ate': arquivado_ate,
+            'mais': pagina['mais'],
+        }
+    
+    def get_indices_sazonais(self):
+        """{metrica: {'dia_semana'|'mes'|'feriado': {chave: índice}}} ou None se indisponível"""
+        return None
+    
+    def aplicar_retencao(self, meses=None):
+        """Move registros brutos antigos para resumos/arquivo; retorna linhas movidas ou -1"""
+        return 0
+    
+    def get_resumo(self, granularidade='mes', inicio=None, fim=None):
+        """Série semanal/mensal cobrindo resumos arquivados e a tabela quente"""
+        return []
+    
+    def consultar_arquivo(self, inicio=None, fim=None, lote=None):
+        """Lotes de linhas arquivadas (COLUNAS_EXPORTACAO) entre inicio e fim"""
+        return iter(())
+    
+    # --- Manutenção (opcional por motor) ---
+    def garantir_inicializado(self):
+        pass
+    
+    def iniciar_compactacao(self, intervalo=None):
+        pass
+    
+    def iniciar_manutencao(self, intervalo=None):
+        pass
+    
+    def status_manutencao(self):
+        return {}
+    
+    def status_esquema(self):
+        return {'versao': None, 'pendentes': []}
+    
+    def fechar(self):
+        """Libera conexões e arquivos abertos (motores temporários de benchmarks)"""
+        pass
+    
+    def caminho_leitura_externa(self):
+        """Arquivo que outro processo pode abrir somente leitura, ou None (motores em memória)"""
+        return None
+    
+    # --- Modelo dimensional (fatos por data × dimensão × métrica; opcional por motor) ---
+    def get_versao_fatos(self):
+        return None
+    
+    def registrar_fatos(self, fatos):
+        print(f"⚠️ Modelo dimensional indisponível em {type(self).__name__}")
+        return -1
+    
+    def listar_dimensoes(self, tipo=None):
+        return []
+    
+    def agregar_fatos(self, metrica, agrupar_por, inicio=None, fim=None, granularidade='total'):
+        return []
+    
+    def get_kpis_dimensao(self, periodo, dimensao):
+        print(f"⚠️ Modelo dimensional indisponível em {type(self).__name__}")
+        return self._formatar_kpis([None] * len(METRICAS))
+    
+    def get_historico_dimensao(self, limite, dimensao):
+        return []
+    
+    # --- Comum a todos os motores ---
+    def registrar_ouvinte(self, ouvinte):
+        """Registra callback ouvinte(evento, linhas) chamado após cada escrita confirmada"""
+        self._ouvintes.append(ouvinte)
+    
+    def _notificar(self, evento, linhas):
+        for ouvinte in list(self._ouvintes):
+            try:
+                ouvinte(evento, linhas)
+            except Exception as e:
+                print(f"⚠️ Erro em ouvinte de {evento}: {e}")
+    
+    @staticmethod
+    def _entrada_log(operacao, linha):
+        """Linha (id, data_registro, *METRICAS) -> (operacao, registro_id, data_registro, dados JSON)"""
+        return (operacao, linha[0], linha[1], json.dumps(dict(zip(METRICAS, linha[2:]))))
+    
+    def get_alteracoes(self, apos=0, limite=500):
+        """Página do feed de alterações após `apos` (seq exclusivo)
+        
+        reiniciar=True indica que entradas entre `apos` e o início do log já foram
+        descartadas pela retenção: o consumidor deve recarregar tudo (ex.: exportação)
+        e voltar a seguir o feed a partir de ultimo_seq.
+        """
+        entradas, seq_minimo = self._ler_alteracoes(apos, limite + 1)
+        mais = len(entradas) > limite
+        entradas = entradas[:limite]
+        return {
+            'alteracoes': entradas,
+            'ultimo_seq': entradas[-1]['seq'] if entradas else apos,
+            'mais': mais,
+            'reiniciar': seq_minimo is not None and apos + 1 < seq_minimo,
+        }
+    
+    def _data_limite(self, periodo):
+        # Mapear período para dias
+        dias = PERIODOS.get(periodo, 7)
+        return (datetime.now() - timedelta(days=dias)).strftime('%Y-%m-%d')
+    
+    def inserir_dados(self, vendas, despesas, lucro, crescimento, ticket_medio, clientes_ativos, data_registro,
+                      upsert=False, chave_idempotencia=None):
+        """Insere novos dados no banco"""
+        status, _ = self.registrar_dados(
+            vendas, despesas, lucro, crescimento, ticket_medio, clientes_ativos, data_registro,
+            upsert=upsert, chave_idempotencia=chave_idempotencia
+        )
+        return status in ('inserido', 'atualizado', 'repetido')
+    
+    def deletar_dados(self, id):
+        """Remove dados específicos pelo ID"""
+        removidos = self.deletar_lote(ids=[id])
+        if removidos > 0:
+            print(f"✅ Dados ID {id} removidos com sucesso")
+            return True
+        elif removidos == 0:
+            print(f"⚠️ Nenhum dado encontrado com ID {id}")
+        return False
+    
+    def _formatar_kpis(self, row):
+        kpis = {
+            'vendas': round(row[0] or 0, 2),
+            'despesas': round(row[1] or 0, 2),
+            'lucro': round(row[2] or 0, 2),
+            'crescimento': round(row[3] or 0, 2),
+            'ticket_medio': round(row[4] or 0, 2),
+            'clientes_ativos': int(row[5] or 0)
+        }
+        # Derivadas do período calculadas uma vez aqui (razão dos totais, não média das razões)
+        kpis.update(zip(METRICAS_DERIVADAS, calcular_derivadas(
+            kpis['vendas'], kpis['despesas'], kpis['lucro'], kpis['clientes_ativos'])))
+        return kpis
+    
+    def get_kpis_fallback(self):
+        """KPIs de fallback em caso de erro"""
+        return {
+            'vendas': 12500.0,
+            'despesas': 8200.0,
+            'lucro': 4300.0,
+            'crescimento': 2.5,
+            'ticket_medio': 185.0,
+            'clientes_ativos': 145
+        }
+
+# ===== MIGRAÇÕES DE ESQUEMA =====
+class Migracao:
+    """Passo versionado do esquema
+    
+    aplicar(cursor): DDL curta, executada uma vez na transação de inicialização.
+    lote(cursor, tamanho) -> linhas processadas: backfill repetido em transações
+    pequenas até retornar menos que `tamanho`; deve ser retomável (ex.: WHERE col IS NULL).
+    Uma migração usa um dos dois; ADD COLUMN + backfill são duas migrações.
+    A DDL logo após um backfill pendente roda depois dele (ex.: índice sobre a coluna
+    preenchida); as demais DDLs sempre rodam na inicialização, mesmo com backfill pendente.
+    """
+    __slots__ = ('versao', 'descricao', 'aplicar', 'lote')
+    
+    def __init__(self, versao, descricao, aplicar=None, lote=None):
+        self.versao = versao
+        self.descricao = descricao
+        self.aplicar = aplicar
+        self.lote = lote
+
+def _migracao_esquema_inicial(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS indicadores (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            vendas REAL NOT NULL DEFAULT 0,
+            despesas REAL NOT NULL DEFAULT 0,
+            lucro REAL NOT NULL DEFAULT 0,
+            crescimento REAL NOT NULL DEFAULT 0,
+            ticket_medio REAL DEFAULT 0,
+            clientes_ativos INTEGER DEFAULT 0,
+            data_registro TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            deletado_em TIMESTAMP
+        )
+    ''')
+    # Bancos anteriores ao versionamento podem não ter a coluna de tombstone
+    colunas = {linha[1] for linha in cursor.execute('PRAGMA table_info(indicadores)')}
+    if 'deletado_em' not in colunas:
+        cursor.execute('ALTER TABLE indicadores ADD COLUMN deletado_em TIMESTAMP')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_indicadores_data
+        ON indicadores(data_registro) WHERE deletado_em IS NULL
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_indicadores_tombstones
+        ON indicadores(deletado_em) WHERE deletado_em IS NOT NULL
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS metadados (
+            chave TEXT PRIMARY KEY,
+            valor INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO metadados (chave, valor) VALUES ('versao_dados', 0)")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chaves_idempotencia (
+            chave TEXT PRIMARY KEY,
+            hash_payload TEXT NOT NULL,
+            registro_id INTEGER,
+            criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _migracao_colunas_derivadas(cursor):
+    colunas = {linha[1] for linha in cursor.execute('PRAGMA table_info(indicadores)')}
+    for coluna in METRICAS_DERIVADAS:
+        if coluna not in colunas:
+            cursor.execute(f'ALTER TABLE indicadores ADD COLUMN {coluna} REAL')
+
+def _migracao_backfill_derivadas(cursor, tamanho):
+    # Avança por faixas de id (cursor salvo em metadados) para não reler linhas já preenchidas
+    linha = cursor.execute("SELECT valor FROM metadados WHERE chave = 'backfill_derivadas'").fetchone()
+    ultimo_id = linha[0] if linha else 0
+    ids = cursor.execute('SELECT id FROM indicadores WHERE id > ? ORDER BY id LIMIT ?',
+                         (ultimo_id, tamanho)).fetchall()
+    if ids:
+        cursor.execute('''
+            UPDATE indicadores SET
+                margem = CASE WHEN vendas > 0 THEN lucro / vendas * 100 ELSE 0 END,
+                razao_despesas = CASE WHEN vendas > 0 THEN despesas / vendas * 100 ELSE 0 END,
+                receita_por_cliente = CASE WHEN clientes_ativos > 0 THEN vendas / clientes_ativos ELSE 0 END
+            WHERE id > ? AND id <= ? AND margem IS NULL
+        ''', (ultimo_id, ids[-1][0]))
+    if len(ids) < tamanho:
+        cursor.execute("DELETE FROM metadados WHERE chave = 'backfill_derivadas'")
+    else:
+        cursor.execute("INSERT OR REPLACE INTO metadados (chave, valor) VALUES ('backfill_derivadas', ?)",
+                       (ids[-1][0],))
+    return len(ids)
+
+def _migracao_indice_margem(cursor):
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_indicadores_margem
+        ON indicadores(margem) WHERE deletado_em IS NULL
+    ''')
+
+def _migracao_modelo_dimensional(cursor):
+    # Dimensão genérica (tipo: produto, canal, regiao...) com um nível de hierarquia via pai_id
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS dimensoes (
+            id INTEGER PRIMARY KEY,
+            tipo TEXT NOT NULL,
+            nome TEXT NOT NULL,
+            pai_id INTEGER REFERENCES dimensoes(id),
+            UNIQUE (tipo, nome)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_dimensoes_pai
+        ON dimensoes(pai_id) WHERE pai_id IS NOT NULL
+    ''')
+    # Chave (dimensão, métrica, data): série de uma dimensão é uma varredura de faixa na PK
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fatos (
+            dimensao_id INTEGER NOT NULL REFERENCES dimensoes(id),
+            metrica TEXT NOT NULL,
+            data_registro TEXT NOT NULL,
+            valor REAL NOT NULL,
+            PRIMARY KEY (dimensao_id, metrica, data_registro)
+        ) WITHOUT ROWID
+    ''')
+    # Índice de cobertura para agrupamentos de uma métrica entre todas as dimensões
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_fatos_metrica_data
+        ON fatos(metrica, data_registro, dimensao_id, valor)
+    ''')
+    # Rollup mensal mantido na mesma transação da escrita dos fatos
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fatos_mensais (
+            dimensao_id INTEGER NOT NULL,
+            metrica TEXT NOT NULL,
+            mes TEXT NOT NULL,
+            soma REAL NOT NULL,
+            contagem INTEGER NOT NULL,
+            PRIMARY KEY (dimensao_id, metrica, mes)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO metadados (chave, valor) VALUES ('versao_fatos', 0)")
+
+def _migracao_log_alteracoes(cursor):
+    # AUTOINCREMENT: seq nunca é reutilizado, mesmo após a retenção apagar o início do log
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS log_alteracoes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            operacao TEXT NOT NULL,
+            registro_id INTEGER,
+            data_registro TEXT,
+            dados TEXT NOT NULL,
+            criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def carregar_feriados(caminho=None):
+    """{'MM-DD' ou 'AAAA-MM-DD': nome} a partir do CSV local; arquivo ausente = sem feriados"""
+    caminho = caminho or Config.FERIADOS_ARQUIVO
+    if not caminho or not os.path.exists(caminho):
+        return {}
+    try:
+        with open(caminho, encoding='utf-8') as f:
+            return {linha['data'].strip(): linha['nome'].strip() for linha in csv.DictReader(f) if linha.get('data')}
+    except Exception as e:
+        print(f"⚠️ Feriados ignorados ({caminho}): {e}")
+        return {}
+
+def linha_calendario(data_registro, feriados):
+    """(data, dia_semana 0=segunda, semana ISO, mês, ano, feriado ou None)"""
+    dia = datetime.strptime(data_registro, '%Y-%m-%d').date()
+    feriado = feriados.get(data_registro) or feriados.get(data_registro[5:])
+    return (data_registro, dia.weekday(), dia.isocalendar()[1], dia.month, dia.year, feriado)
+
+def linhas_calendario(datas, feriados):
+    """linha_calendario de cada data; datas fora de AAAA-MM-DD ficam sem sazonalidade"""
+    linhas = []
+    for data in datas:
+        try:
+            linhas.append(linha_calendario(data, feriados))
+        except (TypeError, ValueError):
+            continue
+    return linhas
+
+def reconstruir_sazonalidade(cursor):
+    """Recalcula indices_sazonais do zero (migração e troca do arquivo de feriados)
+    
+    Dias já retirados pela retenção entram pelos resumos diários, com a mesma soma e
+    contagem que tinham na tabela quente.
+    """
+    cursor.execute('DELETE FROM indices_sazonais')
+    for metrica in METRICAS_SAZONAIS:
+        for tipo, expressao in (('dia_semana', 'c.dia_semana'), ('mes', 'c.mes'),
+                                ('feriado', 'c.feriado IS NOT NULL')):
+            cursor.execute(f'''
+                INSERT INTO indices_sazonais (tipo, chave, metrica, soma, contagem)
+                SELECT ?, {expressao}, ?, SUM(i.soma), SUM(i.contagem)
+                FROM (
+                    SELECT data_registro AS data, {metrica} AS soma, 1 AS contagem
+                    FROM indicadores WHERE deletado_em IS NULL
+                    UNION ALL
+                    SELECT inicio, {metrica}, registros
+                    FROM indicadores_resumo WHERE granularidade = 'dia'
+                ) i JOIN calendario c ON c.data = i.data
+                GROUP BY {expressao}
+            ''', (tipo, metrica))
+
+def _migracao_calendario(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS calendario (
+            data TEXT PRIMARY KEY,
+            dia_semana INTEGER NOT NULL,
+            semana_ano INTEGER NOT NULL,
+            mes INTEGER NOT NULL,
+            ano INTEGER NOT NULL,
+            feriado TEXT
+        ) WITHOUT ROWID
+    ''')
+    # Somas/contagens por chave sazonal: índice = média da chave / média geral
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS indices_sazonais (
+            tipo TEXT NOT NULL,
+            chave INTEGER NOT NULL,
+            metrica TEXT NOT NULL,
+            soma REAL NOT NULL DEFAULT 0,
+            contagem INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (tipo, chave, metrica)
+        ) WITHOUT ROWID
+    ''')
+
+def _migracao_backfill_calendario(cursor, tamanho):
+    # Mesmo esquema de cursor por id do backfill de derivadas; INSERT OR IGNORE torna o lote retomável
+    linha = cursor.execute("SELECT valor FROM metadados WHERE chave = 'backfill_calendario'").fetchone()
+    ultimo_id = linha[0] if linha else 0
+    linhas = cursor.execute('SELECT id, data_registro FROM indicadores WHERE id > ? ORDER BY id LIMIT ?',
+                            (ultimo_id, tamanho)).fetchall()
+    cursor.executemany('INSERT OR IGNORE INTO calendario VALUES (?, ?, ?, ?, ?, ?)',
+                       linhas_calendario({data for _, data in linhas}, carregar_feriados()))
+    if len(linhas) < tamanho:
+        cursor.execute("DELETE FROM metadados WHERE chave = 'backfill_calendario'")
+    else:
+        cursor.execute("INSERT OR REPLACE INTO metadados (chave, valor) VALUES ('backfill_calendario', ?)",
+                       (linhas[-1][0],))
+    return len(linhas)
+
+def _migracao_resumos(cursor):
+    # Somas por semana (segunda-feira) ou mês (dia 1) dos registros que saíram da tabela quente;
+    # crescimento e ticket_medio também são somas: média = soma / registros na leitura
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS indicadores_resumo (
+            granularidade TEXT NOT NULL,
+            inicio TEXT NOT NULL,
+            registros INTEGER NOT NULL DEFAULT 0,
+            {', '.join(f'{m} REAL NOT NULL DEFAULT 0' for m in METRICAS)},
+            PRIMARY KEY (granularidade, inicio)
+        ) WITHOUT ROWID
+    ''')
+
+# Ordem crescente de versão; nunca editar uma migração já publicada, só acrescentar
+MIGRACOES = [
+    Migracao(1, 'esquema inicial', aplicar=_migracao_esquema_inicial),
+    Migracao(2, 'colunas de métricas derivadas', aplicar=_migracao_colunas_derivadas),
+    Migracao(3, 'backfill de métricas derivadas', lote=_migracao_backfill_derivadas),
+    Migracao(4, 'índice de margem', aplicar=_migracao_indice_margem),
+    Migracao(5, 'modelo dimensional (dimensoes, fatos, fatos_mensais)', aplicar=_migracao_modelo_dimensional),
+    Migracao(6, 'log de alterações', aplicar=_migracao_log_alteracoes),
+    Migracao(7, 'calendário e índices sazonais', aplicar=_migracao_calendario),
+    Migracao(8, 'resumos semanais e mensais (retenção)', aplicar=_migracao_resumos),
+    Migracao(9, 'backfill do calendário', lote=_migracao_backfill_calendario),
+    Migracao(10, 'recálculo dos índices sazonais', aplicar=reconstruir_sazonalidade),
+]
+
+# Início de cada período de resumo a partir de data_registro (semana começa na segunda);
+# os diários ficam para sempre e mantêm a sazonalidade reconstruível após a retenção
+GRANULARIDADES_RESUMO = {
+    'dia': 'data_registro',
+    'semana': "date(data_registro, 'weekday 0', '-6 days')",
+    'mes': "strftime('%Y-%m-01', data_registro)",
+}
+
+def mes_de_corte(meses, hoje=None):
+    """Primeiro dia do mês `meses` meses antes do mês atual (AAAA-MM-DD)"""
+    hoje = hoje or date.today()
+    indice = hoje.year * 12 + hoje.month - 1 - meses
+    return date(indice // 12, indice % 12 + 1, 1).isoformat()
 
 # ===== GERENCIAMENTO DE BANCO PORTÁVEL =====
-class DatabaseManager:
-    def __init__(self, db_path=None):
+class DatabaseManager(ArmazenamentoBase):
+    def __init__(self, db_path=None, adiar_inicializacao=False):
+        super().__init__()
         self.db_path = db_path or Config.DB_PATH
-        self.inicializar_db()
+        self._uri = False
+        self.snapshot_path = f"{self.db_path}.snapshot"
+        self._snapshot = None
+        # Substituído na troca anterior (fechado só na próxima: leitores em curso terminam) e
+        # versão cuja reconstrução falhou (não repete a varredura até os dados mudarem)
+        self._snapshot_aposentado = None
+        self._snapshot_falha = None
+        self._snapshot_lock = threading.Lock()
+        self._pronto = threading.Event()
+        self._init_lock = threading.Lock()
+        self._thread_inicializando = None
+        # Um único escritor por processo; leituras usam conexões próprias somente leitura
+        self._conn_escrita = None
+        self._escrita_lock = threading.Lock()
+        self._geracao_pragmas = None
+        self._manutencao = {'execucoes': 0, 'erros': 0, 'ultima': None, 'ultimo_analyze': None, 'ultimo_resultado': None}
+        self.replica_path = Config.REPLICA_LEITURA
+        self.arquivo_dir = Config.ARQUIVO_DIR or os.path.join(os.path.dirname(os.path.abspath(self.db_path)), 'arquivo')
+        self._thread_migracoes = None
+        self._feriados = None
+        self._datas_calendario = set()
+        self._sazonalidade = (None, None)
+        if not adiar_inicializacao:
+            self.garantir_inicializado()
+    
+    def garantir_inicializado(self):
+        """Cria o schema e mapeia o snapshot uma única vez (imediato ou no primeiro uso)"""
+        if self._pronto.is_set() or self._thread_inicializando == threading.get_ident():
+            return
+        with self._init_lock:
+            if self._pronto.is_set():
+                return
+            self._thread_inicializando = threading.get_ident()
+            try:
+                with MEDIDOR_INICIO.etapa('banco:inicializar_db'):
+                    self.inicializar_db()
+                if self.replica_path:
+                    with MEDIDOR_INICIO.etapa('banco:replica'):
+                        self.atualizar_replica()
+                    threading.Thread(target=self._loop_replica, name='replica-leitura', daemon=True).start()
+                with MEDIDOR_INICIO.etapa('banco:carregar_snapshot'):
+                    self.carregar_snapshot()
+            finally:
+                self._thread_inicializando = None
+                self._pronto.set()
     
     def conectar(self):
         """Conexão robusta com tratamento de erros"""
+        self.garantir_inicializado()
         try:
-            conn = sqlite3.connect(self.db_path, timeout=30.0)
+            conn = sqlite3.connect(self.db_path, timeout=Config.SQLITE_TIMEOUT, uri=self._uri)
+            # Só tem efeito em bancos novos; permite incremental_vacuum na compactação
+            conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
             conn.execute('PRAGMA journal_mode=WAL')  # Melhor performance
+            self._aplicar_pragmas(conn)
             return conn
         except Exception as e:
             print(f"❌ Erro na conexão: {e}")
             return None
     
+    def conectar_leitura(self):
+        """Conexão somente leitura (mode=ro + query_only) no banco ou na réplica"""
+        self.garantir_inicializado()
+        caminho = self.replica_path if self.replica_path and os.path.exists(self.replica_path) else self.db_path
+        try:
+            conn = sqlite3.connect(f"file:{quote(caminho)}?mode=ro", uri=True, timeout=Config.SQLITE_TIMEOUT)
+            conn.execute('PRAGMA query_only=1')
+            self._aplicar_pragmas(conn)
+            return conn
+        except Exception as e:
+            print(f"❌ Erro na conexão de leitura: {e}")
+            return None
+    
+    @staticmethod
+    def pragmas_efetivos():
+        """Perfil Config.PERFIL_PRAGMA com as sobreposições Config.PRAGMA_* aplicadas"""
+        pragmas = dict(PERFIS_PRAGMA.get(Config.PERFIL_PRAGMA, PERFIS_PRAGMA['equilibrado']))
+        for nome in ('cache_size', 'mmap_size', 'synchronous'):
+            valor = getattr(Config, f'PRAGMA_{nome.upper()}')
+            if valor is not None:
+                pragmas[nome] = valor
+        return pragmas
+    
+    @classmethod
+    def _aplicar_pragmas(cls, conn):
+        """PRAGMAs de desempenho por conexão (não persistem no arquivo)"""
+        pragmas = cls.pragmas_efetivos()
+        # Negativo = KiB em vez de páginas
+        conn.execute(f"PRAGMA cache_size=-{pragmas['cache_size']}")
+        conn.execute(f"PRAGMA mmap_size={pragmas['mmap_size']}")
+        conn.execute(f"PRAGMA synchronous={pragmas['synchronous']}")
+        conn.execute(f"PRAGMA temp_store={pragmas['temp_store']}")
+        conn.execute(f"PRAGMA wal_autocheckpoint={pragmas['wal_autocheckpoint']}")
+    
+    @contextmanager
+    def escrita(self):
+        """Transação no conector de escrita único do processo (commit/rollback automático)"""
+        self.garantir_inicializado()
+        with self._escrita_lock:
+            if self._conn_escrita is None:
+                conn = sqlite3.connect(self.db_path, timeout=Config.SQLITE_TIMEOUT,
+                                       check_same_thread=False, uri=self._uri)
+                conn.execute('PRAGMA journal_mode=WAL')
+                self._conn_escrita = conn
+                self._geracao_pragmas = None
+            conn = self._conn_escrita
+            if self._geracao_pragmas != ESTADO_CONFIG['geracao']:
+                # Conexão persistente: PRAGMAs recarregados valem a partir da próxima transação
+                self._aplicar_pragmas(conn)
+                self._geracao_pragmas = ESTADO_CONFIG['geracao']
+            try:
+                yield conn.cursor()
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                # Linhas do calendário inseridas nesta transação não existem mais
+                self._datas_calendario = set()
+                raise
+    
+    def atualizar_replica(self):
+        """Copia o banco para a réplica via backup API, em passos que não travam o escritor"""
+        origem = self.conectar()
+        if not origem:
+            return False
+        
+        temporario = f"{self.replica_path}.{os.getpid()}.tmp"
+        try:
+            destino = sqlite3.connect(temporario)
+            try:
+                origem.backup(destino, pages=1024)
+                destino.execute('PRAGMA journal_mode=DELETE')
+            finally:
+                destino.close()
+            # Leitores com a réplica anterior aberta continuam no arquivo antigo
+            os.replace(temporario, self.replica_path)
+            return True
+        except Exception as e:
+            print(f"❌ Erro ao atualizar réplica: {e}")
+            if os.path.exists(temporario):
+                os.remove(temporario)
+            return False
+        finally:
+            origem.close()
+    
+    def _loop_replica(self):
+        while True:
+            time.sleep(Config.REPLICA_INTERVALO)
+            self.atualizar_replica()
+    
     def inicializar_db(self):
         """Inicializa banco com dados de exemplo se necessário"""
         conn = self.conectar()
         if not conn:
             return
         
+        pendentes = []
         try:
             cursor = conn.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS indicadores (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    vendas REAL NOT NULL DEFAULT 0,
-                    despesas REAL NOT NULL DEFAULT 0,
-                    lucro REAL NOT NULL DEFAULT 0,
-                    crescimento REAL NOT NULL DEFAULT 0,
-                    ticket_medio REAL DEFAULT 0,
-                    clientes_ativos INTEGER DEFAULT 0,
-                    data_registro TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
+            pendentes = self.migrar(cursor)
+            
+            # Upsert diário exige índice único; falha se já houver dias duplicados
+            if Config.UPSERT_DIARIO:
+                try:
+                    cursor.execute('''
+                        CREATE UNIQUE INDEX IF NOT EXISTS ux_indicadores_dia
+                        ON indicadores(data_registro) WHERE deletado_em IS NULL
+                    ''')
+                except sqlite3.IntegrityError:
+                    print("⚠️ Upsert diário desativado: existem datas duplicadas em indicadores")
+            else:
+                # Índice de uma execução anterior com o flag ligado recusaria inserções comuns no mesmo dia
+                cursor.execute('DROP INDEX IF EXISTS ux_indicadores_dia')
+            self.upsert_disponivel = cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'ux_indicadores_dia'"
+            ).fetchone() is not None
             
             # Inserir dados de exemplo apenas se tabela estiver vazia
             if cursor.execute('SELECT COUNT(*) FROM indicadores').fetchone()[0] == 0:
                 self.popular_dados_exemplo(cursor)
+                self._incrementar_versao(cursor)
             
             conn.commit()
             print("✅ Banco de dados inicializado com sucesso")
         except Exception as e:
             print(f"❌ Erro ao inicializar BD: {e}")
+            self._datas_calendario = set()
+            pendentes = []
         finally:
             conn.close()
-    
-    def popular_dados_exemplo(self, cursor):
-        """Popula dados de exemplo para demonstração"""
-        print("📊 Gerando dados de exemplo...")
-        datas = [(datetime.now() - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(30, 0, -1)]
         
-        for i, data in enumerate(datas):
-            vendas = max(8000 + i*200 + random.randint(-1000, 1500), 1000)
-            despesas = max(vendas * 0.6 + random.randint(-500, 800), 500)
-            lucro = vendas - despesas
-            crescimento = (i/10) - 1.5 + random.uniform(-2, 2)
-            ticket_medio = 120 + i*1.5 + random.randint(-20, 30)
-            clientes_ativos = max(80 + i*2 + random.randint(-10, 15), 20)
-            
-            cursor.execute('''
-                INSERT INTO indicadores 
-                (vendas, despesas, lucro, crescimento, ticket_medio, clientes_ativos, data_registro)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (vendas, despesas, lucro, crescimento, ticket_medio, clientes_ativos, data))
+        # Backfills rodam depois da inicialização, com o banco já servindo leituras
+        if pendentes:
+            self._thread_migracoes = threading.Thread(target=self.migrar_em_lotes, args=(pendentes,),
+                                                      name='migracoes-lote', daemon=True)
+            self._thread_migracoes.start()
     
-    def get_kpis(self, periodo='semana'):
-        """Obtém KPIs do período especificado"""
-        conn = self.conectar()
+    def _versao_esquema(self, cursor):
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS versao_esquema (
+                versao INTEGER PRIMARY KEY,
+                descricao TEXT NOT NULL,
+                aplicada_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        return {linha[0] for linha in cursor.execute('SELECT versao FROM versao_esquema')}
+    
+    def _registrar_migracao(self, cursor, migracao):
+        cursor.execute('INSERT INTO versao_esquema (versao, descricao) VALUES (?, ?)',
+                       (migracao.versao, migracao.descricao))
+        print(f"🧱 Migração {migracao.versao} aplicada: {migracao.descricao}")
+    
+    def migrar(self, cursor):
+        """Aplica em ordem as DDLs curtas e retorna as migrações de segundo plano pendentes"""
+        aplicadas = self._versao_esquema(cursor)
+        adiadas = []
+        for anterior, migracao in zip([None] + MIGRACOES, MIGRACOES):
+            if migracao.versao in aplicadas:
+                continue
+            # Backfill, ou DDL que depende do backfill imediatamente anterior ainda pendente
+            if migracao.lote or (adiadas and adiadas[-1] is anterior and anterior.lote):
+                adiadas.append(migracao)
+                continue
+            migracao.aplicar(cursor)
+            self._registrar_migracao(cursor, migracao)
+        return adiadas
+    
+    def migrar_em_lotes(self, pendentes, tamanho=None, pausa=None):
+        """Executa as migrações restantes; cada lote é uma transação curta no escritor"""
+        tamanho = tamanho or Config.MIGRACAO_LOTE
+        pausa = Config.MIGRACAO_PAUSA if pausa is None else pausa
+        try:
+            for migracao in pendentes:
+                if migracao.aplicar:
+                    with self.escrita() as cursor:
+                        migracao.aplicar(cursor)
+                        self._registrar_migracao(cursor, migracao)
+                    continue
+                
+                while True:
+                    with self.escrita() as cursor:
+                        processadas = migracao.lote(cursor, tamanho)
+                        if processadas < tamanho:
+                            self._registrar_migracao(cursor, migracao)
+                            break
+                    time.sleep(pausa)
+            return True
+        except Exception as e:
+            print(f"❌ Erro em migração em lotes (retomada no próximo início): {e}")
+            return False
+    
+    def status_esquema(self):
+        """Versão aplicada e migrações ainda pendentes"""
+        conn = self.conectar_leitura()
         if not conn:
-            return self.get_kpis_fallback()
+            return super().status_esquema()
         
         try:
-            cursor = conn.cursor()
-            
-            # Mapear período para dias
-            dias_map = {'dia': 1, 'semana': 7, 'mes': 30, 'trimestre': 90}
-            dias = dias_map.get(periodo, 7)
-            
-            data_limite = (datetime.now() - timedelta(days=dias)).strftime('%Y-%m-%d')
-            
-            cursor.execute('''
-                SELECT 
-                    AVG(vendas) as vendas,
-                    AVG(despesas) as despesas,
-                    AVG(lucro) as lucro,
-                    AVG(crescimento) as crescimento,
-                    AVG(ticket_medio) as ticket_medio,
-                    AVG(clientes_ativos) as clientes_ativos
-                FROM indicadores 
-                WHERE data_registro >= ?
-            ''', (data_limite,))
-            
-            row = cursor.fetchone()
+            aplicadas = {linha[0] for linha in conn.execute('SELECT versao FROM versao_esquema')}
             return {
-                'vendas': round(row[0] or 0, 2),
-                'despesas': round(row[1] or 0, 2),
-                'lucro': round(row[2] or 0, 2),
-                'crescimento': round(row[3] or 0, 2),
-                'ticket_medio': round(row[4] or 0, 2),
-                'clientes_ativos': int(row[5] or 0)
+                'versao': max(aplicadas, default=0),
+                'pendentes': [{'versao': m.versao, 'descricao': m.descricao}
+                              for m in MIGRACOES if m.versao not in aplicadas]
             }
         except Exception as e:
-            print(f"❌ Erro ao obter KPIs: {e}")
-            return self.get_kpis_fallback()
+            print(f"❌ Erro ao obter status do esquema: {e}")
+            return super().status_esquema()
         finally:
             conn.close()
     
-    def get_kpis_fallback(self):
-        """KPIs de fallback em caso de erro"""
-        return {
-            'vendas': 12500.0,
-            'despesas': 8200.0,
-            'lucro': 4300.0,
-            'crescimento': 2.5,
-            'ticket_medio': 185.0,
-            'clientes_ativos': 145
-        }
+    def popular_dados_exemplo(self, cursor):
+        """Popula dados de exemplo para demonstração"""
+        print("📊 Gerando dados de exemplo...")
+        gerador = GeradorDados(inicio=date.today() - timedelta(days=30), tendencia=0.025)
+        id_anterior = self._seq_autoincremento(cursor, 'indicadores')
+        for lote in gerador.lotes(30):
+            cursor.executemany(SQL_INSERIR_INDICADOR, map(com_derivadas, lote))
+            self._acumular_sazonalidade(cursor, self._entradas_sazonais(lote))
+        cursor.execute(SQL_REGISTRAR_ALTERACAO, ('carga_em_massa', None, None, json.dumps({
+            'id_inicial': id_anterior + 1, 'id_final': self._seq_autoincremento(cursor, 'indicadores'), 'linhas': 30})))
+    
+    @staticmethod
+    def _seq_autoincremento(cursor, tabela):
+        """Último id já entregue por AUTOINCREMENT (não volta atrás após exclusões/retenção)"""
+        linha = cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (tabela,)).fetchone()
+        return linha[0] if linha else 0
+    
+    def _incrementar_versao(self, cursor):
+        """Marca uma alteração de dados (na mesma transação da escrita)"""
+        cursor.execute("UPDATE metadados SET valor = valor + 1 WHERE chave = 'versao_dados'")
+    
+    @staticmethod
+    def _entradas_sazonais(lote, sinal=1):
+        """Tuplas de inserção (COLUNAS_INSERCAO) -> entradas para _acumular_sazonalidade"""
+        posicoes = [COLUNAS_INSERCAO.index(m) for m in METRICAS_SAZONAIS]
+        return [(valores[6], sinal, [valores[p] for p in posicoes]) for valores in lote]
+    
+    @staticmethod
+    def _entradas_sazonais_linhas(linhas, sinal):
+        """Linhas (id, data_registro, *METRICAS) -> entradas para _acumular_sazonalidade"""
+        posicoes = [2 + METRICAS.index(m) for m in METRICAS_SAZONAIS]
+        return [(linha[1], sinal, [linha[p] for p in posicoes]) for linha in linhas]
+    
+    def _acumular_sazonalidade(self, cursor, entradas):
+        """Soma (sinal=1) ou retira (sinal=-1) valores dos índices sazonais, na transação da escrita"""
+        if self._feriados is None:
+            self._feriados = carregar_feriados()
+        datas = list({data for data, _, _ in entradas})
+        novas = set(datas) - self._datas_calendario
+        if novas:
+            cursor.executemany('INSERT OR IGNORE INTO calendario VALUES (?, ?, ?, ?, ?, ?)',
+                               linhas_calendario(novas, self._feriados))
+        
+        chaves = {}
+        for lote in range(0, len(datas), 500):
+            parte = datas[lote:lote + 500]
+            for data, dia_semana, mes, feriado in cursor.execute(f'''
+                SELECT data, dia_semana, mes, feriado IS NOT NULL FROM calendario
+                WHERE data IN ({', '.join('?' * len(parte))})
+            ''', parte):
+                chaves[data] = (('dia_semana', dia_semana), ('mes', mes), ('feriado', feriado))
+        # Só datas com linha no calendário; o cache é descartado no rollback da escrita
+        self._datas_calendario |= chaves.keys()
+        
+        deltas = {}
+        for data, sinal, valores in entradas:
+            # Data inválida não entra no calendário nem nos índices (coerente com reconstruir_sazonalidade)
+            for tipo, chave in chaves.get(data, ()):
+                for metrica, valor in zip(METRICAS_SAZONAIS, valores):
+                    soma, contagem = deltas.get((tipo, chave, metrica), (0.0, 0))
+                    deltas[(tipo, chave, metrica)] = (soma + sinal * (valor or 0.0), contagem + sinal)
+        cursor.executemany('''
+            INSERT INTO indices_sazonais (tipo, chave, metrica, soma, contagem) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(tipo, chave, metrica) DO UPDATE SET
+                soma = soma + excluded.soma,
+                contagem = contagem + excluded.contagem
+        ''', [(*chave, soma, contagem) for chave, (soma, contagem) in deltas.items()])
+    
+    def get_indices_sazonais(self):
+        """Índices por métrica (média da chave / média geral), em cache por versão dos dados"""
+        versao = self.get_versao_dados()
+        if versao is not None and self._sazonalidade[0] == versao:
+            return self._sazonalidade[1]
+        
+        conn = self.conectar_leitura()
+        if not conn:
+            return None
+        
+        try:
+            linhas = conn.execute('SELECT tipo, chave, metrica, soma, contagem FROM indices_sazonais').fetchall()
+        except Exception as e:
+            print(f"❌ Erro ao ler índices sazonais: {e}")
+            return None
+        finally:
+            conn.close()
+        
+        indices = {}
+        for metrica in METRICAS_SAZONAIS:
+            # Cada registro entra uma vez por tipo: os totais de dia_semana são os gerais
+            doms = [(chave, soma, contagem) for tipo, chave, m, soma, contagem in linhas
+                    if m == metrica and tipo == 'dia_semana' and contagem > 0]
+            total = sum(c for _, _, c in doms)
+            media = sum(s for _, s, _ in doms) / total if total else 0
+            por_tipo = {}
+            for tipo, chave, m, soma, contagem in linhas:
+                if m == metrica and contagem > 0 and media:
+                    por_tipo.setdefault(tipo, {})[chave] = {
+                        'indice': round(soma / contagem / media, 4), 'registros': contagem}
+            indices[metrica] = por_tipo
+        self._sazonalidade = (versao, indices)
+        return indices
+    
+    def fator_sazonal(self, inicio, fim, metrica='vendas'):
+        """Fator médio (dia da semana × mês) dos dias de [inicio, fim]: média bruta / fator = dessazonalizada"""
+        indices = (self.get_indices_sazonais() or {}).get(metrica)
+        if not indices:
+            return 1.0
+        dia = datetime.strptime(inicio, '%Y-%m-%d').date()
+        ultimo = datetime.strptime(fim, '%Y-%m-%d').date()
+        fatores = []
+        while dia <= ultimo:
+            fatores.append(indices.get('dia_semana', {}).get(dia.weekday(), {}).get('indice', 1.0)
+                           * indices.get('mes', {}).get(dia.month, {}).get('indice', 1.0))
+            dia += timedelta(days=1)
+        return sum(fatores) / len(fatores) if fatores else 1.0
+    
+    def atualizar_calendario(self):
+        """Reaplica o arquivo de feriados ao calendário e reconstrói os índices sazonais"""
+        self._feriados = carregar_feriados()
+        try:
+            with self.escrita() as cursor:
+                datas = [linha[0] for linha in cursor.execute('SELECT data FROM calendario')]
+                cursor.executemany('UPDATE calendario SET feriado = ? WHERE data = ?',
+                                   [(linha_calendario(d, self._feriados)[5], d) for d in datas])
+                reconstruir_sazonalidade(cursor)
+                self._incrementar_versao(cursor)
+            print(f"✅ Calendário atualizado ({len(datas)} datas, {len(self._feriados)} feriados no arquivo)")
+            return True
+        except Exception as e:
+            print(f"❌ Erro ao atualizar calendário: {e}")
+            return False
+    
+    def get_versao_dados(self, chave='versao_dados'):
+        """Versão monotônica dos dados, compartilhada entre processos via banco"""
+        conn = self.conectar_leitura()
+        if not conn:
+            return None
+        
+        try:
+            row = conn.execute("SELECT valor FROM metadados WHERE chave = ?", (chave,)).fetchone()
+            return row[0] if row else None
+        except Exception as e:
+            print(f"❌ Erro ao obter versão dos dados: {e}")
+            return None
+        finally:
+            conn.close()
+    
+    def get_versao_fatos(self):
+        """Versão própria dos fatos dimensionais (não invalida snapshot de indicadores)"""
+        return self.get_versao_dados('versao_fatos')
+    
+    def carregar_snapshot(self):
+        """Mapeia o snapshot em disco se ele corresponder à versão atual dos dados"""
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            snapshot = SnapshotBinario.abrir(self.snapshot_path)
+        except Exception as e:
+            print(f"⚠️ Snapshot ignorado: {e}")
+            return
+        
+        if snapshot.versao == self.get_versao_dados():
+            self._snapshot = snapshot
+            print(f"✅ Snapshot carregado ({snapshot.n} registros, versão {snapshot.versao})")
+        else:
+            snapshot.fechar()
+    
+    def get_snapshot(self):
+        """Snapshot na versão atual; regrava a partir do SQL apenas quando os dados mudaram"""
+        if not self.snapshot_path:
+            return None
+        versao = self.get_versao_dados()
+        if versao is None:
+            return None
+        
+        snapshot = self._snapshot
+        if snapshot and snapshot.versao == versao:
+            return snapshot
+        if self._snapshot_falha == versao:
+            return None
+        
+        with self._snapshot_lock:
+            if self._snapshot and self._snapshot.versao == versao:
+                return self._snapshot
+            if self._snapshot_falha == versao:
+                return None
+            
+            conn = self.conectar_leitura()
+            if not conn:
+                return None
+            try:
+                linhas = conn.execute(f'''
+                    SELECT id, data_registro, {', '.join(METRICAS)}
+                    FROM indicadores
+                    WHERE deletado_em IS NULL
+                ''').fetchall()
+                SnapshotBinario.gravar(self.snapshot_path, versao, linhas)
+                novo = SnapshotBinario.abrir(self.snapshot_path)
+            except Exception as e:
+                print(f"⚠️ Snapshot indisponível na versão {versao}, usando SQL: {e}")
+                self._snapshot_falha = versao
+                return None
+            finally:
+                conn.close()
+            
+            if self._snapshot_aposentado:
+                self._snapshot_aposentado.fechar()
+            self._snapshot_aposentado, self._snapshot = self._snapshot, novo
+            return novo
+    
+    def get_kpis(self, periodo='semana', dimensao=None):
+        """Obtém KPIs do período especificado (total ou de uma dimensão (tipo, nome))"""
+        if dimensao:
+            return self.get_kpis_dimensao(periodo, dimensao)
+        data_limite = self._data_limite(periodo)
+        
+        snapshot = self.get_snapshot()
+        if snapshot:
+            medias = snapshot.kpis(data_limite)
+            return self._formatar_kpis([medias[m] for m in METRICAS])
+        
+        conn = self.conectar_leitura()
+        if not conn:
+            return self.get_kpis_fallback()
+        
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT 
+                    AVG(vendas) as vendas,
+                    AVG(despesas) as despesas,
+                    AVG(lucro) as lucro,
+                    AVG(crescimento) as crescimento,
+                    AVG(ticket_medio) as ticket_medio,
+                    AVG(clientes_ativos) as clientes_ativos
+                FROM indicadores 
+                WHERE data_registro >= ? AND deletado_em IS NULL
+            ''', (data_limite,))
+            
+            return self._formatar_kpis(cursor.fetchone())
+        except Exception as e:
+            print(f"❌ Erro ao obter KPIs: {e}")
+            return self.get_kpis_fallback()
+        finally:
+            conn.close()
+    
+    def get_historico(self, limite=None, dimensao=None):
+        """Obtém histórico limitado para análise"""
+        limite = limite or Config.HISTORICO_LIMITE
+        if dimensao:
+            return self.get_historico_dimensao(limite, dimensao)
+        # Sempre pelo SQL: LIMIT no índice de data_registro já é barato, e o snapshot não
+        # guarda created_at nem as métricas derivadas que as linhas completas trazem
+        conn = self.conectar_leitura()
+        if not conn:
+            return []
+        
+        try:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT * FROM indicadores 
+                WHERE deletado_em IS NULL
+                ORDER BY data_registro DESC 
+                LIMIT ?
+            ''', (limite,))
+            
+            return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"❌ Erro ao obter histórico: {e}")
+            return []
+        finally:
+            conn.close()
+
+    def get_dados_recentes(self, limite=None):
+        """Obtém dados recentes para exibição na tabela"""
+        limite = limite or Config.RECENTES_LIMITE
+        conn = self.conectar_leitura()
+        if not conn:
+            return []
+        
+        try:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, vendas, despesas, lucro, crescimento, 
+                       ticket_medio, clientes_ativos, data_registro,
+                       created_at, margem, razao_despesas, receita_por_cliente
+                FROM indicadores 
+                WHERE deletado_em IS NULL
+                ORDER BY data_registro DESC, created_at DESC 
+                LIMIT ?
+            ''', (limite,))
+            
+            return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"❌ Erro ao obter dados recentes: {e}")
+            return []
+        finally:
+            conn.close()
+    
+    def get_dias_margem_abaixo(self, limite=10.0, inicio=None, fim=None):
+        """Varredura de faixa em idx_indicadores_margem (sem expressão por linha)"""
+        filtros = ['margem < ?', 'deletado_em IS NULL']
+        parametros = [limite]
+        if inicio:
+            filtros.append('data_registro >= ?')
+            parametros.append(inicio)
+        if fim:
+            filtros.append('data_registro <= ?')
+            parametros.append(fim)
+        
+        conn = self.conectar_leitura()
+        if not conn:
+            return []
+        
+        try:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.execute(f'''
+                SELECT id, data_registro, vendas, despesas, lucro, margem
+                FROM indicadores INDEXED BY idx_indicadores_margem
+                WHERE {' AND '.join(filtros)}
+                ORDER BY margem
+            ''', parametros)
+            return [dict(row) for row in cursor.fetchall()]
+        except sqlite3.OperationalError:
+            # Índice ainda em construção pela migração: mesma consulta sem forçar o índice
+            cursor = conn.execute(f'''
+                SELECT id, data_registro, vendas, despesas, lucro, margem
+                FROM indicadores WHERE {' AND '.join(filtros)}
+                ORDER BY margem
+            ''', parametros)
+            return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"❌ Erro ao obter dias com margem baixa: {e}")
+            return []
+        finally:
+            conn.close()
+    
+    def registrar_dados(self, vendas, despesas, lucro, crescimento, ticket_medio, clientes_ativos, data_registro,
+                        upsert=False, chave_idempotencia=None):
+        """Grava um registro com upsert diário e/ou chave de idempotência opcionais
+        
+        Retorna (status, registro_id), status em: 'inserido', 'atualizado', 'repetido'
+        (chave já usada com o mesmo payload), 'conflito' (chave reutilizada com outro
+        payload), 'indisponivel' (upsert pedido sem o índice único) ou 'erro'.
+        """
+        valores = (vendas, despesas, lucro, crescimento, ticket_medio, clientes_ativos, data_registro)
+        hash_payload = hashlib.sha256(json.dumps([valores, upsert]).encode()).hexdigest()
+        antiga = None
+        
+        try:
+            with self.escrita() as cursor:
+                if chave_idempotencia:
+                    anterior = cursor.execute(
+                        'SELECT hash_payload, registro_id FROM chaves_idempotencia WHERE chave = ?',
+                        (chave_idempotencia,)
+                    ).fetchone()
+                    if anterior:
+                        status = 'repetido' if anterior[0] == hash_payload else 'conflito'
+                        print(f"♻️ Chave de idempotência já usada ({status}): {chave_idempotencia}")
+                        return status, anterior[1]
+                
+                if upsert:
+                    if not self.upsert_disponivel:
+                        print("❌ Upsert diário indisponível (ative INSIGHTPRO_UPSERT_DIARIO=1)")
+                        return 'indisponivel', None
+                    antiga = cursor.execute(f'''
+                        SELECT id, data_registro, {', '.join(METRICAS)} FROM indicadores
+                        WHERE data_registro = ? AND deletado_em IS NULL
+                    ''', (data_registro,)).fetchone()
+                    cursor.execute(SQL_INSERIR_INDICADOR + '''
+                        ON CONFLICT(data_registro) WHERE deletado_em IS NULL DO UPDATE SET
+                            vendas = excluded.vendas,
+                            despesas = excluded.despesas,
+                            lucro = excluded.lucro,
+                            crescimento = excluded.crescimento,
+                            ticket_medio = excluded.ticket_medio,
+                            clientes_ativos = excluded.clientes_ativos,
+                            margem = excluded.margem,
+                            razao_despesas = excluded.razao_despesas,
+                            receita_por_cliente = excluded.receita_por_cliente
+                    ''', com_derivadas(valores))
+                    registro_id = antiga[0] if antiga else cursor.lastrowid
+                else:
+                    cursor.execute(SQL_INSERIR_INDICADOR, com_derivadas(valores))
+                    registro_id = cursor.lastrowid
+                
+                if chave_idempotencia:
+                    cursor.execute(
+                        'INSERT INTO chaves_idempotencia (chave, hash_payload, registro_id) VALUES (?, ?, ?)',
+                        (chave_idempotencia, hash_payload, registro_id)
+                    )
+                linha = (registro_id, data_registro, vendas, despesas, lucro,
+                         crescimento, ticket_medio, clientes_ativos)
+                cursor.execute(SQL_REGISTRAR_ALTERACAO,
+                               self._entrada_log('atualizado' if antiga else 'inserido', linha))
+                self._acumular_sazonalidade(cursor, self._entradas_sazonais_linhas([linha], 1)
+                                            + self._entradas_sazonais_linhas([antiga] if antiga else [], -1))
+                self._incrementar_versao(cursor)
+            
+            if antiga:
+                # Ouvintes recebem [antiga, nova] para ajustar agregados sem recalcular
+                self._notificar('atualizado', [antiga, linha])
+                print(f"✅ Dados atualizados com sucesso para {data_registro}")
+                return 'atualizado', registro_id
+            
+            self._notificar('inserido', [linha])
+            print(f"✅ Dados inseridos com sucesso para {data_registro}")
+            return 'inserido', registro_id
+        except Exception as e:
+            print(f"❌ Erro ao inserir dados: {e}")
+            return 'erro', None
+    
+    def deletar_lote(self, ids=None, inicio=None, fim=None):
+        """Exclusão lógica (tombstone) por lista de IDs e/ou intervalo de datas
+        
+        Retorna a quantidade de registros marcados, ou -1 em caso de erro.
+        """
+        filtros = ['deletado_em IS NULL']
+        parametros = []
+        if inicio:
+            filtros.append('data_registro >= ?')
+            parametros.append(inicio)
+        if fim:
+            filtros.append('data_registro <= ?')
+            parametros.append(fim)
+        if len(filtros) == 1 and not ids:
+            return 0
+        # IDs em blocos de 500: builds antigas do SQLite (ex.: Termux) limitam a 999 variáveis
+        ids = list(ids or [])
+        partes = [ids[i:i + 500] for i in range(0, len(ids), 500)] or [None]
+        
+        try:
+            with self.escrita() as cursor:
+                linhas = []
+                for parte in partes:
+                    where = ' AND '.join(filtros + ([f"id IN ({', '.join('?' * len(parte))})"] if parte else []))
+                    valores = (parte or []) + parametros
+                    encontradas = cursor.execute(f'''
+                        SELECT id, data_registro, {', '.join(METRICAS)}
+                        FROM indicadores WHERE {where}
+                    ''', valores).fetchall()
+                    if encontradas:
+                        cursor.execute(f'''
+                            UPDATE indicadores SET deletado_em = CURRENT_TIMESTAMP
+                            WHERE {where}
+                        ''', valores)
+                        linhas.extend(encontradas)
+                if linhas:
+                    # Valores no momento da exclusão: consumidores podem desfazer agregados
+                    cursor.executemany(SQL_REGISTRAR_ALTERACAO,
+                                       [self._entrada_log('deletado', linha) for linha in linhas])
+                    self._acumular_sazonalidade(cursor, self._entradas_sazonais_linhas(linhas, -1))
+                    self._incrementar_versao(cursor)
+            
+            if linhas:
+                self._notificar('deletado', linhas)
+            return len(linhas)
+        except Exception as e:
+            print(f"❌ Erro ao deletar dados: {e}")
+            return -1
+    
+    def inserir_em_massa(self, lotes):
+        """executemany por lote, tudo em uma única transação e uma única versão"""
+        total = 0
+        try:
+            with self.escrita() as cursor:
+                id_anterior = self._seq_autoincremento(cursor, 'indicadores')
+                for lote in lotes:
+                    cursor.executemany(SQL_INSERIR_INDICADOR, map(com_derivadas, lote))
+                    self._acumular_sazonalidade(cursor, self._entradas_sazonais(lote))
+                    total += len(lote)
+                # Uma entrada por carga (faixa de ids) em vez de uma por linha
+                cursor.execute(SQL_REGISTRAR_ALTERACAO, ('carga_em_massa', None, None, json.dumps({
+                    'id_inicial': id_anterior + 1, 'id_final': self._seq_autoincremento(cursor, 'indicadores'),
+                    'linhas': total})))
+                self._incrementar_versao(cursor)
+        except Exception as e:
+            print(f"❌ Erro na carga em massa: {e}")
+            return 0
+        
+        # Volume grande demais para entregar linha a linha: ouvintes devem reconstruir
+        self._notificar('carga_em_massa', [])
+        return total
+    
+    def _id_dimensao(self, cursor, tipo, nome, pai=None):
+        pai_id = self._id_dimensao(cursor, *pai) if pai else None
+        cursor.execute('''
+            INSERT INTO dimensoes (tipo, nome, pai_id) VALUES (?, ?, ?)
+            ON CONFLICT(tipo, nome) DO UPDATE SET pai_id = COALESCE(excluded.pai_id, pai_id)
+        ''', (tipo, nome, pai_id))
+        return cursor.execute('SELECT id FROM dimensoes WHERE tipo = ? AND nome = ?', (tipo, nome)).fetchone()[0]
+    
+    def registrar_fatos(self, fatos):
+        """Grava fatos {data_registro, tipo, nome, metrica, valor[, pai: (tipo, nome)]}
+        
+        Cada (dimensão, métrica, data) guarda um valor (regravar substitui). Os meses
+        tocados são recalculados em fatos_mensais na mesma transação.
+        Retorna a quantidade gravada, ou -1 em caso de erro.
+        """
+        try:
+            with self.escrita() as cursor:
+                dimensoes = {}
+                linhas = []
+                meses = set()
+                for fato in fatos:
+                    chave = (fato['tipo'], fato['nome'])
+                    if chave not in dimensoes:
+                        pai = tuple(fato['pai']) if fato.get('pai') else None
+                        dimensoes[chave] = self._id_dimensao(cursor, *chave, pai=pai)
+                    linhas.append((dimensoes[chave], fato['metrica'], fato['data_registro'], float(fato['valor'])))
+                    meses.add((dimensoes[chave], fato['metrica'], fato['data_registro'][:7]))
+                if not linhas:
+                    return 0
+                
+                cursor.executemany('''
+                    INSERT INTO fatos (dimensao_id, metrica, data_registro, valor) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(dimensao_id, metrica, data_registro) DO UPDATE SET valor = excluded.valor
+                ''', linhas)
+                # Cada mês é uma faixa curta da PK de fatos (até 31 linhas)
+                cursor.executemany('''
+                    INSERT OR REPLACE INTO fatos_mensais (dimensao_id, metrica, mes, soma, contagem)
+                    SELECT dimensao_id, metrica, ?3, SUM(valor), COUNT(*) FROM fatos
+                    WHERE dimensao_id = ?1 AND metrica = ?2 AND data_registro BETWEEN ?3 || '-01' AND ?3 || '-31'
+                ''', sorted(meses))
+                cursor.execute("UPDATE metadados SET valor = valor + 1 WHERE chave = 'versao_fatos'")
+            print(f"✅ {len(linhas)} fatos gravados ({len(dimensoes)} dimensões)")
+            return len(linhas)
+        except Exception as e:
+            print(f"❌ Erro ao gravar fatos: {e}")
+            return -1
+    
+    def listar_dimensoes(self, tipo=None):
+        """Dimensões cadastradas (opcionalmente de um tipo), com o pai quando houver"""
+        conn = self.conectar_leitura()
+        if not conn:
+            return []
+        
+        try:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.execute('''
+                SELECT d.id, d.tipo, d.nome, p.tipo AS pai_tipo, p.nome AS pai_nome
+                FROM dimensoes d LEFT JOIN dimensoes p ON p.id = d.pai_id
+                WHERE ? IS NULL OR d.tipo = ?
+                ORDER BY d.tipo, d.nome
+            ''', (tipo, tipo))
+            return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"❌ Erro ao listar dimensões: {e}")
+            return []
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def _meses_inteiros(inicio, fim):
+        """Primeiro e último mês (AAAA-MM) inteiramente contidos em [inicio, fim]"""
+        primeiro = ultimo = None
+        if inicio:
+            dia = datetime.strptime(inicio, '%Y-%m-%d').date()
+            if dia.day != 1:
+                dia = (dia.replace(day=28) + timedelta(days=4)).replace(day=1)
+            primeiro = dia.strftime('%Y-%m')
+        if fim:
+            dia = datetime.strptime(fim, '%Y-%m-%d').date()
+            if (dia + timedelta(days=1)).day != 1:
+                dia = dia.replace(day=1) - timedelta(days=1)
+            ultimo = dia.strftime('%Y-%m')
+        return primeiro, ultimo
+    
+    def agregar_fatos(self, metrica, agrupar_por, inicio=None, fim=None, granularidade='total'):
+        """Soma de uma métrica agrupada por tipo de dimensão (ou pelo tipo do pai)
+        
+        granularidade: 'total' (meses inteiros do rollup + bordas em fatos), 'mes'
+        (só fatos_mensais) ou 'dia' (fatos).
+        """
+        grupo = '''
+            JOIN dimensoes d ON d.id = origem.dimensao_id
+            LEFT JOIN dimensoes p ON p.id = d.pai_id
+            WHERE d.tipo = :tipo OR p.tipo = :tipo
+        '''
+        nome_grupo = 'CASE WHEN d.tipo = :tipo THEN d.nome ELSE p.nome END'
+        parametros = {'tipo': agrupar_por, 'metrica': metrica, 'inicio': inicio, 'fim': fim}
+        
+        if granularidade == 'dia':
+            sql = f'''
+                SELECT {nome_grupo} AS grupo, origem.periodo, SUM(origem.soma) AS valor
+                FROM (SELECT dimensao_id, data_registro AS periodo, valor AS soma FROM fatos
+                      WHERE metrica = :metrica
+                        AND (:inicio IS NULL OR data_registro >= :inicio)
+                        AND (:fim IS NULL OR data_registro <= :fim)) origem
+                {grupo}
+                GROUP BY grupo, origem.periodo ORDER BY origem.periodo, grupo
+            '''
+        elif granularidade == 'mes':
+            sql = f'''
+                SELECT {nome_grupo} AS grupo, origem.periodo, SUM(origem.soma) AS valor
+                FROM (SELECT dimensao_id, mes AS periodo, soma FROM fatos_mensais
+                      WHERE metrica = :metrica
+                        AND (:inicio IS NULL OR mes >= substr(:inicio, 1, 7))
+                        AND (:fim IS NULL OR mes <= substr(:fim, 1, 7))) origem
+                {grupo}
+                GROUP BY grupo, origem.periodo ORDER BY origem.periodo, grupo
+            '''
+        else:
+            parametros['primeiro'], parametros['ultimo'] = self._meses_inteiros(inicio, fim)
+            if parametros['primeiro'] and parametros['ultimo'] and parametros['primeiro'] > parametros['ultimo']:
+                # Intervalo sem mês inteiro: tudo vem de fatos
+                parametros['primeiro'], parametros['ultimo'] = '9999-99', '0000-00'
+            sql = f'''
+                SELECT {nome_grupo} AS grupo, SUM(origem.soma) AS valor
+                FROM (
+                    SELECT dimensao_id, soma FROM fatos_mensais
+                    WHERE metrica = :metrica
+                      AND (:primeiro IS NULL OR mes >= :primeiro)
+                      AND (:ultimo IS NULL OR mes <= :ultimo)
+                    UNION ALL
+                    SELECT dimensao_id, valor FROM fatos
+                    WHERE metrica = :metrica
+                      AND (:inicio IS NULL OR data_registro >= :inicio)
+                      AND (:fim IS NULL OR data_registro <= :fim)
+                      AND ((:primeiro IS NOT NULL AND data_registro < :primeiro || '-01')
+                           OR (:ultimo IS NOT NULL AND data_registro > :ultimo || '-31'))
+                ) origem
+                {grupo}
+                GROUP BY grupo ORDER BY valor DESC
+            '''
+        
+        conn = self.conectar_leitura()
+        if not conn:
+            return []
+        
+        try:
+            conn.row_factory = sqlite3.Row
+            return [dict(row) for row in conn.execute(sql, parametros).fetchall()]
+        except Exception as e:
+            print(f"❌ Erro ao agregar fatos: {e}")
+            return []
+        finally:
+            conn.close()
+    
+    def _serie_dimensao(self, dimensao, inicio=None, limite=None):
+        """Valores diários de METRICAS de uma dimensão (somando as filhas), mais recentes primeiro"""
+        conn = self.conectar_leitura()
+        if not conn:
+            return []
+        
+        try:
+            tipo, nome = dimensao
+            ids = [linha[0] for linha in conn.execute('''
+                SELECT d.id FROM dimensoes d LEFT JOIN dimensoes p ON p.id = d.pai_id
+                WHERE (d.tipo = ? AND d.nome = ?) OR (p.tipo = ? AND p.nome = ?)
+            ''', (tipo, nome, tipo, nome))]
+            if not ids:
+                return []
+            
+            # IN nas duas primeiras colunas da PK + faixa de datas: só busca por índice
+            linhas = conn.execute(f'''
+                SELECT data_registro, metrica, SUM(valor), COUNT(*) FROM fatos
+                WHERE dimensao_id IN ({', '.join('?' * len(ids))})
+                  AND metrica IN ({', '.join('?' * len(METRICAS))})
+                  AND data_registro >= ?
+                GROUP BY data_registro, metrica
+            ''', (*ids, *METRICAS, inicio or '')).fetchall()
+        except Exception as e:
+            print(f"❌ Erro ao obter série da dimensão {dimensao}: {e}")
+            return []
+        finally:
+            conn.close()
+        
+        dias = {}
+        for data_registro, metrica, soma, contagem in linhas:
+            dias.setdefault(data_registro, {})[metrica] = soma if metrica in METRICAS_ADITIVAS else soma / contagem
+        serie = [{'data_registro': dia, **dias[dia]} for dia in sorted(dias, reverse=True)]
+        return serie[:limite] if limite else serie
+    
+    def get_kpis_dimensao(self, periodo, dimensao):
+        """Média diária das métricas da dimensão no período (mesma semântica de get_kpis)"""
+        serie = self._serie_dimensao(dimensao, inicio=self._data_limite(periodo))
+        medias = []
+        for metrica in METRICAS:
+            valores = [dia[metrica] for dia in serie if metrica in dia]
+            medias.append(sum(valores) / len(valores) if valores else None)
+        return self._formatar_kpis(medias)
+    
+    def get_historico_dimensao(self, limite, dimensao):
+        return [{**{m: 0 for m in METRICAS}, **dia} for dia in self._serie_dimensao(dimensao, limite=limite)]
+    
+    def _ler_alteracoes(self, apos, limite):
+        conn = self.conectar_leitura()
+        if not conn:
+            return [], None
+        
+        try:
+            conn.row_factory = sqlite3.Row
+            entradas = [dict(row) for row in conn.execute('''
+                SELECT seq, operacao, registro_id, data_registro, dados, criado_em
+                FROM log_alteracoes WHERE seq > ? ORDER BY seq LIMIT ?
+            ''', (apos, limite))]
+            for entrada in entradas:
+                entrada['dados'] = json.loads(entrada['dados'])
+            seq_minimo = conn.execute('SELECT MIN(seq) FROM log_alteracoes').fetchone()[0]
+            if seq_minimo is None:
+                # Log podado até ficar vazio: o próximo seq ainda indica o que foi descartado
+                ultimo = self._seq_autoincremento(conn, 'log_alteracoes')
+                seq_minimo = ultimo + 1 if ultimo else None
+            return entradas, seq_minimo
+        except Exception as e:
+            print(f"❌ Erro ao ler log de alterações: {e}")
+            return [], None
+        finally:
+            conn.close()
+    
+    def get_ultimo_seq(self):
+        conn = self.conectar_leitura()
+        if not conn:
+            return 0
+        
+        try:
+            # sqlite_sequence: a marca d'água não volta a 0 quando a retenção esvazia o log
+            return self._seq_autoincremento(conn, 'log_alteracoes')
+        except Exception as e:
+            print(f"❌ Erro ao ler log de alterações: {e}")
+            return 0
+        finally:
+            conn.close()
+    
+    def compactar_tombstones(self, retencao=None, lote=None, paginas=100):
+        """Purga tombstones antigos em lotes curtos e devolve páginas livres ao disco
+        
+        Os registros purgados já estavam invisíveis, então a versão dos dados (e os
+        caches derivados dela) não muda.
+        """
+        retencao = Config.TOMBSTONE_RETENCAO if retencao is None else retencao
+        lote = lote or Config.COMPACTACAO_LOTE
+        total = 0
+        try:
+            while True:
+                # Cada lote é uma transação curta: inserções intercalam entre os lotes
+                with self.escrita() as cursor:
+                    cursor.execute('''
+                        DELETE FROM indicadores WHERE id IN (
+                            SELECT id FROM indicadores
+                            WHERE deletado_em IS NOT NULL AND deletado_em <= datetime('now', ?)
+                            LIMIT ?
+                        )
+                    ''', (f'-{retencao} seconds', lote))
+                    purgados = cursor.rowcount
+                total += purgados
+                if purgados < lote:
+                    break
+            
+            with self.escrita() as cursor:
+                cursor.execute(
+                    "DELETE FROM chaves_idempotencia WHERE criado_em <= datetime('now', ?)",
+                    (f'-{Config.IDEMPOTENCIA_RETENCAO} seconds',)
+                )
+                cursor.execute(
+                    "DELETE FROM log_alteracoes WHERE criado_em <= datetime('now', ?)",
+                    (f'-{Config.LOG_ALTERACOES_RETENCAO} seconds',)
+                )
+            
+            # Bancos anteriores ao auto_vacuum=INCREMENTAL: `manutencao --vacuum` converte uma vez
+            while True:
+                # Um lote de páginas por vez: o escritor único fica livre entre os lotes
+                with self._escrita_lock:
+                    conn = self._conn_escrita
+                    if (conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2
+                            or conn.execute('PRAGMA freelist_count').fetchone()[0] == 0):
+                        break
+                    # execute() dá um único passo (uma página); executescript roda o PRAGMA até o fim
+                    conn.executescript(f'PRAGMA incremental_vacuum({paginas})')
+            
+            if total:
+                print(f"🧹 {total} tombstones compactados")
+            return total
+        except Exception as e:
+            print(f"❌ Erro na compactação: {e}")
+            return total
+    
+    def _caminho_arquivo(self, ano):
+        return os.path.join(self.arquivo_dir, f'indicadores_{ano}.jsonl.gz')
+    
+    def _caminho_pendente(self):
+        return os.path.join(self.arquivo_dir, 'retencao_pendente.jsonl.gz')
+    
+    def _arquivar(self, linhas, caminho=None):
+        """Acrescenta linhas ao arquivo anual como um novo membro gzip (arquivos multi-membro são válidos)
+        
+        Com `caminho`, grava todas as linhas só nele, substituindo o conteúdo (arquivo pendente).
+        """
+        por_ano = {}
+        for linha in linhas:
+            por_ano.setdefault(linha[COLUNAS_EXPORTACAO.index('data_registro')][:4], []).append(linha)
+        os.makedirs(self.arquivo_dir, exist_ok=True)
+        if caminho:
+            with gzip.open(caminho, 'wt', encoding='utf-8') as f:
+                for texto in ExportadorDados.jsonl([linhas]):
+                    f.write(texto)
+            return
+        for ano, linhas_ano in por_ano.items():
+            with gzip.open(self._caminho_arquivo(ano), 'at', encoding='utf-8') as f:
+                for texto in ExportadorDados.jsonl([linhas_ano]):
+                    f.write(texto)
+    
+    def _concluir_pendente(self):
+        """Queda entre o commit de uma retenção e o arquivo anual: arquiva o que já saiu da tabela"""
+        caminho = self._caminho_pendente() if self.arquivo_dir else None
+        if not caminho or not os.path.exists(caminho):
+            return
+        try:
+            with gzip.open(caminho, 'rt', encoding='utf-8') as f:
+                pendentes = [tuple(json.loads(texto)[c] for c in COLUNAS_EXPORTACAO) for texto in f]
+        except (OSError, EOFError, ValueError, KeyError):
+            # Pendente incompleto: a queda foi antes do commit e as linhas seguem na tabela
+            pendentes = []
+        if pendentes:
+            with self.escrita() as cursor:
+                cursor.execute('CREATE TEMP TABLE IF NOT EXISTS ids_retencao (id INTEGER PRIMARY KEY)')
+                cursor.execute('DELETE FROM ids_retencao')
+                cursor.executemany('INSERT INTO ids_retencao (id) VALUES (?)', ((linha[0],) for linha in pendentes))
+                restantes = {registro_id for (registro_id,) in cursor.execute(
+                    'SELECT id FROM indicadores WHERE id IN (SELECT id FROM ids_retencao)')}
+                cursor.execute('DELETE FROM ids_retencao')
+            self._arquivar([linha for linha in pendentes if linha[0] not in restantes])
+        os.remove(caminho)
+    
+    def aplicar_retencao(self, meses=None):
+        """Retira da tabela quente os meses anteriores à janela de retenção, um mês por transação
+        
+        O gzip nunca é escrito segurando o escritor único. As linhas do mês são lidas
+        fora dele e gravadas num arquivo pendente. A transação de escrita resume e
+        apaga por id só as que continuam iguais: linhas gravadas ou alteradas nesse meio
+        tempo ficam na tabela para a próxima volta. Após o commit, as linhas apagadas vão
+        para o arquivo anual e o pendente é removido. Numa queda entre os dois passos, a
+        próxima execução arquiva do pendente o que já saiu da tabela. Uma queda depois do
+        arquivo só duplica linhas nele (consultar_arquivo descarta ids repetidos), nunca
+        as perde. Depois os resumos semanais mais velhos que a retenção semanal são
+        descartados (os mensais e diários já cobrem o mesmo período).
+        """
+        meses = Config.RETENCAO_MESES if meses is None else meses
+        if meses <= 0:
+            return 0
+        # A janela quente nunca fica menor que o maior período do dashboard
+        meses = max(meses, math.ceil(max(PERIODOS.values()) / 30) + 1)
+        corte = mes_de_corte(meses)
+        total = 0
+        try:
+            self._concluir_pendente()
+            while True:
+                # Leitura fora do escritor, no arquivo principal (a réplica pode estar atrasada)
+                conn = self.conectar()
+                if not conn:
+                    raise sqlite3.OperationalError('conexão indisponível')
+                try:
+                    primeira = conn.execute('SELECT MIN(data_registro) FROM indicadores').fetchone()[0]
+                    if not primeira or primeira >= corte:
+                        break
+                    inicio = primeira[:8] + '01'
+                    fim = min(mes_de_corte(-1, datetime.strptime(inicio, '%Y-%m-%d').date()), corte)
+                    linhas = conn.execute(f'''
+                        SELECT {', '.join(COLUNAS_EXPORTACAO)} FROM indicadores
+                        WHERE deletado_em IS NULL AND data_registro >= ? AND data_registro < ?
+                        ORDER BY data_registro, id
+                    ''', (inicio, fim)).fetchall()
+                finally:
+                    conn.close()
+                
+                arquivar = bool(linhas and self.arquivo_dir)
+                if arquivar:
+                    self._arquivar(linhas, self._caminho_pendente())
+                
+                with self.escrita() as cursor:
+                    # Resumo e exclusão só das linhas lidas acima que não mudaram desde então
+                    cursor.execute('CREATE TEMP TABLE IF NOT EXISTS ids_retencao (id INTEGER PRIMARY KEY)')
+                    cursor.execute('DELETE FROM ids_retencao')
+                    cursor.executemany('INSERT INTO ids_retencao (id) VALUES (?)', ((linha[0],) for linha in linhas))
+                    atuais = {linha[0]: linha for linha in cursor.execute(f'''
+                        SELECT {', '.join(COLUNAS_EXPORTACAO)} FROM indicadores
+                        WHERE deletado_em IS NULL AND id IN (SELECT id FROM ids_retencao)
+                    ''')}
+                    alteradas = [(linha[0],) for linha in linhas if atuais.get(linha[0]) != linha]
+                    cursor.executemany('DELETE FROM ids_retencao WHERE id = ?', alteradas)
+                    linhas = [linha for linha in linhas if atuais.get(linha[0]) == linha]
+                    for granularidade, expressao in GRANULARIDADES_RESUMO.items():
+                        cursor.execute(f'''
+                            INSERT INTO indicadores_resumo (granularidade, inicio, registros, {', '.join(METRICAS)})
+                            SELECT ?, {expressao}, COUNT(*), {', '.join(f'SUM({m})' for m in METRICAS)}
+                            FROM indicadores
+                            WHERE id IN (SELECT id FROM ids_retencao)
+                            GROUP BY 2
+                            ON CONFLICT(granularidade, inicio) DO UPDATE SET
+                                registros = registros + excluded.registros,
+                                {', '.join(f'{m} = {m} + excluded.{m}' for m in METRICAS)}
+                        ''', (granularidade,))
+                    cursor.execute('DELETE FROM indicadores WHERE id IN (SELECT id FROM ids_retencao)')
+                    # Tombstones do período saem junto: não há mais o que compactar ali
+                    cursor.execute('''
+                        DELETE FROM indicadores
+                        WHERE deletado_em IS NOT NULL AND data_registro >= ? AND data_registro < ?
+                    ''', (inicio, fim))
+                    cursor.execute('DELETE FROM ids_retencao')
+                    cursor.execute(SQL_REGISTRAR_ALTERACAO, ('arquivado', None, None, json.dumps({
+                        'inicio': inicio, 'fim': fim, 'linhas': len(linhas)})))
+                    self._incrementar_versao(cursor)
+                if arquivar:
+                    self._arquivar(linhas)
+                    os.remove(self._caminho_pendente())
+                total += len(linhas)
+                print(f"🗄️ {len(linhas)} registros de {inicio[:7]} arquivados")
+            
+            with self.escrita() as cursor:
+                cursor.execute("DELETE FROM indicadores_resumo WHERE granularidade = 'semana' AND inicio < ?",
+                               (mes_de_corte(meses + Config.RETENCAO_SEMANAL_MESES),))
+        except Exception as e:
+            print(f"❌ Erro na retenção: {e}")
+            return -1
+        
+        if total:
+            # Brutos fora da tabela: ouvintes reconstroem o que dependia deles
+            self._notificar('arquivado', [])
+        return total
+    
+    def get_resumo(self, granularidade='mes', inicio=None, fim=None):
+        """Série por semana/mês: resumos arquivados somados ao agrupamento da tabela quente"""
+        expressao = GRANULARIDADES_RESUMO[granularidade]
+        conn = self.conectar_leitura()
+        if not conn:
+            return []
+        
+        try:
+            linhas = conn.execute(f'''
+                SELECT inicio, SUM(registros), {', '.join(f'SUM({m})' for m in METRICAS)} FROM (
+                    SELECT inicio, registros, {', '.join(METRICAS)}
+                    FROM indicadores_resumo WHERE granularidade = ?
+                    UNION ALL
+                    SELECT {expressao}, COUNT(*), {', '.join(f'SUM({m})' for m in METRICAS)}
+                    FROM indicadores WHERE deletado_em IS NULL
+                    GROUP BY 1
+                )
+                WHERE inicio >= ? AND inicio <= ?
+                GROUP BY inicio ORDER BY inicio
+            ''', (granularidade, inicio or '0000-00-00', fim or '9999-99-99')).fetchall()
+        except Exception as e:
+            print(f"❌ Erro ao ler resumo: {e}")
+            return []
+        finally:
+            conn.close()
+        
+        resumo = []
+        for inicio_periodo, registros, *somas in linhas:
+            item = {'inicio': inicio_periodo, 'registros': registros}
+            for metrica, soma in zip(METRICAS, somas):
+                # Taxas e médias não somam entre dias: média do período
+                item[metrica] = round(soma / registros if metrica in ('crescimento', 'ticket_medio') else soma, 2)
+            resumo.append(item)
+        return resumo
+    
+    def consultar_arquivo(self, inicio=None, fim=None, lote=None):
+        """Lê os arquivos anuais do intervalo em lotes, na ordem gravada, sem ids repetidos
+        
+        Um id só se repete quando o mesmo mês foi arquivado de novo após uma queda, e as
+        duas cópias ficam em sequência: basta lembrar os ids do mês corrente.
+        """
+        lote = lote or Config.EXPORTACAO_LOTE
+        if not self.arquivo_dir or not os.path.isdir(self.arquivo_dir):
+            return
+        anos = sorted(nome[len('indicadores_'):-len('.jsonl.gz')] for nome in os.listdir(self.arquivo_dir)
+                      if nome.startswith('indicadores_') and nome.endswith('.jsonl.gz'))
+        mes, vistos = None, set()
+        linhas = []
+        for ano in anos:
+            if (inicio and ano < inicio[:4]) or (fim and ano > fim[:4]):
+                continue
+            try:
+                with gzip.open(self._caminho_arquivo(ano), 'rt', encoding='utf-8') as f:
+                    for texto in f:
+                        registro = json.loads(texto)
+                        data = registro['data_registro']
+                        if data[:7] != mes:
+                            mes, vistos = data[:7], set()
+                        if (inicio and data < inicio) or (fim and data > fim) or registro['id'] in vistos:
+                            continue
+                        vistos.add(registro['id'])
+                        linhas.append(tuple(registro[c] for c in COLUNAS_EXPORTACAO))
+                        if len(linhas) >= lote:
+                            yield linhas
+                            linhas = []
+            except Exception as e:
+                # Propaga como iterar_indicadores: a exportação aborta em vez de sair truncada
+                print(f"❌ Erro ao ler arquivo de {ano}: {e}")
+                raise
+        if linhas:
+            yield linhas
+    
+    def iniciar_compactacao(self, intervalo=None):
+        """Executa compactar_tombstones periodicamente em uma thread daemon"""
+        intervalo = intervalo or Config.COMPACTACAO_INTERVALO
+        
+        def loop():
+            while True:
+                time.sleep(intervalo)
+                self.compactar_tombstones()
+                if Config.RETENCAO_MESES:
+                    self.aplicar_retencao()
+        
+        threading.Thread(target=loop, name='compactacao', daemon=True).start()
+    
+    def manutencao(self, analisar=False, vacuum=False):
+        """PRAGMA optimize e checkpoint do WAL (TRUNCATE); com analisar=True, também ANALYZE
+        
+        vacuum=True (só pela CLI, uma vez) passa bancos criados antes do
+        auto_vacuum=INCREMENTAL para esse modo com um VACUUM completo: ele reescreve o
+        arquivo inteiro segurando o escritor, por isso não entra no ciclo periódico.
+        
+        optimize só reanalisa tabelas cujas estatísticas ficaram velhas, então é barato
+        o bastante para rodar sempre; ANALYZE fica para intervalos maiores. Ele roda na
+        transação do escritor único, então amostra até Config.ANALYZE_LIMITE linhas por
+        índice (analysis_limit) para não segurar as escritas enquanto varre bancos grandes.
+        O checkpoint TRUNCATE devolve o espaço do WAL, que cresce entre checkpoints no
+        perfil de ingestão.
+        """
+        inicio = time.perf_counter()
+        try:
+            with self.escrita() as cursor:
+                if analisar:
+                    cursor.execute(f'PRAGMA analysis_limit={int(Config.ANALYZE_LIMITE)}')
+                    cursor.execute('ANALYZE')
+                cursor.execute('PRAGMA optimize')
+            # Fora de transação: o checkpoint não pode rodar com uma aberta no mesmo conector
+            with self._escrita_lock:
+                conn = self._conn_escrita
+                if vacuum and conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                    conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+                    conn.execute('VACUUM')
+                    print("🧹 Banco convertido para auto_vacuum=INCREMENTAL")
+                ocupado, paginas_wal, copiadas = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+        except Exception as e:
+            print(f"❌ Erro na manutenção: {e}")
+            self._manutencao['erros'] += 1
+            return None
+        
+        agora = datetime.now().isoformat(timespec='seconds')
+        resultado = {
+            'duracao_ms': round((time.perf_counter() - inicio) * 1000, 1),
+            'analyze': analisar,
+            'vacuum': vacuum,
+            # ocupado=1: leitores impediram o checkpoint completo; tenta de novo no próximo ciclo
+            'checkpoint': {'ocupado': bool(ocupado), 'paginas_wal': paginas_wal, 'copiadas': copiadas},
+        }
+        self._manutencao.update(ultima=agora, ultimo_resultado=resultado, execucoes=self._manutencao['execucoes'] + 1)
+        if analisar:
+            self._manutencao['ultimo_analyze'] = agora
+        return resultado
+    
+    def iniciar_manutencao(self, intervalo=None):
+        """manutencao() periódica em uma thread daemon; ANALYZE a cada Config.ANALYZE_INTERVALO"""
+        intervalo = intervalo or Config.MANUTENCAO_INTERVALO
+        
+        def loop():
+            ultimo_analyze = time.monotonic()
+            while True:
+                time.sleep(intervalo)
+                analisar = time.monotonic() - ultimo_analyze >= Config.ANALYZE_INTERVALO
+                if self.manutencao(analisar) and analisar:
+                    ultimo_analyze = time.monotonic()
+        
+        threading.Thread(target=loop, name='manutencao', daemon=True).start()
+    
+    def status_manutencao(self):
+        return dict(self._manutencao, perfil=Config.PERFIL_PRAGMA, pragmas=self.pragmas_efetivos())
+    
+    def caminho_leitura_externa(self):
+        self.garantir_inicializado()
+        return self.replica_path if self.replica_path and os.path.exists(self.replica_path) else self.db_path
+    
+    def fechar(self):
+        """Fecha o conector de escrita e os snapshots mapeados; espera as migrações em lotes"""
+        if self._thread_migracoes:
+            self._thread_migracoes.join()
+        with self._escrita_lock:
+            if self._conn_escrita is not None:
+                self._conn_escrita.close()
+                self._conn_escrita = None
+        with self._snapshot_lock:
+            for snapshot in (self._snapshot, self._snapshot_aposentado):
+                if snapshot:
+                    snapshot.fechar()
+            self._snapshot = self._snapshot_aposentado = None
+
+    def iterar_indicadores(self, inicio=None, fim=None, lote=None):
+        """Percorre a tabela em lotes com cursor no servidor (memória constante)
+        
+        Erros são propagados: uma exportação em streaming interrompida precisa abortar a
+        resposta, e não terminar normalmente parecendo completa.
+        """
+        lote = lote or Config.EXPORTACAO_LOTE
+        conn = self.conectar_leitura()
+        if not conn:
+            raise sqlite3.OperationalError('conexão de leitura indisponível')
+        
+        try:
+            filtros = ['deletado_em IS NULL']
+            parametros = []
+            if inicio:
+                filtros.append('data_registro >= ?')
+                parametros.append(inicio)
+            if fim:
+                filtros.append('data_registro <= ?')
+                parametros.append(fim)
+            where = f"WHERE {' AND '.join(filtros)}"
+            
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT {', '.join(COLUNAS_EXPORTACAO)}
+                FROM indicadores 
+                {where}
+                ORDER BY data_registro, id
+            ''', parametros)
+            
+            while True:
+                linhas = cursor.fetchmany(lote)
+                if not linhas:
+                    break
+                yield linhas
+        except Exception as e:
+            print(f"❌ Erro ao exportar dados: {e}")
+            raise
+        finally:
+            conn.close()
+
+# ===== MOTORES ALTERNATIVOS (SEM DISCO) =====
+class ArmazenamentoSQLiteMemoria(DatabaseManager):
+    """SQLite :memory: com cache compartilhado: mesmo SQL do motor em arquivo, sem disco"""
+    def __init__(self, nome=None, adiar_inicializacao=False):
+        nome = nome or f"insightpro_{os.getpid()}_{id(self)}"
+        super().__init__(f"file:{nome}?mode=memory&cache=shared", adiar_inicializacao=True)
+        self._uri = True
+        # Sem snapshot/réplica em disco; a conexão âncora mantém o banco vivo
+        self.snapshot_path = None
+        self.replica_path = None
+        # Sem arquivo anual: a retenção só reduz os brutos a resumos
+        self.arquivo_dir = None
+        self._ancora = sqlite3.connect(self.db_path, uri=True, check_same_thread=False)
+        if not adiar_inicializacao:
+            self.garantir_inicializado()
+    
+    def conectar_leitura(self):
+        self.garantir_inicializado()
+        try:
+            conn = sqlite3.connect(self.db_path, uri=True, timeout=Config.SQLITE_TIMEOUT)
+            conn.execute('PRAGMA query_only=1')
+            # Cache compartilhado usa travas por tabela: leitor não espera o escritor
+            conn.execute('PRAGMA read_uncommitted=1')
+            return conn
+        except Exception as e:
+            print(f"❌ Erro na conexão de leitura: {e}")
+            return None
+    
+    def caminho_leitura_externa(self):
+        # Cache compartilhado só existe neste processo
+        return None
+    
+    def fechar(self):
+        super().fechar()
+        # Última conexão do cache compartilhado: o banco em memória é liberado
+        self._ancora.close()
+
+class ArmazenamentoMemoria(ArmazenamentoBase):
+    """Motor puro Python: registros em dict + lista ordenada (data, id) com índice bisect
+    
+    Janelas por data são um bisect_left seguido de uma varredura só das linhas
+    do período; ids crescentes reproduzem a ordem de created_at dentro do dia.
+    """
+    def __init__(self, popular_exemplo=True):
+        super().__init__()
+        self._registros = {}
+        self._ordem = []
+        self._ultimo_id = 0
+        self._versao = 0
+        self._chaves_idempotencia = {}
+        self._log = []
+        self._lock = threading.RLock()
+        self.upsert_disponivel = Config.UPSERT_DIARIO
+        if popular_exemplo:
+            gerador = GeradorDados(inicio=date.today() - timedelta(days=30), tendencia=0.025)
+            self.inserir_em_massa(gerador.lotes(30))
+    
+    def _novo_registro(self, valores):
+        self._ultimo_id += 1
+        registro = dict(zip(COLUNAS_INSERCAO + METRICAS_DERIVADAS, com_derivadas(valores)))
+        registro['id'] = self._ultimo_id
+        registro['created_at'] = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        self._registros[registro['id']] = registro
+        return registro
+    
+    @staticmethod
+    def _linha(registro):
+        return (registro['id'], registro['data_registro'], *(registro[m] for m in METRICAS))
+    
+    def _faixa(self, inicio=None, fim=None):
+        a = bisect.bisect_left(self._ordem, (inicio,)) if inicio else 0
+        b = bisect.bisect_left(self._ordem, (fim + '\uffff',)) if fim else len(self._ordem)
+        return self._ordem[a:b]
+    
+    def get_versao_dados(self):
+        return self._versao
+    
+    def get_kpis(self, periodo='semana', dimensao=None):
+        if dimensao:
+            return self.get_kpis_dimensao(periodo, dimensao)
+        with self._lock:
+            registros = [self._registros[i] for _, i in self._faixa(self._data_limite(periodo))]
+        if not registros:
+            return self._formatar_kpis([None] * len(METRICAS))
+        return self._formatar_kpis([sum(r[m] for r in registros) / len(registros) for m in METRICAS])
+    
+    def get_historico(self, limite=None, dimensao=None):
+        limite = limite or Config.HISTORICO_LIMITE
+        if dimensao:
+            return self.get_historico_dimensao(limite, dimensao)
+        with self._lock:
+            return [dict(self._registros[i]) for _, i in reversed(self._ordem[-limite:])]
+    
+    def get_dados_recentes(self, limite=None):
+        return self.get_historico(limite or Config.RECENTES_LIMITE)
+    
+    def iterar_indicadores(self, inicio=None, fim=None, lote=None):
+        lote = lote or Config.EXPORTACAO_LOTE
+        with self._lock:
+            registros = [self._registros[i] for _, i in self._faixa(inicio, fim)]
+        for a in range(0, len(registros), lote):
+            yield [tuple(r[c] for c in COLUNAS_EXPORTACAO) for r in registros[a:a + lote]]
+    
+    def registrar_dados(self, vendas, despesas, lucro, crescimento, ticket_medio, clientes_ativos, data_registro,
+                        upsert=False, chave_idempotencia=None):
+        valores = (vendas, despesas, lucro, crescimento, ticket_medio, clientes_ativos, data_registro)
+        hash_payload = hashlib.sha256(json.dumps([valores, upsert]).encode()).hexdigest()
+        with self._lock:
+            if chave_idempotencia in self._chaves_idempotencia:
+                hash_anterior, registro_id = self._chaves_idempotencia[chave_idempotencia]
+                return ('repetido' if hash_anterior == hash_payload else 'conflito'), registro_id
+            if upsert and not self.upsert_disponivel:
+                return 'indisponivel', None
+            
+            existente = None
+            if upsert:
+                faixa = self._faixa(data_registro, data_registro)
+                existente = self._registros[faixa[0][1]] if faixa else None
+            
+            if existente:
+                antiga = self._linha(existente)
+                existente.update(zip(COLUNAS_INSERCAO + METRICAS_DERIVADAS, com_derivadas(valores)))
+                registro, evento, status = existente, 'atualizado', 'atualizado'
+            else:
+                registro = self._novo_registro(valores)
+                bisect.insort(self._ordem, (data_registro, registro['id']))
+                evento, status = 'inserido', 'inserido'
+            
+            if chave_idempotencia:
+                self._chaves_idempotencia[chave_idempotencia] = (hash_payload, registro['id'])
+            self._versao += 1
+            linha = self._linha(registro)
+            self._registrar_log(*self._entrada_log(evento, linha))
+        
+        self._notificar(evento, [antiga, linha] if existente else [linha])
+        return status, registro['id']
+    
+    def deletar_lote(self, ids=None, inicio=None, fim=None):
+        if not (ids or inicio or fim):
+            return 0
+        with self._lock:
+            alvos = self._faixa(inicio, fim)
+            if ids:
+                ids = set(ids)
+                alvos = [chave for chave in alvos if chave[1] in ids]
+            removidas = set(alvos)
+            if removidas:
+                self._ordem = [chave for chave in self._ordem if chave not in removidas]
+                self._versao += 1
+            linhas = [self._linha(self._registros.pop(i)) for _, i in alvos]
+            for linha in linhas:
+                self._registrar_log(*self._entrada_log('deletado', linha))
+        
+        if linhas:
+            self._notificar('deletado', linhas)
+        return len(linhas)
+    
+    def _registrar_log(self, operacao, registro_id, data_registro, dados):
+        self._log.append({
+            'seq': len(self._log) + 1, 'operacao': operacao, 'registro_id': registro_id,
+            'data_registro': data_registro, 'dados': json.loads(dados),
+            'criado_em': datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+        })
+    
+    def _ler_alteracoes(self, apos, limite):
+        # seq = posição + 1 (sem retenção neste motor)
+        with self._lock:
+            return self._log[apos:apos + limite], (1 if self._log else None)
+    
+    def get_ultimo_seq(self):
+        with self._lock:
+            return len(self._log)
+    
+    def get_dias_margem_abaixo(self, limite=10.0, inicio=None, fim=None):
+        with self._lock:
+            registros = [self._registros[i] for _, i in self._faixa(inicio, fim)]
+        return sorted(({c: r[c] for c in ('id', 'data_registro', 'vendas', 'despesas', 'lucro', 'margem')}
+                       for r in registros if r['margem'] < limite), key=lambda r: r['margem'])
+    
+    def inserir_em_massa(self, lotes):
+        total = 0
+        with self._lock:
+            id_anterior = self._ultimo_id
+            for lote in lotes:
+                for valores in lote:
+                    self._ordem.append((valores[6], self._novo_registro(valores)['id']))
+                total += len(lote)
+            self._ordem.sort()
+            self._versao += 1
+            self._registrar_log('carga_em_massa', None, None, json.dumps({
+                'id_inicial': id_anterior + 1, 'id_final': id_anterior + total, 'linhas': total}))
+        self._notificar('carga_em_massa', [])
+        return total
+
+def criar_armazenamento(tipo=None, caminho=None, adiar_inicializacao=False):
+    """Fábrica de motores: 'sqlite' (arquivo), 'sqlite-memoria' ou 'memoria'"""
+    tipo = tipo or Config.ARMAZENAMENTO
+    if tipo == 'memoria':
+        return ArmazenamentoMemoria()
+    if tipo == 'sqlite-memoria':
+        return ArmazenamentoSQLiteMemoria(adiar_inicializacao=adiar_inicializacao)
+    if tipo != 'sqlite':
+        print(f"⚠️ Armazenamento desconhecido '{tipo}', usando sqlite")
+    return DatabaseManager(caminho, adiar_inicializacao=adiar_inicializacao)
+
+def comparar_armazenamentos(linhas=100000, repeticoes=20, semente=42):
+    """Mede carga, KPIs por período, histórico e inserções em cada motor"""
+    import tempfile
+    resultados = {}
+    for tipo in ('sqlite', 'sqlite-memoria', 'memoria'):
+        with tempfile.TemporaryDirectory(prefix='insightpro-motor-') as pasta:
+            motor = criar_armazenamento(tipo, os.path.join(pasta, 'comparacao.db') if tipo == 'sqlite' else None)
+            try:
+                gerador = GeradorDados(semente=semente, linhas_por_dia=max(1, linhas // 365))
+                medidas = {}
+                
+                inicio = time.perf_counter()
+                motor.inserir_em_massa(gerador.lotes(linhas))
+                medidas['carga_s'] = round(time.perf_counter() - inicio, 3)
+                
+                for periodo in PERIODOS:
+                    inicio = time.perf_counter()
+                    for _ in range(repeticoes):
+                        motor.get_kpis(periodo)
+                    medidas[f'kpis_{periodo}_ms'] = round((time.perf_counter() - inicio) * 1000 / repeticoes, 3)
+                
+                inicio = time.perf_counter()
+                for _ in range(repeticoes):
+                    motor.get_historico()
+                    motor.get_dados_recentes()
+                medidas['historico+recentes_ms'] = round((time.perf_counter() - inicio) * 1000 / repeticoes, 3)
+                
+                inicio = time.perf_counter()
+                for i in range(repeticoes):
+                    motor.registrar_dados(1000.0, 600.0, 400.0, 1.0, 100.0, 10, date.today().strftime('%Y-%m-%d'))
+                medidas['insercao_ms'] = round((time.perf_counter() - inicio) * 1000 / repeticoes, 3)
+                resultados[tipo] = medidas
+            finally:
+                motor.fechar()
+    return resultados
+
+def _percentil(amostras, p):
+    ordenadas = sorted(amostras)
+    return ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * p))]
+
+def comparar_perfis_pragma(linhas=200000, repeticoes=200, semente=42):
+    """Mede cada perfil de PRAGMA num banco em arquivo novo: vazão de carga, latência de
+    inserção individual (um commit cada, onde synchronous pesa) e de leituras que vão ao SQL"""
+    import tempfile
+    perfil_original = Config.PERFIL_PRAGMA
+    resultados = {}
+    try:
+        for perfil in PERFIS_PRAGMA:
+            Config.PERFIL_PRAGMA = perfil
+            # Diretório apagado ao fim de cada perfil: três bancos de `linhas` registros não ficam no /tmp
+            with tempfile.TemporaryDirectory(prefix='insightpro-perfil-') as pasta:
+                motor = DatabaseManager(os.path.join(pasta, 'perfil.db'))
+                try:
+                    gerador = GeradorDados(semente=semente, linhas_por_dia=max(1, linhas // 365))
+                    medidas = {}
+                    
+                    inicio = time.perf_counter()
+                    motor.inserir_em_massa(gerador.lotes(linhas))
+                    medidas['carga_linhas_s'] = round(linhas / (time.perf_counter() - inicio))
+                    
+                    amostras = []
+                    hoje = date.today().strftime('%Y-%m-%d')
+                    for _ in range(repeticoes):
+                        inicio = time.perf_counter()
+                        motor.registrar_dados(1000.0, 600.0, 400.0, 1.0, 100.0, 10, hoje)
+                        amostras.append((time.perf_counter() - inicio) * 1000)
+                    medidas['insercao_p50_ms'] = round(_percentil(amostras, 0.5), 3)
+                    medidas['insercao_p95_ms'] = round(_percentil(amostras, 0.95), 3)
+                    
+                    leituras = {
+                        'recentes': lambda: motor.get_dados_recentes(),
+                        'margem_baixa': lambda: motor.get_dias_margem_abaixo(20.0),
+                        'resumo_mensal': lambda: motor.get_resumo('mes'),
+                    }
+                    for nome, leitura in leituras.items():
+                        amostras = []
+                        for _ in range(max(1, repeticoes // 10)):
+                            inicio = time.perf_counter()
+                            leitura()
+                            amostras.append((time.perf_counter() - inicio) * 1000)
+                        medidas[f'{nome}_p50_ms'] = round(_percentil(amostras, 0.5), 3)
+                    
+                    medidas['manutencao_ms'] = (motor.manutencao(analisar=True) or {}).get('duracao_ms')
+                    resultados[perfil] = medidas
+                finally:
+                    motor.fechar()
+    finally:
+        Config.PERFIL_PRAGMA = perfil_original
+    return resultados
+
+# ===== GERADOR DE DADOS SINTÉTICOS =====
+# Tuplas de entrada (geradores, cargas em massa); as derivadas são acrescentadas na gravação
+COLUNAS_INSERCAO = ('vendas', 'despesas', 'lucro', 'crescimento', 'ticket_medio', 'clientes_ativos', 'data_registro')
+
+SQL_INSERIR_INDICADOR = f'''
+    INSERT INTO indicadores 
+    ({', '.join(COLUNAS_INSERCAO + METRICAS_DERIVADAS)})
+    VALUES ({', '.join('?' * (len(COLUNAS_INSERCAO) + len(METRICAS_DERIVADAS)))})
+'''
+
+SQL_REGISTRAR_ALTERACAO = '''
+    INSERT INTO log_alteracoes (operacao, registro_id, data_registro, dados) VALUES (?, ?, ?, ?)
+'''
+
+def com_derivadas(valores):
+    """Tupla de COLUNAS_INSERCAO + derivadas, na ordem de SQL_INSERIR_INDICADOR"""
+    return (*valores, *calcular_derivadas(valores[0], valores[1], valores[2], valores[5]))
+
+# Sazonalidade semanal (segunda..domingo) aplicada ao nível de vendas
+FATORES_DIA_SEMANA = (0.92, 0.95, 1.0, 1.03, 1.15, 1.22, 0.78)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class GeradorDados:
+    """Gera indicadores realistas (tendência, sazonalidade semanal, ruído e outliers) em lotes
+    
+    Com numpy, cada lote é calculado de forma vetorizada; sem ele, usa listas por
+    compreensão. A mesma semente reproduz os mesmos dados no mesmo backend.
+    """
+    def __init__(self, semente=None, inicio=None, linhas_por_dia=1, vendas_base=8000.0,
+                 tendencia=0.0005, ruido=0.08, prob_outlier=0.01, usar_numpy=True):
+        self.semente = semente
+        self.inicio = inicio or date.today() - timedelta(days=365)
+        self.linhas_por_dia = max(1, int(linhas_por_dia))
+        self.vendas_base = vendas_base
+        self.tendencia = tendencia
+        self.ruido = ruido
+        self.prob_outlier = prob_outlier
+        self.usar_numpy = usar_numpy and numpy is not None
+    
+    def _datas(self, dia_inicial, dia_final):
+        inicio = self.inicio + timedelta(days=dia_inicial)
+        return [(inicio + timedelta(days=d)).strftime('%Y-%m-%d') for d in range(dia_final - dia_inicial + 1)]
     
-    def get_historico(self, limite=30):
-        """Obtém histórico limitado para análise"""
-        conn = self.conectar()
-        if not conn:
-            return []
+    def lotes(self, total, tamanho_lote=50000):
+        """Gera listas de tuplas na ordem de SQL_INSERIR_INDICADOR"""
+        if self.usar_numpy:
+            rng = numpy.random.default_rng(self.semente)
+            gerar = lambda a, b: self._lote_numpy(rng, a, b)
+        else:
+            rng = random.Random(self.semente)
+            gerar = lambda a, b: self._lote_python(rng, a, b)
         
-        try:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT * FROM indicadores 
-                ORDER BY data_registro DESC 
-                LIMIT ?
-            ''', (limite,))
-            
-            return [dict(row) for row in cursor.fetchall()]
-        except Exception as e:
-            print(f"❌ Erro ao obter histórico: {e}")
-            return []
-        finally:
-            conn.close()
+        for a in range(0, total, tamanho_lote):
+            yield gerar(a, min(a + tamanho_lote, total))
+    
+    def _lote_numpy(self, rng, a, b):
+        np = numpy
+        n = b - a
+        dia = np.arange(a, b) // self.linhas_por_dia
+        dia_semana = (self.inicio.weekday() + dia) % 7
+        nivel = 1 + self.tendencia * dia
+        
+        vendas = self.vendas_base * nivel * np.asarray(FATORES_DIA_SEMANA)[dia_semana] * (1 + rng.normal(0, self.ruido, n))
+        outliers = rng.random(n) < self.prob_outlier
+        vendas[outliers] *= rng.choice((0.3, 2.5), outliers.sum())
+        vendas = np.maximum(vendas, 100).round(2)
+        despesas = (vendas * rng.uniform(0.55, 0.72, n)).round(2)
+        lucro = (vendas - despesas).round(2)
+        crescimento = (self.tendencia * 7 / nivel * 100 + rng.normal(0, 2, n)).round(2)
+        ticket_medio = np.maximum(120 * (1 + self.tendencia * dia / 2) * (1 + rng.normal(0, 0.08, n)), 10).round(2)
+        clientes_ativos = np.maximum((vendas / ticket_medio).round(), 1).astype(np.int64)
+        
+        datas = self._datas(int(dia[0]), int(dia[-1]))
+        data_registro = [datas[d] for d in (dia - dia[0]).tolist()]
+        return list(zip(vendas.tolist(), despesas.tolist(), lucro.tolist(), crescimento.tolist(),
+                        ticket_medio.tolist(), clientes_ativos.tolist(), data_registro))
+    
+    def _lote_python(self, rng, a, b):
+        dia_inicial = a // self.linhas_por_dia
+        datas = self._datas(dia_inicial, (b - 1) // self.linhas_por_dia)
+        linhas = []
+        for i in range(a, b):
+            dia = i // self.linhas_por_dia
+            nivel = 1 + self.tendencia * dia
+            vendas = self.vendas_base * nivel * FATORES_DIA_SEMANA[(self.inicio.weekday() + dia) % 7]
+            vendas *= 1 + rng.gauss(0, self.ruido)
+            if rng.random() < self.prob_outlier:
+                vendas *= rng.choice((0.3, 2.5))
+            vendas = round(max(vendas, 100), 2)
+            despesas = round(vendas * rng.uniform(0.55, 0.72), 2)
+            ticket_medio = round(max(120 * (1 + self.tendencia * dia / 2) * (1 + rng.gauss(0, 0.08)), 10), 2)
+            linhas.append((
+                vendas, despesas, round(vendas - despesas, 2),
+                round(self.tendencia * 7 / nivel * 100 + rng.gauss(0, 2), 2),
+                ticket_medio, max(int(round(vendas / ticket_medio)), 1),
+                datas[dia - dia_inicial]
+            ))
+        return linhas
+    
+    def popular(self, db_manager, total, tamanho_lote=50000):
+        """Carga em massa via inserir_em_massa do motor (uma única transação no SQLite)"""
+        if self.linhas_por_dia > 1 and db_manager.upsert_disponivel:
+            print("❌ Upsert diário ativo: use linhas_por_dia=1")
+            return 0
+        
+        inicio = time.perf_counter()
+        total = db_manager.inserir_em_massa(self.lotes(total, tamanho_lote))
+        if not total:
+            return 0
+        duracao = time.perf_counter() - inicio
+        print(f"✅ {total:,} registros gerados em {duracao:.1f}s ({total / max(duracao, 1e-9):,.0f} linhas/s)")
+        return total
 
-    def get_dados_recentes(self, limite=10):
-        """Obtém dados recentes para exibição na tabela"""
-        conn = self.conectar()
-        if not conn:
-            return []
+# ===== EXPORTAÇÃO EM STREAMING =====
+COLUNAS_EXPORTACAO = ('id', 'vendas', 'despesas', 'lucro', 'crescimento',
+                      'ticket_medio', 'clientes_ativos', 'data_registro', 'created_at')
+
+class _SaidaStreaming:
+    """Arquivo somente-escrita que acumula bytes até serem drenados pela resposta"""
+    def __init__(self):
+        self.partes = []
+        self.posicao = 0
+        self.closed = False
+    
+    def write(self, dados):
+        dados = bytes(dados)
+        self.partes.append(dados)
+        self.posicao += len(dados)
+        return len(dados)
+    
+    def tell(self):
+        return self.posicao
+    
+    def writable(self):
+        return True
+    
+    def seekable(self):
+        return False
+    
+    def flush(self):
+        pass
+    
+    def close(self):
+        self.closed = True
+    
+    def drenar(self):
+        dados = b''.join(self.partes)
+        self.partes.clear()
+        return dados
+
+class ExportadorDados:
+    """Serializa lotes de linhas de `indicadores` em CSV, JSONL, Parquet ou Arrow"""
+    FORMATOS = {
+        'csv': 'text/csv; charset=utf-8',
+        'jsonl': 'application/x-ndjson',
+        'parquet': 'application/vnd.apache.parquet',
+        'arrow': 'application/vnd.apache.arrow.stream',
+    }
+    
+    @staticmethod
+    def csv(lotes):
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer)
+        escritor.writerow(COLUNAS_EXPORTACAO)
+        # Cabeçalho sai antes da consulta: primeiro byte imediato
+        yield buffer.getvalue()
+        
+        for linhas in lotes:
+            buffer.seek(0)
+            buffer.truncate()
+            escritor.writerows(linhas)
+            yield buffer.getvalue()
+    
+    @staticmethod
+    def jsonl(lotes):
+        for linhas in lotes:
+            yield ''.join(
+                json.dumps(dict(zip(COLUNAS_EXPORTACAO, linha)), ensure_ascii=False) + '\n'
+                for linha in linhas
+            )
+    
+    @staticmethod
+    def _schema_arrow(pa):
+        return pa.schema([
+            ('id', pa.int64()),
+            ('vendas', pa.float64()),
+            ('despesas', pa.float64()),
+            ('lucro', pa.float64()),
+            ('crescimento', pa.float64()),
+            ('ticket_medio', pa.float64()),
+            ('clientes_ativos', pa.int64()),
+            ('data_registro', pa.string()),
+            ('created_at', pa.string()),
+        ])
+    
+    @staticmethod
+    def _lote_arrow(pa, schema, linhas):
+        colunas = list(zip(*linhas))
+        return pa.RecordBatch.from_arrays(
+            [pa.array(coluna, type=campo.type) for coluna, campo in zip(colunas, schema)],
+            schema=schema
+        )
+    
+    @staticmethod
+    def parquet(lotes):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
         
+        schema = ExportadorDados._schema_arrow(pa)
+        saida = _SaidaStreaming()
+        escritor = pq.ParquetWriter(saida, schema, compression='zstd')
         try:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT id, vendas, despesas, lucro, crescimento, 
-                       ticket_medio, clientes_ativos, data_registro,
-                       created_at
-                FROM indicadores 
-                ORDER BY data_registro DESC, created_at DESC 
-                LIMIT ?
-            ''', (limite,))
-            
-            return [dict(row) for row in cursor.fetchall()]
-        except Exception as e:
-            print(f"❌ Erro ao obter dados recentes: {e}")
-            return []
+            # Cada lote vira um row group, enviado assim que é escrito
+            for linhas in lotes:
+                escritor.write_batch(ExportadorDados._lote_arrow(pa, schema, linhas))
+                yield saida.drenar()
         finally:
-            conn.close()
+            escritor.close()
+        yield saida.drenar()
     
-    def inserir_dados(self, vendas, despesas, lucro, crescimento, ticket_medio, clientes_ativos, data_registro):
-        """Insere novos dados no banco"""
-        conn = self.conectar()
-        if not conn:
-            return False
+    @staticmethod
+    def arrow(lotes):
+        import pyarrow as pa
         
+        schema = ExportadorDados._schema_arrow(pa)
+        saida = _SaidaStreaming()
+        escritor = pa.ipc.new_stream(saida, schema)
+        yield saida.drenar()
         try:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO indicadores 
-                (vendas, despesas, lucro, crescimento, ticket_medio, clientes_ativos, data_registro)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (vendas, despesas, lucro, crescimento, ticket_medio, clientes_ativos, data_registro))
-            
-            conn.commit()
-            print(f"✅ Dados inseridos com sucesso para {data_registro}")
-            return True
-        except Exception as e:
-            print(f"❌ Erro ao inserir dados: {e}")
-            return False
+            for linhas in lotes:
+                escritor.write_batch(ExportadorDados._lote_arrow(pa, schema, linhas))
+                yield saida.drenar()
         finally:
-            conn.close()
+            escritor.close()
+        yield saida.drenar()
     
-    def deletar_dados(self, id):
-        """Remove dados específicos pelo ID"""
-        conn = self.conectar()
-        if not conn:
-            return False
-        
+    @staticmethod
+    def colunar_disponivel():
         try:
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM indicadores WHERE id = ?', (id,))
-            conn.commit()
-            
-            if cursor.rowcount > 0:
-                print(f"✅ Dados ID {id} removidos com sucesso")
-                return True
-            else:
-                print(f"⚠️ Nenhum dado encontrado com ID {id}")
-                return False
-        except Exception as e:
-            print(f"❌ Erro ao deletar dados: {e}")
+            import pyarrow
+            return True
+        except ImportError:
             return False
-        finally:
-            conn.close()
 
 # ===== SISTEMA DE IA PARA SUGESTÕES =====
 # ===== SISTEMA DE IA PARA SUGESTÕES (MELHORADO) =====
+# Textos por código: a análise produz apenas (código, parâmetros) e o HTML é montado aqui
+TEXTOS_SUGESTAO = {
+    'margem_critica': "⚠️ <strong>Margem crítica</strong> ({margem:.1f}%): Risco de prejuízo! Revisar custos operacionais e precificação",
+    'margem_moderada': "🔸 <strong>Margem moderada</strong> ({margem:.1f}%): Otimize processos e reduza desperdícios para melhorar",
+    'margem_excelente': "✅ <strong>Margem excelente</strong> ({margem:.1f}%): Considere investir em expansão ou novos produtos",
+    'despesas_muito_altas': "🔴 <strong>Despesas muito altas</strong> ({razao_despesas:.1f}% da receita): Priorize redução de custos urgentemente",
+    'despesas_acima_ideal': "🔸 <strong>Despesas acima do ideal</strong> ({razao_despesas:.1f}%): Analise contratos e negocie melhores condições",
+    'queda_acentuada': "📉 <strong>Queda acentuada</strong> ({crescimento:.1f}%): Realize promoções urgentes e análise de mercado",
+    'desaceleracao': "🔻 <strong>Desaceleração</strong> ({crescimento:.1f}%): Revise estratégias de marketing e vendas",
+    'crescimento_acelerado': "🚀 <strong>Crescimento acelerado</strong> ({crescimento:.1f}%): Garanta capacidade operacional para sustentar",
+    'baixo_valor_cliente': "💡 <strong>Baixo valor por cliente</strong> (R${receita_por_cliente:.2f}): Implemente programas de fidelização e upsell",
+    'alto_valor_cliente': "💎 <strong>Alto valor por cliente</strong> (R${receita_por_cliente:.2f}): Invista em experiência premium e retenção",
+    'tendencia_vendas_negativa': "📉 <strong>Tendência negativa de vendas</strong> ({tendencia_vendas:.1f}%): Investigar causas imediatamente",
+    'tendencia_vendas_positiva': "📈 <strong>Tendência positiva de vendas</strong> ({tendencia_vendas:.1f}%): Capitalize no momento favorável",
+    'erosao_lucros': "⚠️ <strong>Erosão de lucros</strong> ({tendencia_lucros:.1f}%): Revisar estrutura de custos urgentemente",
+    'padrao_semanal': "📅 <strong>Padrão semanal</strong>: {dia_nome} vende {variacao:.0f}% acima da média diária (índice sazonal)",
+    'performance_excepcional': "🌟 <strong>Performance excepcional</strong>: Considere investir em novos mercados ou aquisições",
+    'oportunidade_valor': "💡 <strong>Oportunidade de valor</strong>: Desenvolva produtos premium para aumentar ticket médio",
+    'alerta_eficiencia': "⚠️ <strong>Alerta de eficiência</strong>: Mesmo com alto volume, despesas comprometem lucratividade",
+    'indicadores_estaveis': "✅ <strong>Indicadores estáveis</strong>: Continue monitorando e buscando pequenas melhorias",
+}
+
+DIAS_NOME = ['Segunda', 'Terça', 'Quarta', 'Quinta', 'Sexta', 'Sábado', 'Domingo']
+
+# Ordem de prioridade na exibição (menor índice = mais urgente)
+SEVERIDADES = ('critica', 'alerta', 'info', 'positiva')
+
+def _arredondar(valor):
+    return round(valor, 2) if isinstance(valor, float) else valor
+
+class Sugestao:
+    """Sugestão tipada: o HTML só é gerado na borda (renderização)"""
+    __slots__ = ('codigo', 'severidade', 'metrica', 'valor', 'limites', 'params')
+    
+    def __init__(self, codigo, severidade, metrica=None, valor=None, limites=None, params=None):
+        self.codigo = codigo
+        self.severidade = severidade
+        self.metrica = metrica
+        self.valor = valor
+        self.limites = limites or []
+        self.params = params or {}
+    
+    def texto(self):
+        return TEXTOS_SUGESTAO[self.codigo].format(**self.params)
+    
+    def html(self):
+        if self.severidade == 'critica':
+            return f"<div class='urgencia'>{self.texto()}</div>"
+        return self.texto()
+    
+    def para_dict(self):
+        return {
+            'codigo': self.codigo,
+            'severidade': self.severidade,
+            'metrica': self.metrica,
+            'valor': _arredondar(self.valor),
+            'limites': self.limites,
+            'params': {k: _arredondar(v) for k, v in self.params.items()},
+        }
+
+class Regra:
+    """Regra de limiar: todas as condições (metrica, operador, limite) devem valer"""
+    OPERADORES = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+    
+    def __init__(self, codigo, severidade, condicoes):
+        self.codigo = codigo
+        self.severidade = severidade
+        self.condicoes = condicoes
+        self.metrica = condicoes[0][0]
+    
+    def avaliar(self, valores):
+        try:
+            if not all(self.OPERADORES[op](valores[metrica], limite) for metrica, op, limite in self.condicoes):
+                return None
+        except KeyError:
+            # Métrica indisponível (ex.: tendência sem histórico suficiente)
+            return None
+        return Sugestao(
+            self.codigo, self.severidade, self.metrica, valores[self.metrica],
+            [list(c) for c in self.condicoes], {self.metrica: valores[self.metrica]}
+        )
+    
+    def mascara(self, colunas, n):
+        """Avaliação vetorizada: booleano por linha de uma tabela colunar (ausente/NaN = falso)"""
+        if any(metrica not in colunas for metrica, _, _ in self.condicoes):
+            return numpy.zeros(n, dtype=bool) if numpy is not None else [False] * n
+        if numpy is not None:
+            resultado = numpy.ones(n, dtype=bool)
+            for metrica, op, limite in self.condicoes:
+                resultado &= self.OPERADORES[op](colunas[metrica], limite)
+            return resultado
+        comparacoes = [(colunas[metrica], self.OPERADORES[op], limite) for metrica, op, limite in self.condicoes]
+        return [all(coluna[i] is not None and op(coluna[i], limite) for coluna, op, limite in comparacoes)
+                for i in range(n)]
+
+# Regras na ordem original de avaliação; faixas da mesma métrica não se sobrepõem
+REGRAS = [
+    # Análise de saúde financeira
+    Regra('margem_critica', 'critica', [('margem', '<', 10)]),
+    Regra('margem_moderada', 'alerta', [('margem', '>=', 10), ('margem', '<', 20)]),
+    Regra('margem_excelente', 'positiva', [('margem', '>', 40)]),
+    # Análise de eficiência operacional
+    Regra('despesas_muito_altas', 'critica', [('razao_despesas', '>', 75)]),
+    Regra('despesas_acima_ideal', 'alerta', [('razao_despesas', '>', 60), ('razao_despesas', '<=', 75)]),
+    # Análise de crescimento sustentável
+    Regra('queda_acentuada', 'alerta', [('crescimento', '<', -5)]),
+    Regra('desaceleracao', 'alerta', [('crescimento', '>=', -5), ('crescimento', '<', 0)]),
+    Regra('crescimento_acelerado', 'info', [('crescimento', '>', 15)]),
+    # Análise de valor do cliente
+    Regra('baixo_valor_cliente', 'alerta', [('receita_por_cliente', '<', 50)]),
+    Regra('alto_valor_cliente', 'positiva', [('receita_por_cliente', '>', 200)]),
+    # Tendências (dependem do histórico)
+    Regra('tendencia_vendas_negativa', 'alerta', [('tendencia_vendas', '<', -5)]),
+    Regra('tendencia_vendas_positiva', 'positiva', [('tendencia_vendas', '>', 5)]),
+    Regra('erosao_lucros', 'critica', [('tendencia_lucros', '<', -8)]),
+]
+
+# Recomendações estratégicas (avaliadas após o padrão semanal)
+REGRAS_ESTRATEGICAS = [
+    Regra('performance_excepcional', 'positiva', [('lucro', '>', 5000), ('crescimento', '>', 8)]),
+    Regra('oportunidade_valor', 'info', [('clientes_ativos', '>', 100), ('ticket_medio', '<', 80)]),
+    Regra('alerta_eficiencia', 'critica', [('vendas', '>', 20000), ('razao_despesas', '>', 70)]),
+]
+
+class AnaliseIA:
+    """Resultado de uma análise: sugestões ranqueadas + resumo, renderizável em vários formatos"""
+    def __init__(self, sugestoes, resumo):
+        self.sugestoes = sugestoes
+        self.resumo = resumo
+        self._html = None
+    
+    def html(self):
+        """Lista de blocos HTML exibida no dashboard (renderizada uma única vez)"""
+        if self._html is None:
+            self._html = self._renderizar_html()
+        return self._html
+    
+    def _renderizar_html(self):
+        resumo = self.resumo
+        margem = resumo['margem']
+        razao_despesas = resumo['razao_despesas']
+        crescimento = resumo['crescimento']
+        lucro = resumo['lucro']
+        
+        blocos = [s.html() for s in self.sugestoes]
+        
+        # Rodapé com análise resumida
+        blocos.append(f"""
+        <div class='ia-resumo'>
+            <p><strong>🔍 Resumo Financeiro:</strong></p>
+            <p>Margem Líquida: {margem:.1f}% | Rentabilidade: {'✅' if lucro > 0 else '⚠️'}</p>
+            <p>Eficiência Operacional: {'🔴' if razao_despesas > 70 else '🔸' if razao_despesas > 60 else '✅'}</p>
+            <p>Saúde do Crescimento: {'🚀' if crescimento > 10 else '📈' if crescimento > 0 else '📉'}</p>
+        </div>
+        """)
+        
+        # Rodapé
+        blocos.append("""
+        <div class='ia-footer'>
+            <p><strong>🤖 InsightPro AI - Análise Avançada</strong></p>
+            <p>Desenvolvido por Dione Castro Alves | InNovaIdeia © 2025</p>
+        </div>
+        """)
+        return blocos
+    
+    def compacto(self):
+        """Payload compacto (sem HTML) para clientes que renderizam por código"""
+        return {
+            'sugestoes': [
+                {'codigo': s.codigo, 'severidade': s.severidade,
+                 'params': {k: _arredondar(v) for k, v in s.params.items()}}
+                for s in self.sugestoes
+            ],
+            'resumo': {k: _arredondar(v) for k, v in self.resumo.items()},
+        }
+    
+    def para_dict(self):
+        """Representação completa para consumidores JSON e de alertas"""
+        return {
+            'sugestoes': [s.para_dict() for s in self.sugestoes],
+            'resumo': {k: _arredondar(v) for k, v in self.resumo.items()},
+        }
+
+class ResultadoLote:
+    """Sugestões de muitas linhas de KPIs: uma máscara booleana por regra, sem HTML"""
+    def __init__(self, regras, mascaras, n, datas=None):
+        # Regras já em ordem de prioridade (severidade, depois ordem de avaliação)
+        self.regras = regras
+        self.mascaras = mascaras
+        self.n = n
+        self.datas = datas
+        if numpy is not None:
+            disparou = numpy.zeros(n, dtype=bool)
+            for mascara in mascaras.values():
+                disparou |= mascara
+            self.mascaras['indicadores_estaveis'] = ~disparou
+        else:
+            self.mascaras['indicadores_estaveis'] = [
+                not any(mascara[i] for mascara in mascaras.values()) for i in range(n)
+            ]
+        self.codigos_ordenados = [regra.codigo for regra in regras] + ['indicadores_estaveis']
+    
+    def codigos(self, i):
+        """Códigos disparados na linha i, na mesma ordem de analisar()"""
+        return [codigo for codigo in self.codigos_ordenados if self.mascaras[codigo][i]]
+    
+    def linhas(self):
+        return [self.codigos(i) for i in range(self.n)]
+    
+    def frequencias(self):
+        """Quantas vezes (e quando, primeira/última) cada alerta teria disparado"""
+        relatorio = {}
+        for codigo in self.codigos_ordenados:
+            mascara = self.mascaras[codigo]
+            indices = numpy.flatnonzero(mascara).tolist() if numpy is not None else [
+                i for i, ativo in enumerate(mascara) if ativo]
+            relatorio[codigo] = {
+                'disparos': len(indices),
+                'taxa': round(len(indices) / self.n, 4) if self.n else 0,
+                'primeira': self.datas[indices[0]] if self.datas and indices else None,
+                'ultima': self.datas[indices[-1]] if self.datas and indices else None,
+            }
+        return relatorio
+    
+    def para_dict(self, detalhes=False):
+        resultado = {'linhas': self.n, 'frequencias': self.frequencias()}
+        if detalhes:
+            resultado['detalhes'] = [
+                {'data_registro': self.datas[i] if self.datas else i, 'codigos': self.codigos(i)}
+                for i in range(self.n)
+            ]
+        return resultado
+
 class SugestaoIA:
     @staticmethod
-    def gerar_sugestao_completa(kpis, historico=None):
-        """Sistema inteligente de sugestões baseado em KPIs e análise preditiva"""
-        sugestoes = []
-        
+    def calcular_metricas(kpis, historico=None):
+        """KPIs + métricas derivadas usadas pelas regras"""
         vendas = kpis.get('vendas', 0)
         despesas = kpis.get('despesas', 0)
         lucro = kpis.get('lucro', 0)
-        crescimento = kpis.get('crescimento', 0)
-        ticket_medio = kpis.get('ticket_medio', 0)
         clientes_ativos = kpis.get('clientes_ativos', 0)
+        if 'margem' in kpis:
+            margem, razao_despesas, receita_por_cliente = (kpis[m] for m in METRICAS_DERIVADAS)
+        else:
+            margem, razao_despesas, receita_por_cliente = calcular_derivadas(vendas, despesas, lucro, clientes_ativos)
         
-        # === ANÁLISE FUNDAMENTAL AVANÇADA ===
-        margem = (lucro / vendas * 100) if vendas > 0 else 0
-        razao_despesas = (despesas / vendas * 100) if vendas > 0 else 0
-        receita_por_cliente = vendas / clientes_ativos if clientes_ativos > 0 else 0
-        
-        # Análise de saúde financeira
-        if margem < 10:
-            sugestoes.append(f"⚠️ <strong>Margem crítica</strong> ({margem:.1f}%): Risco de prejuízo! Revisar custos operacionais e precificação")
-        elif margem < 20:
-            sugestoes.append(f"🔸 <strong>Margem moderada</strong> ({margem:.1f}%): Otimize processos e reduza desperdícios para melhorar")
-        elif margem > 40:
-            sugestoes.append(f"✅ <strong>Margem excelente</strong> ({margem:.1f}%): Considere investir em expansão ou novos produtos")
-        
-        # Análise de eficiência operacional
-        if razao_despesas > 75:
-            sugestoes.append(f"🔴 <strong>Despesas muito altas</strong> ({razao_despesas:.1f}% da receita): Priorize redução de custos urgentemente")
-        elif razao_despesas > 60:
-            sugestoes.append(f"🔸 <strong>Despesas acima do ideal</strong> ({razao_despesas:.1f}%): Analise contratos e negocie melhores condições")
-        
-        # Análise de crescimento sustentável
-        if crescimento < -5:
-            sugestoes.append(f"📉 <strong>Queda acentuada</strong> ({crescimento:.1f}%): Realize promoções urgentes e análise de mercado")
-        elif crescimento < 0:
-            sugestoes.append(f"🔻 <strong>Desaceleração</strong> ({crescimento:.1f}%): Revise estratégias de marketing e vendas")
-        elif crescimento > 15:
-            sugestoes.append(f"🚀 <strong>Crescimento acelerado</strong> ({crescimento:.1f}%): Garanta capacidade operacional para sustentar")
-        
-        # Análise de valor do cliente
-        if receita_por_cliente < 50:
-            sugestoes.append(f"💡 <strong>Baixo valor por cliente</strong> (R${receita_por_cliente:.2f}): Implemente programas de fidelização e upsell")
-        elif receita_por_cliente > 200:
-            sugestoes.append(f"💎 <strong>Alto valor por cliente</strong> (R${receita_por_cliente:.2f}): Invista em experiência premium e retenção")
+        valores = {
+            'vendas': vendas,
+            'despesas': despesas,
+            'lucro': lucro,
+            'crescimento': kpis.get('crescimento', 0),
+            'ticket_medio': kpis.get('ticket_medio', 0),
+            'clientes_ativos': clientes_ativos,
+            # === ANÁLISE FUNDAMENTAL AVANÇADA ===
+            'margem': margem,
+            'razao_despesas': razao_despesas,
+            'receita_por_cliente': receita_por_cliente,
+        }
         
         # === ANÁLISE PREDITIVA E TENDÊNCIAS ===
         if historico and len(historico) >= 7:
@@ -305,69 +3330,439 @@ class SugestaoIA:
                 # Tendência dos últimos 7 dias
                 vendas_recentes = [h['vendas'] for h in historico[:7]]
                 lucros_recentes = [h['lucro'] for h in historico[:7]]
-                
-                # Cálculo de tendência
                 tendencia_vendas = (vendas_recentes[0] - vendas_recentes[-1]) / vendas_recentes[-1] * 100
                 tendencia_lucros = (lucros_recentes[0] - lucros_recentes[-1]) / lucros_recentes[-1] * 100
-                
-                if tendencia_vendas < -5:
-                    sugestoes.append(f"📉 <strong>Tendência negativa de vendas</strong> ({tendencia_vendas:.1f}%): Investigar causas imediatamente")
-                elif tendencia_vendas > 5:
-                    sugestoes.append(f"📈 <strong>Tendência positiva de vendas</strong> ({tendencia_vendas:.1f}%): Capitalize no momento favorável")
-                
-                if tendencia_lucros < -8:
-                    sugestoes.append(f"⚠️ <strong>Erosão de lucros</strong> ({tendencia_lucros:.1f}%): Revisar estrutura de custos urgentemente")
-                
-                # Detecção de padrões sazonais
-                dias_semana = [datetime.strptime(h['data_registro'], '%Y-%m-%d').weekday() for h in historico[:7]]
-                melhor_dia = max(set(dias_semana), key=dias_semana.count)
-                dias_nome = ['Segunda', 'Terça', 'Quarta', 'Quinta', 'Sexta', 'Sábado', 'Domingo']
-                sugestoes.append(f"📅 <strong>Padrão semanal</strong>: Melhor desempenho às {dias_nome[melhor_dia]}s-feiras")
-                
+                valores['tendencia_vendas'] = tendencia_vendas
+                valores['tendencia_lucros'] = tendencia_lucros
             except Exception as e:
                 print(f"Erro na análise preditiva: {e}")
+        return valores
+    
+    @staticmethod
+    def priorizar(sugestoes):
+        """Ordena por severidade mantendo a ordem de geração entre iguais (heap)"""
+        heap = [(SEVERIDADES.index(s.severidade), ordem, s) for ordem, s in enumerate(sugestoes)]
+        heapq.heapify(heap)
+        return [heapq.heappop(heap)[2] for _ in range(len(heap))]
+    
+    @staticmethod
+    def analisar(kpis, historico=None, sazonalidade=None):
+        """Análise estruturada: AnaliseIA com sugestões tipadas e ranqueadas"""
+        valores = SugestaoIA.calcular_metricas(kpis, historico)
+        sugestoes = [s for s in (regra.avaliar(valores) for regra in REGRAS) if s]
         
-        # === RECOMENDAÇÕES ESTRATÉGICAS PERSONALIZADAS ===
-        if lucro > 5000 and crescimento > 8:
-            sugestoes.append("🌟 <strong>Performance excepcional</strong>: Considere investir em novos mercados ou aquisições")
-        
-        if clientes_ativos > 100 and ticket_medio < 80:
-            sugestoes.append("💡 <strong>Oportunidade de valor</strong>: Desenvolva produtos premium para aumentar ticket médio")
+        # Padrão semanal a partir dos índices sazonais (todo o histórico, não só a última semana)
+        dias = ((sazonalidade or {}).get('vendas') or {}).get('dia_semana') or {}
+        if len(dias) == 7 and all(d['registros'] >= 2 for d in dias.values()):
+            melhor_dia = max(dias, key=lambda d: dias[d]['indice'])
+            if dias[melhor_dia]['indice'] > 1.05:
+                sugestoes.append(Sugestao('padrao_semanal', 'info', 'dia_semana', dias[melhor_dia]['indice'],
+                                          params={'dia': melhor_dia, 'dia_nome': DIAS_NOME[melhor_dia],
+                                                  'variacao': (dias[melhor_dia]['indice'] - 1) * 100}))
         
-        if vendas > 20000 and razao_despesas > 70:
-            sugestoes.append("⚠️ <strong>Alerta de eficiência</strong>: Mesmo com alto volume, despesas comprometem lucratividade")
+        # === RECOMENDAÇÕES ESTRATÉGICAS PERSONALIZADAS ===
+        sugestoes.extend(s for s in (regra.avaliar(valores) for regra in REGRAS_ESTRATEGICAS) if s)
         
         # Fallback
         if not sugestoes:
-            sugestoes.append("✅ <strong>Indicadores estáveis</strong>: Continue monitorando e buscando pequenas melhorias")
+            sugestoes.append(Sugestao('indicadores_estaveis', 'info'))
+        
+        resumo = {
+            'margem': valores['margem'],
+            'razao_despesas': valores['razao_despesas'],
+            'crescimento': valores['crescimento'],
+            'lucro': valores['lucro'],
+        }
+        return AnaliseIA(SugestaoIA.priorizar(sugestoes), resumo)
+    
+    @staticmethod
+    def gerar_sugestao_completa(kpis, historico=None):
+        """Sistema inteligente de sugestões baseado em KPIs e análise preditiva"""
+        return SugestaoIA.analisar(kpis, historico).html()
+    
+    @staticmethod
+    def analisar_lote(tabela, datas=None):
+        """Avalia REGRAS + REGRAS_ESTRATEGICAS sobre uma tabela colunar {metrica: valores}
+        
+        Cada regra vira uma comparação vetorizada por coluna (numpy quando disponível).
+        As derivadas são calculadas se ausentes; tendências são opcionais (None/NaN =
+        indisponível). O padrão semanal depende de datas do histórico e não entra no lote.
+        """
+        n = len(next(iter(tabela.values()))) if tabela else 0
+        if numpy is not None:
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                colunas = {nome: numpy.asarray(valores, dtype=float) for nome, valores in tabela.items()}
+                vendas, despesas, lucro, clientes = (colunas[m] for m in METRICAS_ADITIVAS)
+                derivadas = {
+                    'margem': numpy.where(vendas > 0, lucro / vendas * 100, 0),
+                    'razao_despesas': numpy.where(vendas > 0, despesas / vendas * 100, 0),
+                    'receita_por_cliente': numpy.where(clientes > 0, vendas / clientes, 0),
+                }
+        else:
+            colunas = {nome: list(valores) for nome, valores in tabela.items()}
+            calculadas = [calcular_derivadas(*linha) for linha in zip(*(colunas[m] for m in METRICAS_ADITIVAS))]
+            derivadas = {nome: [linha[j] for linha in calculadas] for j, nome in enumerate(METRICAS_DERIVADAS)}
+        for nome, valores in derivadas.items():
+            colunas.setdefault(nome, valores)
+        
+        regras = sorted(REGRAS + REGRAS_ESTRATEGICAS, key=lambda r: SEVERIDADES.index(r.severidade))
+        mascaras = {regra.codigo: regra.mascara(colunas, n) for regra in regras}
+        return ResultadoLote(regras, mascaras, n, datas)
+    
+    @staticmethod
+    def tabela_historica(linhas, periodo='semana', inicio=None, fim=None):
+        """KPIs de cada dia como get_kpis os teria calculado naquele dia (tabela colunar)
+        
+        linhas: (data_registro, *METRICAS) em ordem de data. A janela de cada dia D é
+        [D - PERIODOS[periodo], D], via somas prefixadas; as tendências usam os 7
+        registros mais recentes até D, como calcular_metricas faz com o histórico.
+        Linhas com data fora de AAAA-MM-DD são ignoradas e contadas (terceiro retorno).
+        """
+        registros, ignoradas = [], 0
+        for linha in linhas:
+            try:
+                registros.append((datetime.strptime(linha[0], '%Y-%m-%d').toordinal(), linha[1:]))
+            except (TypeError, ValueError):
+                ignoradas += 1
+        # Ordem da consulta é textual; datas sem zero à esquerda ('2024-1-5') também parseiam
+        registros.sort(key=lambda registro: registro[0])
+        dias, valores = [dia for dia, _ in registros], {m: [] for m in METRICAS}
+        for _, metricas in registros:
+            for metrica, valor in zip(METRICAS, metricas):
+                valores[metrica].append(valor)
+        tabela = {nome: [] for nome in METRICAS + ('tendencia_vendas', 'tendencia_lucros')}
+        if not dias:
+            return tabela, [], ignoradas
+        
+        somas, contagens = {}, {}
+        for metrica in METRICAS:
+            somas[metrica], contagens[metrica] = [0.0], [0]
+            for valor in valores[metrica]:
+                somas[metrica].append(somas[metrica][-1] + (valor or 0.0))
+                contagens[metrica].append(contagens[metrica][-1] + (valor is not None))
         
-        # Priorização das sugestões
-        priorizadas = []
-        for s in sugestoes:
-            if "⚠️" in s or "🔴" in s:
-                priorizadas.insert(0, f"<div class='urgencia'>{s}</div>")
+        janela = PERIODOS.get(periodo, 7)
+        primeiro = max(dias[0], datetime.strptime(inicio, '%Y-%m-%d').toordinal()) if inicio else dias[0]
+        ultimo = min(dias[-1], datetime.strptime(fim, '%Y-%m-%d').toordinal()) if fim else dias[-1]
+        datas = []
+        for dia in range(primeiro, ultimo + 1):
+            a = bisect.bisect_left(dias, dia - janela)
+            b = bisect.bisect_right(dias, dia)
+            for metrica in METRICAS:
+                contagem = contagens[metrica][b] - contagens[metrica][a]
+                media = (somas[metrica][b] - somas[metrica][a]) / contagem if contagem else 0
+                # Mesmo arredondamento de _formatar_kpis
+                tabela[metrica].append(int(media) if metrica == 'clientes_ativos' else round(media, 2))
+            
+            tendencias = (None, None)
+            if b >= 7:
+                try:
+                    tendencias = tuple(
+                        (valores[m][b - 1] - valores[m][b - 7]) / valores[m][b - 7] * 100 for m in ('vendas', 'lucro'))
+                except (ZeroDivisionError, TypeError):
+                    pass
+            tabela['tendencia_vendas'].append(tendencias[0])
+            tabela['tendencia_lucros'].append(tendencias[1])
+            datas.append(date.fromordinal(dia).strftime('%Y-%m-%d'))
+        return tabela, datas, ignoradas
+
+# ===== PRÉ-CÁLCULO DOS DASHBOARDS EM SEGUNDO PLANO =====
+class AgendadorDashboards:
+    """Recalcula KPIs + sugestões de todos os períodos após rajadas de escrita e à meia-noite
+    
+    As requisições apenas leem o resultado pronto; se ele estiver defasado (outra versão
+    dos dados ou outro dia), o chamador calcula sob demanda como antes.
+    """
+    def __init__(self, db_manager, periodos=None):
+        self.db_manager = db_manager
+        self.periodos = list(periodos or PERIODOS)
+        self._resultados = {}
+        self._lock = threading.Lock()
+        self._recalculo_lock = threading.Lock()
+        self._acordar = threading.Event()
+        self._pendente_desde = None
+        self._ultima_escrita = None
+        self._versao_calculada = None
+        self._dia_calculado = None
+        self._metricas = {
+            'execucoes': 0,
+            'ultima_execucao_em': None,
+            'ultima_duracao_ms': None,
+            'duracao_total_ms': 0.0,
+            'ultimo_lag_ms': None,
+            'lag_maximo_ms': 0.0,
+            'erros': 0,
+        }
+        db_manager.registrar_ouvinte(self._ao_escrever)
+    
+    def _ao_escrever(self, evento, linhas):
+        agora = time.monotonic()
+        with self._lock:
+            if self._pendente_desde is None:
+                self._pendente_desde = agora
+            self._ultima_escrita = agora
+        self._acordar.set()
+    
+    def iniciar(self):
+        threading.Thread(target=self._loop, name='agendador-dashboards', daemon=True).start()
+        return self
+    
+    def _segundos_ate_meia_noite(self):
+        agora = datetime.now()
+        meia_noite = datetime.combine(agora.date() + timedelta(days=1), datetime.min.time())
+        return (meia_noite - agora).total_seconds()
+    
+    def _loop(self):
+        self.recalcular()
+        while True:
+            espera = min(Config.AGENDADOR_VERIFICACAO, self._segundos_ate_meia_noite() + 0.01)
+            self._acordar.wait(espera)
+            
+            if self._acordar.is_set():
+                # Debounce: aguarda a rajada terminar (com teto para escritas contínuas)
+                while True:
+                    with self._lock:
+                        inicio = self._pendente_desde or time.monotonic()
+                        ultima = self._ultima_escrita or inicio
+                    agora = time.monotonic()
+                    if (agora - ultima >= Config.AGENDADOR_ESPERA_RAJADA
+                            or agora - inicio >= Config.AGENDADOR_ESPERA_MAXIMA):
+                        break
+                    time.sleep(Config.AGENDADOR_ESPERA_RAJADA / 5)
+                self._acordar.clear()
+                self.recalcular()
             else:
-                priorizadas.append(s)
+                with self._lock:
+                    calculado = (self._dia_calculado, self._versao_calculada)
+                if calculado != (date.today(), self.db_manager.get_versao_dados()):
+                    # Virada do dia (janelas relativas) ou escrita feita por outro processo
+                    self.recalcular()
+    
+    def recalcular(self):
+        """Recalcula todos os períodos e publica os resultados de uma vez
         
-        # Rodapé com análise resumida
-        priorizadas.append(f"""
-        <div class='ia-resumo'>
-            <p><strong>🔍 Resumo Financeiro:</strong></p>
-            <p>Margem Líquida: {margem:.1f}% | Rentabilidade: {'✅' if lucro > 0 else '⚠️'}</p>
-            <p>Eficiência Operacional: {'🔴' if razao_despesas > 70 else '🔸' if razao_despesas > 60 else '✅'}</p>
-            <p>Saúde do Crescimento: {'🚀' if crescimento > 10 else '📈' if crescimento > 0 else '📉'}</p>
-        </div>
-        """)
+        Serializado: a thread do agendador e a recarga de configuração podem chamar ao
+        mesmo tempo, e um cálculo mais antigo não pode publicar por cima de um mais novo.
+        """
+        with self._recalculo_lock:
+            self._recalcular()
+    
+    def _recalcular(self):
+        with self._lock:
+            pendente_desde = self._pendente_desde
+            self._pendente_desde = None
         
-        # Rodapé
-        priorizadas.append("""
-        <div class='ia-footer'>
-            <p><strong>🤖 InsightPro AI - Análise Avançada</strong></p>
-            <p>Desenvolvido por Dione Castro Alves | InNovaIdeia © 2025</p>
-        </div>
-        """)
+        inicio = time.perf_counter()
+        try:
+            versao = self.db_manager.get_versao_dados()
+            hoje = date.today()
+            historico = self.db_manager.get_historico()
+            sazonalidade = self.db_manager.get_indices_sazonais()
+            resultados = {}
+            for periodo in self.periodos:
+                kpis = self.db_manager.get_kpis(periodo)
+                resultados[periodo] = ((versao, hoje), (kpis, SugestaoIA.analisar(kpis, historico, sazonalidade)))
+        except Exception as e:
+            print(f"❌ Erro no pré-cálculo dos dashboards: {e}")
+            with self._lock:
+                self._metricas['erros'] += 1
+            return
         
-        return priorizadas
+        duracao = (time.perf_counter() - inicio) * 1000
+        with self._lock:
+            self._resultados = resultados
+            self._versao_calculada = versao
+            self._dia_calculado = hoje
+            m = self._metricas
+            m['execucoes'] += 1
+            m['ultima_execucao_em'] = datetime.now().isoformat(timespec='seconds')
+            m['ultima_duracao_ms'] = round(duracao, 2)
+            m['duracao_total_ms'] += duracao
+            if pendente_desde is not None:
+                lag = (time.monotonic() - pendente_desde) * 1000
+                m['ultimo_lag_ms'] = round(lag, 2)
+                m['lag_maximo_ms'] = round(max(m['lag_maximo_ms'], lag), 2)
+    
+    def obter(self, periodo, versao):
+        """(kpis, AnaliseIA) pré-calculados, ou None se defasados"""
+        with self._lock:
+            item = self._resultados.get(periodo)
+        if item and item[0] == (versao, date.today()):
+            return item[1]
+        return None
+    
+    def metricas(self):
+        with self._lock:
+            m = dict(self._metricas)
+            pendente_desde = self._pendente_desde
+            m['versao_calculada'] = self._versao_calculada
+        m['duracao_media_ms'] = round(m.pop('duracao_total_ms') / m['execucoes'], 2) if m['execucoes'] else None
+        m['pendente'] = pendente_desde is not None
+        m['atraso_atual_ms'] = round((time.monotonic() - pendente_desde) * 1000, 2) if pendente_desde else 0.0
+        return m
+
+class CacheLRU:
+    """Cache LRU thread-safe de tamanho fixo"""
+    def __init__(self, tamanho=64):
+        self.tamanho = tamanho
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def obter(self, chave, padrao=None):
+        with self._lock:
+            if chave not in self._itens:
+                return padrao
+            self._itens.move_to_end(chave)
+            return self._itens[chave]
+    
+    def guardar(self, chave, valor):
+        with self._lock:
+            self._itens[chave] = valor
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.tamanho:
+                self._itens.popitem(last=False)
+    
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+
+# ===== BUFFER DE DADOS RECENTES =====
+class BufferRecentes:
+    """Os N registros mais recentes em memória, mantidos pelos ouvintes de escrita
+    
+    Lista ordenada de chaves (data_registro, created_at, id) com bisect: inserir e
+    remover custam O(N) sobre um N pequeno, e ler os `limite` primeiros não toca o
+    banco. Eventos que o buffer não consegue aplicar sozinho (carga em massa,
+    arquivamento, upsert de um registro fora do buffer) só o marcam como sujo: a
+    próxima leitura o reconstrói com uma consulta. Escritas de outros processos (CLI,
+    outro worker) não chegam aos ouvintes: obter() compara a versão dos dados com a
+    esperada pelo buffer, no máximo uma vez a cada Config.RECENTES_VERIFICACAO_MS, e
+    reconstrói se ela avançou por fora.
+    """
+    def __init__(self, db_manager, capacidade=None):
+        self.db_manager = db_manager
+        self.capacidade = capacidade or Config.RECENTES_CAPACIDADE
+        self._chaves = []
+        self._registros = {}
+        # completo: o buffer contém todos os registros ativos (tabela menor que a capacidade)
+        self._completo = False
+        self._sujo = True
+        # Eventos recebidos (detecta escrita durante a reconstrução) e versão esperada dos dados
+        self._geracao = 0
+        self._versao = None
+        # Última consulta da versão no banco (monotonic); entre consultas valem os ouvintes
+        self._verificado_em = None
+        self._lock = threading.Lock()
+        self._metricas = {'leituras': 0, 'reconstrucoes': 0, 'verificacoes': 0}
+    
+    def iniciar(self, carregar=True):
+        self.db_manager.registrar_ouvinte(self._ao_escrever)
+        if carregar:
+            self.reconstruir()
+        return self
+    
+    @staticmethod
+    def _chave(registro):
+        return (registro['data_registro'], registro['created_at'] or '', registro['id'])
+    
+    def reconstruir(self):
+        """Recarrega do banco; retorna os registros lidos (mais recentes primeiro)"""
+        with self._lock:
+            geracao = self._geracao
+        lido_em = time.monotonic()
+        versao = self.db_manager.get_versao_dados()
+        registros = self.db_manager.get_dados_recentes(limite=self.capacidade)
+        with self._lock:
+            self._metricas['reconstrucoes'] += 1
+            self._verificado_em = lido_em
+            if self._geracao != geracao:
+                # Evento entre a leitura e agora: a consulta pode não conter a escrita notificada
+                self._sujo = True
+                return registros
+            self._registros = {r['id']: r for r in registros}
+            self._chaves = sorted(self._chave(r) for r in registros)
+            self._completo = len(registros) < self.capacidade
+            self._versao = versao
+            self._sujo = False
+        return registros
+    
+    def _adicionar(self, registro):
+        # Reconstrução concluída entre o commit e a notificação: o registro já pode estar aqui
+        self._remover(registro['id'])
+        chave = self._chave(registro)
+        if len(self._chaves) >= self.capacidade and chave < self._chaves[0]:
+            return
+        bisect.insort(self._chaves, chave)
+        self._registros[registro['id']] = registro
+        if len(self._chaves) > self.capacidade:
+            removida = self._chaves.pop(0)
+            del self._registros[removida[2]]
+            self._completo = False
+    
+    def _remover(self, registro_id):
+        registro = self._registros.pop(registro_id, None)
+        if registro:
+            self._chaves.pop(bisect.bisect_left(self._chaves, self._chave(registro)))
+    
+    @staticmethod
+    def _registro(linha, created_at):
+        """Linha de ouvinte (id, data_registro, *METRICAS) -> dict no formato de get_dados_recentes"""
+        registro = dict(zip(('id', 'data_registro') + METRICAS, linha))
+        registro['created_at'] = created_at
+        registro.update(zip(METRICAS_DERIVADAS, calcular_derivadas(
+            registro['vendas'], registro['despesas'], registro['lucro'], registro['clientes_ativos'])))
+        return registro
+    
+    def _ao_escrever(self, evento, linhas):
+        with self._lock:
+            self._geracao += 1
+            if self._versao is not None:
+                # Cada escrita notificada avança versao_dados em 1 (mesma transação)
+                self._versao += 1
+            if evento == 'inserido':
+                agora = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+                for linha in linhas:
+                    self._adicionar(self._registro(linha, agora))
+            elif evento == 'deletado':
+                for linha in linhas:
+                    self._remover(linha[0])
+            elif evento == 'atualizado':
+                antiga, nova = linhas
+                if antiga[0] in self._registros:
+                    # Upsert preserva created_at: mesma posição, valores novos
+                    self._registros[antiga[0]] = self._registro(nova, self._registros[antiga[0]]['created_at'])
+                elif self._completo or not self._chaves or nova[1] >= self._chaves[0][0]:
+                    self._sujo = True
+            else:
+                self._sujo = True
+    
+    def obter(self, limite=10):
+        """Os `limite` registros mais recentes (data_registro DESC, created_at DESC)"""
+        agora = time.monotonic()
+        with self._lock:
+            verificar = (self._verificado_em is None
+                         or agora - self._verificado_em >= Config.RECENTES_VERIFICACAO_MS / 1000)
+            if verificar:
+                # Reserva a verificação: leituras concorrentes seguem com a versão esperada
+                self._verificado_em = agora
+        if verificar:
+            versao = self.db_manager.get_versao_dados()
+            with self._lock:
+                self._metricas['verificacoes'] += 1
+                if versao is None or versao != self._versao:
+                    self._sujo = True
+        with self._lock:
+            self._metricas['leituras'] += 1
+            valido = (not self._sujo and self._versao is not None
+                      and (self._completo or len(self._chaves) >= limite))
+            if valido:
+                return [dict(self._registros[chave[2]]) for chave in reversed(self._chaves[-limite:])]
+        # Exclusões esvaziaram o buffer abaixo do pedido, um evento o invalidou ou outro processo escreveu
+        return [dict(registro) for registro in self.reconstruir()[:limite]]
+    
+    def metricas(self):
+        with self._lock:
+            return dict(self._metricas, tamanho=len(self._chaves), capacidade=self.capacidade)
 
 # ===== TEMPLATE PARA ADICIONAR DADOS =====
 ADICIONAR_DADOS_TEMPLATE = """
@@ -675,11 +4070,13 @@ ADICIONAR_DADOS_TEMPLATE = """
             
             <div class="dados-recentes">
                 <h2>📋 Dados Recentes</h2>
+                <div id="statusSync"></div>
                 <div id="tabelaDados" class="loading">Carregando dados...</div>
             </div>
         </div>
     </div>
 
+    <script src="/sync.js"></script>
     <script>
         // Definir data atual como padrão
         document.getElementById('data_registro').value = new Date().toISOString().split('T')[0];
@@ -708,6 +4105,9 @@ ADICIONAR_DADOS_TEMPLATE = """
             document.getElementById(id).addEventListener('input', calcularPreview);
         });
         
+        // Chave de idempotência do envio em andamento
+        let chaveEnvio = null;
+        
         // Submissão do formulário
         document.getElementById('dadosForm').addEventListener('submit', async function(e) {
             e.preventDefault();
@@ -723,11 +4123,15 @@ ADICIONAR_DADOS_TEMPLATE = """
             const formData = new FormData(e.target);
             const dados = Object.fromEntries(formData.entries());
             
+            // Mesma chave para reenvios do mesmo formulário: o servidor não duplica
+            chaveEnvio = chaveEnvio || (window.crypto && crypto.randomUUID ? crypto.randomUUID() : `${Date.now()}-${Math.random()}`);
+            
             try {
                 const response = await fetch('/api/salvar-dados', {
                     method: 'POST',
                     headers: {
-                        'Content-Type': 'application/json'
+                        'Content-Type': 'application/json',
+                        'Idempotency-Key': chaveEnvio
                     },
                     body: JSON.stringify(dados)
                 });
@@ -740,7 +4144,8 @@ ADICIONAR_DADOS_TEMPLATE = """
                     alertBox.textContent = `✅ ${result.message} | Lucro: R$ ${result.dados.lucro} | Margem: ${result.dados.margem}%`;
                     alertBox.style.display = 'block';
                     
-                    // Limpar formulário
+                    // Limpar formulário (próximo envio usa nova chave)
+                    chaveEnvio = null;
                     e.target.reset();
                     document.getElementById('data_registro').value = new Date().toISOString().split('T')[0];
                     document.getElementById('previewCalculos').innerHTML = '';
@@ -754,9 +4159,16 @@ ADICIONAR_DADOS_TEMPLATE = """
                     alertBox.style.display = 'block';
                 }
             } catch (error) {
-                alertBox.className = 'alert error';
-                alertBox.textContent = `❌ Erro de conexão: ${error.message}`;
+                // Sem conexão: guarda o envio com a mesma chave e reenvia quando a rede voltar
+                InsightSync.enfileirar(dados, chaveEnvio);
+                chaveEnvio = null;
+                e.target.reset();
+                document.getElementById('data_registro').value = new Date().toISOString().split('T')[0];
+                document.getElementById('previewCalculos').innerHTML = '';
+                alertBox.className = 'alert success';
+                alertBox.textContent = '📴 Sem conexão: registro guardado no aparelho e enviado assim que a rede voltar';
                 alertBox.style.display = 'block';
+                mostrarStatusSync(true);
             } finally {
                 // Reabilitar botão
                 submitBtn.disabled = false;
@@ -769,11 +4181,31 @@ ADICIONAR_DADOS_TEMPLATE = """
             }
         });
         
-        // Carregar dados recentes
+        function mostrarStatusSync(offline) {
+            const pendentes = InsightSync.pendentes();
+            const avisos = [];
+            if (offline) {
+                avisos.push('📴 Offline: exibindo a última cópia sincronizada');
+            }
+            if (pendentes) {
+                avisos.push(`⏳ ${pendentes} registro(s) aguardando envio`);
+            }
+            document.getElementById('statusSync').innerHTML = avisos.map(a => `<p>${a}</p>`).join('');
+        }
+        
+        // Carregar dados recentes: envia a fila offline, aplica só o delta e desenha a partir do espelho local
         async function carregarDadosRecentes() {
+            let offline = false;
+            try {
+                await InsightSync.enviarFila();
+                await InsightSync.sincronizar();
+            } catch (error) {
+                offline = true;
+            }
+            mostrarStatusSync(offline);
+            
             try {
-                const response = await fetch('/api/dados-recentes');
-                const result = await response.json();
+                const result = {dados: InsightSync.recentes(10)};
                 
                 if (result.dados && result.dados.length > 0) {
                     let html = `
@@ -794,7 +4226,8 @@ ADICIONAR_DADOS_TEMPLATE = """
                     `;
                     
                     result.dados.forEach(item => {
-                        const margem = item.vendas > 0 ? (item.lucro / item.vendas * 100) : 0;
+                        // Margem gravada no registro (nula só enquanto a migração preenche linhas antigas)
+                        const margem = Number(item.margem ?? 0);
                         const margemColor = margem < 15 ? '#e74c3c' : margem > 40 ? '#27ae60' : '#333';
                         
                         html += `
@@ -857,8 +4290,9 @@ ADICIONAR_DADOS_TEMPLATE = """
         // Carregar dados ao inicializar
         carregarDadosRecentes();
         
-        // Auto-atualizar dados a cada 30 segundos
+        // A cada 30 segundos só o delta trafega; a volta da rede sincroniza na hora
         setInterval(carregarDadosRecentes, 30000);
+        window.addEventListener('online', carregarDadosRecentes);
     </script>
 </body>
 </html>
@@ -1022,102 +4456,768 @@ DASHBOARD_TEMPLATE = """
             
             <div class="periodo-selector">
                 <select id="periodoSelect" onchange="alterarPeriodo()">
-                    <option value="dia" {{ 'selected' if periodo == 'dia' else '' }}>Último Dia</option>
-                    <option value="semana" {{ 'selected' if periodo == 'semana' else '' }}>Última Semana</option>
-                    <option value="mes" {{ 'selected' if periodo == 'mes' else '' }}>Último Mês</option>
-                    <option value="trimestre" {{ 'selected' if periodo == 'trimestre' else '' }}>Último Trimestre</option>
+                    {% for nome, rotulo in periodos %}
+                    <option value="{{ nome }}" {{ 'selected' if periodo == nome else '' }}>{{ rotulo }}</option>
+                    {% endfor %}
                 </select>
                 <button class="refresh-btn" onclick="atualizarDados()">🔄 Atualizar</button>
                 <a href="/adicionar-dados" class="refresh-btn" style="text-decoration: none; display: inline-block;">📝 Adicionar Dados</a>
             </div>
         </div>
         
-        <div class="kpis-grid" id="kpisContainer">
-            <div class="kpi-card">
-                <h3>💰 Vendas</h3>
-                <div class="kpi-value">R$ {{ "{:,.2f}".format(kpis.vendas) }}</div>
-            </div>
-            
-            <div class="kpi-card">
-                <h3>💸 Despesas</h3>
-                <div class="kpi-value">R$ {{ "{:,.2f}".format(kpis.despesas) }}</div>
-            </div>
-            
-            <div class="kpi-card">
-                <h3>📈 Lucro</h3>
-                <div class="kpi-value {{ 'positive' if kpis.lucro > 0 else 'negative' }}">
-                    R$ {{ "{:,.2f}".format(kpis.lucro) }}
-                </div>
-            </div>
-            
-            <div class="kpi-card">
-                <h3>📊 Crescimento</h3>
-                <div class="kpi-value {{ 'positive' if kpis.crescimento > 0 else 'negative' }}">
-                    {{ "{:+.1f}".format(kpis.crescimento) }}%
-                </div>
-            </div>
-            
-            <div class="kpi-card">
-                <h3>🎫 Ticket Médio</h3>
-                <div class="kpi-value">R$ {{ "{:,.2f}".format(kpis.ticket_medio) }}</div>
-            </div>
-            
-            <div class="kpi-card">
-                <h3>👥 Clientes Ativos</h3>
-                <div class="kpi-value">{{ kpis.clientes_ativos }}</div>
-            </div>
-        </div>
+        {{ kpis_html|safe }}
         
         <div class="sugestoes">
             <h2>🤖 Sugestões da IA</h2>
             <div id="sugestoesContainer">
-                {% for sugestao in sugestoes %}
-                    <div class="sugestao-item">{{ sugestao|safe }}</div>
-                {% endfor %}
+                {{ sugestoes_html|safe }}
             </div>
         </div>
     </div>
     
+    <script src="/sync.js"></script>
     <script>
         function alterarPeriodo() {
             const periodo = document.getElementById('periodoSelect').value;
             window.location.href = `/dashboard?periodo=${periodo}`;
         }
         
+        // Catálogo de textos por código: baixado uma vez, as sugestões chegam compactas
+        let catalogoSugestoes = null;
+        
+        function formatarTexto(modelo, params) {
+            return modelo.replace(/\\{(\\w+)(?::\\.(\\d)f)?\\}/g, (_, nome, casas) =>
+                casas !== undefined ? Number(params[nome]).toFixed(Number(casas)) : params[nome]);
+        }
+        
+        function formatarMoeda(valor) {
+            return Number(valor).toLocaleString('en-US', {minimumFractionDigits: 2, maximumFractionDigits: 2});
+        }
+        
+        function renderizarKpis(kpis) {
+            const formatos = {
+                vendas: v => `R$ ${formatarMoeda(v)}`,
+                despesas: v => `R$ ${formatarMoeda(v)}`,
+                lucro: v => `R$ ${formatarMoeda(v)}`,
+                crescimento: v => `${v >= 0 ? '+' : ''}${Number(v).toFixed(1)}%`,
+                ticket_medio: v => `R$ ${formatarMoeda(v)}`,
+                clientes_ativos: v => `${v}`
+            };
+            document.querySelectorAll('[data-kpi]').forEach(el => {
+                const nome = el.dataset.kpi;
+                el.textContent = formatos[nome](kpis[nome]);
+                if (nome === 'lucro' || nome === 'crescimento') {
+                    el.classList.toggle('positive', kpis[nome] > 0);
+                    el.classList.toggle('negative', !(kpis[nome] > 0));
+                }
+            });
+        }
+        
+        function renderizarSugestoes(dados) {
+            const r = dados.resumo;
+            const blocos = dados.sugestoes.map(s => {
+                const texto = formatarTexto(catalogoSugestoes.textos[s.codigo], s.params);
+                return s.severidade === 'critica' ? `<div class='urgencia'>${texto}</div>` : texto;
+            });
+            blocos.push(`
+                <div class='ia-resumo'>
+                    <p><strong>🔍 Resumo Financeiro:</strong></p>
+                    <p>Margem Líquida: ${r.margem.toFixed(1)}% | Rentabilidade: ${r.lucro > 0 ? '✅' : '⚠️'}</p>
+                    <p>Eficiência Operacional: ${r.razao_despesas > 70 ? '🔴' : r.razao_despesas > 60 ? '🔸' : '✅'}</p>
+                    <p>Saúde do Crescimento: ${r.crescimento > 10 ? '🚀' : r.crescimento > 0 ? '📈' : '📉'}</p>
+                </div>`);
+            blocos.push(`
+                <div class='ia-footer'>
+                    <p><strong>🤖 InsightPro AI - Análise Avançada</strong></p>
+                    <p>Desenvolvido por Dione Castro Alves | InNovaIdeia © 2025</p>
+                </div>`);
+            document.getElementById('sugestoesContainer').innerHTML =
+                blocos.map(b => `<div class="sugestao-item">${b}</div>`).join('');
+        }
+        
         async function atualizarDados() {
             const periodo = document.getElementById('periodoSelect').value;
             document.getElementById('sugestoesContainer').innerHTML = '<div class="loading">🔄 Atualizando dados...</div>';
             
             try {
-                const response = await fetch(`/api/atualizar-dados?periodo=${periodo}`);
+                if (!catalogoSugestoes) {
+                    catalogoSugestoes = await (await fetch('/api/sugestoes/catalogo')).json();
+                }
+                const response = await fetch(`/api/atualizar-dados?periodo=${periodo}&compacto=1`);
                 const data = await response.json();
                 
-                // Recarregar página para atualizar todos os dados
-                setTimeout(() => window.location.reload(), 500);
+                renderizarKpis(data.kpis);
+                renderizarSugestoes(data);
             } catch (error) {
                 console.error('Erro ao atualizar:', error);
                 alert('Erro ao atualizar dados. Tente novamente.');
             }
         }
         
-        // Auto-refresh a cada 5 minutos
-        setInterval(() => {
-            console.log('Auto-refresh executado');
-            // atualizarDados(); // Descomente para ativar auto-refresh
-        }, 300000);
+        // Auto-refresh: a cada minuto consulta só o delta; KPIs e sugestões são rebuscados se algo mudou
+        InsightSync.sincronizar().catch(() => {});
+        setInterval(async () => {
+            try {
+                if (await InsightSync.sincronizar()) {
+                    atualizarDados();
+                }
+            } catch (error) {
+                console.log('Sem conexão: mantendo o último dashboard');
+            }
+        }, 60000);
     </script>
 </body>
 </html>
 """
 
+# Fragmentos dinâmicos do dashboard: renderizados e guardados em cache à parte da casca estática
+DASHBOARD_KPIS_TEMPLATE = """
+<div class="kpis-grid" id="kpisContainer">
+    <div class="kpi-card">
+        <h3>💰 Vendas</h3>
+        <div class="kpi-value" data-kpi="vendas">R$ {{ "{:,.2f}".format(kpis.vendas) }}</div>
+    </div>
+    
+    <div class="kpi-card">
+        <h3>💸 Despesas</h3>
+        <div class="kpi-value" data-kpi="despesas">R$ {{ "{:,.2f}".format(kpis.despesas) }}</div>
+    </div>
+    
+    <div class="kpi-card">
+        <h3>📈 Lucro</h3>
+        <div class="kpi-value {{ 'positive' if kpis.lucro > 0 else 'negative' }}" data-kpi="lucro">
+            R$ {{ "{:,.2f}".format(kpis.lucro) }}
+        </div>
+    </div>
+    
+    <div class="kpi-card">
+        <h3>📊 Crescimento</h3>
+        <div class="kpi-value {{ 'positive' if kpis.crescimento > 0 else 'negative' }}" data-kpi="crescimento">
+            {{ "{:+.1f}".format(kpis.crescimento) }}%
+        </div>
+    </div>
+    
+    <div class="kpi-card">
+        <h3>🎫 Ticket Médio</h3>
+        <div class="kpi-value" data-kpi="ticket_medio">R$ {{ "{:,.2f}".format(kpis.ticket_medio) }}</div>
+    </div>
+    
+    <div class="kpi-card">
+        <h3>👥 Clientes Ativos</h3>
+        <div class="kpi-value" data-kpi="clientes_ativos">{{ kpis.clientes_ativos }}</div>
+    </div>
+</div>
+"""
+
+DASHBOARD_SUGESTOES_TEMPLATE = """
+{% for sugestao in sugestoes %}
+    <div class="sugestao-item">{{ sugestao|safe }}</div>
+{% endfor %}
+"""
+
+# ===== CLIENTE OFFLINE (SINCRONIZAÇÃO + SERVICE WORKER) =====
+SYNC_CLIENTE_JS = """
+// Espelho local dos registros recentes, mantido por deltas de /api/sync, e fila de envios offline
+const InsightSync = (() => {
+    const CHAVE_ESPELHO = 'insightpro_sync';
+    const CHAVE_FILA = 'insightpro_fila';
+    
+    function ler(chave, padrao) {
+        try {
+            return JSON.parse(localStorage.getItem(chave)) || padrao;
+        } catch (e) {
+            return padrao;
+        }
+    }
+    
+    function gravar(chave, valor) {
+        try {
+            localStorage.setItem(chave, JSON.stringify(valor));
+        } catch (e) {
+            console.warn('Armazenamento local indisponível:', e);
+        }
+    }
+    
+    let espelho = ler(CHAVE_ESPELHO, {watermark: 0, janela_inicio: null, linhas: {}});
+    
+    function aplicar(delta) {
+        if (delta.reiniciar) {
+            espelho = {watermark: delta.watermark, janela_inicio: delta.janela_inicio, linhas: {}};
+            delta.linhas.forEach(l => { espelho.linhas[l.id] = l; });
+            return true;
+        }
+        delta.inseridos.concat(delta.atualizados).forEach(l => {
+            if (!espelho.janela_inicio || l.data_registro >= espelho.janela_inicio) {
+                espelho.linhas[l.id] = l;
+            }
+        });
+        delta.deletados.forEach(id => { delete espelho.linhas[id]; });
+        if (delta.arquivado_ate) {
+            Object.values(espelho.linhas)
+                .filter(l => l.data_registro < delta.arquivado_ate)
+                .forEach(l => { delete espelho.linhas[l.id]; });
+        }
+        espelho.watermark = delta.watermark;
+        return delta.inseridos.length + delta.atualizados.length + delta.deletados.length > 0
+            || Boolean(delta.arquivado_ate);
+    }
+    
+    // Busca só o que mudou desde a última marca d'água; retorna true se o espelho mudou
+    async function sincronizar() {
+        let mudou = false;
+        let mais = true;
+        while (mais) {
+            const resposta = await fetch(`/api/sync?desde=${espelho.watermark}`, {cache: 'no-store'});
+            const delta = await resposta.json();
+            if (!delta.success) {
+                throw new Error(delta.message);
+            }
+            mudou = aplicar(delta) || mudou;
+            mais = delta.mais;
+        }
+        gravar(CHAVE_ESPELHO, espelho);
+        return mudou;
+    }
+    
+    function recentes(limite) {
+        return Object.values(espelho.linhas)
+            .sort((a, b) => a.data_registro === b.data_registro ? b.id - a.id
+                : (a.data_registro < b.data_registro ? 1 : -1))
+            .slice(0, limite);
+    }
+    
+    // Envios feitos sem conexão: reenviados com a mesma chave de idempotência (o servidor não duplica)
+    function enfileirar(dados, chave) {
+        const fila = ler(CHAVE_FILA, []);
+        fila.push({dados, chave});
+        gravar(CHAVE_FILA, fila);
+    }
+    
+    function pendentes() {
+        return ler(CHAVE_FILA, []).length;
+    }
+    
+    async function enviarFila() {
+        const fila = ler(CHAVE_FILA, []);
+        while (fila.length) {
+            const {dados, chave} = fila[0];
+            let resposta;
+            try {
+                resposta = await fetch('/api/salvar-dados', {
+                    method: 'POST',
+                    headers: {'Content-Type': 'application/json', 'Idempotency-Key': chave},
+                    body: JSON.stringify(dados)
+                });
+            } catch (e) {
+                break;  // Ainda sem conexão: tenta de novo mais tarde
+            }
+            if (resposta.status === 400) {
+                // Dados inválidos nunca serão aceitos: descarta
+                console.warn('Registro offline recusado pelo servidor:', dados);
+            } else if (resposta.status !== 409) {
+                // 409 = chave já usada; 429, 5xx ou escrita que falhou ficam na fila para a próxima tentativa
+                const resultado = resposta.ok ? await resposta.json().catch(() => null) : null;
+                if (!resultado || !resultado.success) {
+                    break;
+                }
+            }
+            fila.shift();
+            gravar(CHAVE_FILA, fila);
+        }
+        return fila.length;
+    }
+    
+    if ('serviceWorker' in navigator) {
+        navigator.serviceWorker.register('/sw.js').catch(e => console.warn('Service worker não registrado:', e));
+    }
+    
+    return {sincronizar, recentes, enfileirar, pendentes, enviarFila};
+})();
+"""
+
+SERVICE_WORKER_JS = """
+// Service worker do InsightPro: rede primeiro, última resposta guardada quando offline
+const CACHE = 'insightpro-__VERSAO__';
+const PRE_CARREGAR = ['/dashboard', '/adicionar-dados', '/sync.js', '/api/sugestoes/catalogo'];
+// Só estas rotas são guardadas; /api/sync tem o próprio espelho no cliente
+const GUARDAVEIS = PRE_CARREGAR.concat(['/api/atualizar-dados']);
+
+self.addEventListener('install', evento => {
+    evento.waitUntil(
+        caches.open(CACHE).then(cache => cache.addAll(PRE_CARREGAR)).then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', evento => {
+    evento.waitUntil(
+        caches.keys()
+            .then(nomes => Promise.all(nomes.filter(n => n !== CACHE).map(n => caches.delete(n))))
+            .then(() => self.clients.claim())
+    );
+});
+
+self.addEventListener('fetch', evento => {
+    const url = new URL(evento.request.url);
+    if (evento.request.method !== 'GET' || url.origin !== self.location.origin
+            || !GUARDAVEIS.includes(url.pathname)) {
+        return;
+    }
+    evento.respondWith(
+        fetch(evento.request)
+            .then(resposta => {
+                if (resposta.ok) {
+                    const copia = resposta.clone();
+                    caches.open(CACHE).then(cache => cache.put(evento.request, copia));
+                }
+                return resposta;
+            })
+            // Offline: a mesma URL guardada ou, sem ela, a mesma rota com outros parâmetros
+            .catch(() => caches.match(evento.request)
+                .then(guardada => guardada || caches.match(evento.request, {ignoreSearch: true})))
+    );
+});
+"""
+
+# Muda a cada alteração das páginas ou scripts: o service worker descarta o cache antigo
+VERSAO_CLIENTE = hashlib.sha1(''.join((
+    DASHBOARD_TEMPLATE, DASHBOARD_KPIS_TEMPLATE, DASHBOARD_SUGESTOES_TEMPLATE,
+    ADICIONAR_DADOS_TEMPLATE, SYNC_CLIENTE_JS, SERVICE_WORKER_JS
+)).encode()).hexdigest()[:12]
+
+# ===== CAMADA DE RESPOSTA (JSON RÁPIDO + COMPRESSÃO) =====
+# Aceleradores opcionais: sem eles, usa json/gzip da biblioteca padrão
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:  # Flask < 2.2
+    DefaultJSONProvider = None
+
+if DefaultJSONProvider:
+    class ProvedorJSONRapido(DefaultJSONProvider):
+        """jsonify compacto, com orjson quando disponível"""
+        compact = True
+        
+        def dumps(self, obj, **kwargs):
+            # response() sempre passa separators compactos; só indent/outros kwargs exigem a stdlib
+            compacto = kwargs.get('indent') is None and kwargs.get('separators', (',', ':')) == (',', ':')
+            if orjson and compacto and set(kwargs) <= {'indent', 'separators'}:
+                try:
+                    # Datas passam pelo default do Flask (http_date), como na stdlib
+                    return orjson.dumps(obj, default=self.default,
+                                        option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+                                        | orjson.OPT_PASSTHROUGH_DATETIME).decode()
+                except TypeError:
+                    pass
+            kwargs.setdefault('ensure_ascii', False)
+            kwargs.setdefault('separators', (',', ':'))
+            return super().dumps(obj, **kwargs)
+
+class CompressorResposta:
+    """Negocia zstd/br/gzip pelo Accept-Encoding e comprime respostas (inclusive streaming)"""
+    TIPOS_COMPRIMIVEIS = ('text/', 'application/json', 'application/javascript',
+                          'application/x-ndjson', 'image/svg+xml')
+    
+    @staticmethod
+    def codificacoes_disponiveis():
+        """Em ordem de preferência do servidor"""
+        disponiveis = []
+        if zstandard:
+            disponiveis.append('zstd')
+        if brotli:
+            disponiveis.append('br')
+        disponiveis.append('gzip')
+        return disponiveis
+    
+    @classmethod
+    def negociar(cls, accept_encodings):
+        for codificacao in cls.codificacoes_disponiveis():
+            if accept_encodings.quality(codificacao) > 0:
+                return codificacao
+        return None
+    
+    @staticmethod
+    def comprimir(dados, codificacao):
+        if codificacao == 'zstd':
+            return zstandard.ZstdCompressor(level=3).compress(dados)
+        if codificacao == 'br':
+            return brotli.compress(dados, quality=5)
+        return gzip.compress(dados, compresslevel=6)
+    
+    @staticmethod
+    def compressor_stream(codificacao):
+        """Objeto com compress(bytes) e flush() para respostas em streaming"""
+        if codificacao == 'zstd':
+            return zstandard.ZstdCompressor(level=3).compressobj()
+        if codificacao == 'br':
+            compressor = brotli.Compressor(quality=5)
+            compressor.compress = compressor.process
+            compressor.flush = compressor.finish
+            return compressor
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    
+    @classmethod
+    def aplicar(cls, response):
+        """Hook after_request"""
+        if (response.status_code < 200 or response.status_code in (204, 304)
+                or 'Content-Encoding' in response.headers
+                or not (response.mimetype or '').startswith(cls.TIPOS_COMPRIMIVEIS)):
+            return response
+        
+        codificacao = cls.negociar(request.accept_encodings)
+        if not codificacao:
+            return response
+        
+        if response.is_streamed:
+            partes = response.response
+            compressor = cls.compressor_stream(codificacao)
+            
+            def comprimir_stream():
+                for parte in partes:
+                    if isinstance(parte, str):
+                        parte = parte.encode('utf-8')
+                    bloco = compressor.compress(parte)
+                    if bloco:
+                        yield bloco
+                yield compressor.flush()
+            
+            response.response = comprimir_stream()
+            response.headers.pop('Content-Length', None)
+        else:
+            dados = response.get_data()
+            if len(dados) < Config.COMPRESSAO_MINIMO:
+                return response
+            response.set_data(cls.comprimir(dados, codificacao))
+        
+        response.headers['Content-Encoding'] = codificacao
+        response.vary.add('Accept-Encoding')
+        return response
+
+# ===== CONTROLE DE CARGA (COALESCÊNCIA + LIMITE DE TAXA) =====
+class ColapsadorRequisicoes:
+    """Single-flight: chamadas concorrentes com a mesma chave compartilham uma execução"""
+    def __init__(self):
+        self._em_andamento = {}
+        self._lock = threading.Lock()
+        self.coalescidas = 0
+    
+    def executar(self, chave, funcao):
+        with self._lock:
+            voo = self._em_andamento.get(chave)
+            lider = voo is None
+            if lider:
+                voo = self._em_andamento[chave] = {'pronto': threading.Event(), 'resultado': None, 'erro': None}
+            else:
+                self.coalescidas += 1
+        
+        if not lider:
+            voo['pronto'].wait()
+            if voo['erro'] is not None:
+                raise voo['erro']
+            return voo['resultado']
+        
+        try:
+            voo['resultado'] = funcao()
+            return voo['resultado']
+        except Exception as e:
+            voo['erro'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._em_andamento[chave]
+            voo['pronto'].set()
+
+class LimitadorTaxa:
+    """Token bucket por cliente: até `capacidade` requisições em rajada, repostas a `taxa`/s"""
+    MAXIMO_CLIENTES = 10000
+    
+    def __init__(self, capacidade, taxa):
+        self.capacidade = capacidade
+        self.taxa = taxa
+        self._baldes = {}
+        self._lock = threading.Lock()
+    
+    def consumir(self, cliente):
+        """Retorna 0 se permitido, ou os segundos até o próximo token"""
+        agora = time.monotonic()
+        with self._lock:
+            tokens, ultimo = self._baldes.get(cliente, (self.capacidade, agora))
+            tokens = min(self.capacidade, tokens + (agora - ultimo) * self.taxa)
+            if tokens >= 1:
+                self._baldes[cliente] = (tokens - 1, agora)
+                espera = 0
+            else:
+                self._baldes[cliente] = (tokens, agora)
+                espera = (1 - tokens) / self.taxa
+            
+            if len(self._baldes) > self.MAXIMO_CLIENTES:
+                # Baldes já cheios equivalem a clientes novos: podem ser descartados
+                for chave, (t, u) in list(self._baldes.items()):
+                    if t + (agora - u) * self.taxa >= self.capacidade:
+                        del self._baldes[chave]
+        return espera
+
+def limitar_taxa(limitador):
+    """Decorator de rota: responde 429 com Retry-After quando o balde do cliente esvazia"""
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def envolvida(*args, **kwargs):
+            espera = limitador.consumir(request.remote_addr or 'desconhecido')
+            if espera:
+                resposta = jsonify({'success': False, 'message': 'Muitas requisições. Tente novamente em instantes.'})
+                resposta.status_code = 429
+                resposta.headers['Retry-After'] = str(max(1, int(espera + 0.999)))
+                return resposta
+            return funcao(*args, **kwargs)
+        return envolvida
+    return decorador
+
+# ===== SERVIÇO DE ANÁLISE FORA DO PROCESSO =====
+def _tarefa_analisar(kpis, historico, sazonalidade=None):
+    return SugestaoIA.analisar(kpis, historico, sazonalidade)
+
+def _ler_linhas_backtest(caminho, corte, fim):
+    """(data_registro, *METRICAS) até `fim`: desde `corte` + os 7 registros anteriores (tendências)"""
+    conn = sqlite3.connect(f"file:{quote(caminho)}?mode=ro", uri=True, timeout=Config.SQLITE_TIMEOUT)
+    try:
+        conn.execute('PRAGMA query_only=1')
+        filtros, parametros = ['deletado_em IS NULL'], []
+        if fim:
+            filtros.append('data_registro <= ?')
+            parametros.append(fim)
+        where = ' AND '.join(filtros)
+        colunas = ', '.join(('data_registro',) + METRICAS)
+        if not corte:
+            return conn.execute(f'SELECT {colunas} FROM indicadores WHERE {where} ORDER BY data_registro, id',
+                                parametros).fetchall()
+        anteriores = conn.execute(f'''
+            SELECT {colunas} FROM indicadores WHERE {where} AND data_registro < ?
+            ORDER BY data_registro DESC, id DESC LIMIT 7
+        ''', parametros + [corte]).fetchall()
+        janela = conn.execute(f'''
+            SELECT {colunas} FROM indicadores WHERE {where} AND data_registro >= ?
+            ORDER BY data_registro, id
+        ''', parametros + [corte]).fetchall()
+        return anteriores[::-1] + janela
+    finally:
+        conn.close()
+
+def _tarefa_backtest(fonte, corte, periodo, inicio, fim, detalhes):
+    # fonte: caminho do banco (o trabalhador lê as linhas) ou as linhas já recortadas
+    linhas = _ler_linhas_backtest(fonte, corte, fim) if isinstance(fonte, str) else fonte
+    tabela, datas, ignoradas = SugestaoIA.tabela_historica(linhas, periodo, inicio, fim)
+    return dict(SugestaoIA.analisar_lote(tabela, datas).para_dict(detalhes), linhas_ignoradas=ignoradas)
+
+# Funções de módulo: são referenciadas pelo nome no processo trabalhador
+TAREFAS_ANALISE = {
+    'analisar': _tarefa_analisar,
+    'backtest': _tarefa_backtest,
+}
+
+def _executar_tarefa(nome, args):
+    return TAREFAS_ANALISE[nome](*args)
+
+def _futuro_local(nome, args):
+    """Future já resolvido com a tarefa executada na thread atual"""
+    futuro = Future()
+    try:
+        futuro.set_result(_executar_tarefa(nome, args))
+    except Exception as e:
+        futuro.set_exception(e)
+    return futuro
+
+class ServicoSobrecarregado(Exception):
+    """Fila do serviço de análise cheia: o chamador deve tentar novamente depois"""
+
+class AnaliseExpirada(Exception):
+    """Tarefa de análise não terminou dentro de ANALISE_TIMEOUT"""
+
+class ServicoAnalise:
+    """Pool de processos para análises CPU-bound, fora do GIL das threads de requisição
+    
+    As threads do Flask só enfileiram a tarefa e aguardam o resultado com timeout.
+    No máximo `fila_maxima` tarefas ficam pendentes ou em execução; acima disso
+    executar() levanta ServicoSobrecarregado em vez de acumular fila. Com `chave`
+    (versão dos dados + parâmetros), o resultado fica num CacheLRU por tarefa.
+    Sem pool de processos na plataforma (ex.: sem sem_open), executa localmente.
+    """
+    def __init__(self, processos=None, fila_maxima=None, timeout=None, cache_tamanho=None):
+        self.processos = processos or Config.ANALISE_PROCESSOS
+        self.fila_maxima = fila_maxima or Config.ANALISE_FILA_MAXIMA
+        self.timeout = timeout or Config.ANALISE_TIMEOUT
+        self._vagas = threading.BoundedSemaphore(self.fila_maxima)
+        self._cache = CacheLRU(cache_tamanho or Config.ANALISE_CACHE_TAMANHO)
+        self._executor = None
+        self._sem_pool = False
+        self._lock = threading.Lock()
+        self._metricas = {'executadas': 0, 'cache': 0, 'rejeitadas': 0, 'timeouts': 0, 'falhas_pool': 0}
+    
+    def _contar(self, chave):
+        with self._lock:
+            self._metricas[chave] += 1
+    
+    def _submeter(self, nome, args):
+        with self._lock:
+            if self._executor is None and not self._sem_pool:
+                try:
+                    # spawn: trabalhadores não herdam threads/conexões do servidor
+                    self._executor = ProcessPoolExecutor(self.processos,
+                                                         mp_context=multiprocessing.get_context('spawn'))
+                except Exception as e:
+                    print(f"⚠️ Pool de processos indisponível, análises rodam no próprio processo: {e}")
+                    self._sem_pool = True
+            executor = self._executor
+        if executor is None:
+            return _futuro_local(nome, args)
+        try:
+            return executor.submit(_executar_tarefa, nome, args)
+        except BrokenProcessPool as e:
+            print(f"⚠️ Pool de análise quebrado, calculando localmente: {e}")
+            with self._lock:
+                self._executor = None
+            self._contar('falhas_pool')
+            return _futuro_local(nome, args)
+    
+    def obter_cache(self, nome, chave):
+        """Resultado já calculado para (tarefa, chave), ou None"""
+        if chave is None:
+            return None
+        resultado = self._cache.obter((nome, chave))
+        if resultado is not None:
+            self._contar('cache')
+        return resultado
+    
+    def executar(self, nome, *args, chave=None):
+        resultado = self.obter_cache(nome, chave)
+        if resultado is not None:
+            return resultado
+        
+        if not self._vagas.acquire(blocking=False):
+            self._contar('rejeitadas')
+            raise ServicoSobrecarregado(f"{self.fila_maxima} análises já em andamento")
+        try:
+            futuro = self._submeter(nome, args)
+        except Exception:
+            self._vagas.release()
+            raise
+        # A vaga só volta quando o trabalhador termina, mesmo após timeout do chamador
+        futuro.add_done_callback(lambda _: self._vagas.release())
+        
+        try:
+            resultado = futuro.result(timeout=self.timeout)
+        except FuturoTimeout:
+            futuro.cancel()
+            self._contar('timeouts')
+            raise AnaliseExpirada(f"{nome} excedeu {self.timeout}s") from None
+        except BrokenProcessPool as e:
+            # Trabalhador morreu (OOM, kill): recria o pool na próxima chamada e calcula aqui
+            print(f"⚠️ Pool de análise quebrado, calculando localmente: {e}")
+            with self._lock:
+                self._executor = None
+            self._contar('falhas_pool')
+            resultado = _executar_tarefa(nome, args)
+        
+        self._contar('executadas')
+        if chave is not None:
+            self._cache.guardar((nome, chave), resultado)
+        return resultado
+    
+    def redimensionar_cache(self, tamanho):
+        """Novo limite do cache de resultados (excedentes saem na próxima gravação)"""
+        self._cache.tamanho = tamanho
+    
+    def metricas(self):
+        with self._lock:
+            return {'processos': self.processos, 'fila_maxima': self.fila_maxima,
+                    'timeout_s': self.timeout, 'cache_tamanho': self._cache.tamanho, **self._metricas}
+    
+    def encerrar(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+class ServicoAnaliseLocal(ServicoAnalise):
+    """Substituto sem processos (testes, INSIGHTPRO_ANALISE_PROCESSOS=0): executa na própria thread
+    
+    Mantém cache e backpressure; o timeout não interrompe a execução local.
+    """
+    def __init__(self, fila_maxima=None, timeout=None, cache_tamanho=None):
+        super().__init__(processos=0, fila_maxima=fila_maxima, timeout=timeout, cache_tamanho=cache_tamanho)
+        self.processos = 0
+    
+    def _submeter(self, nome, args):
+        return _futuro_local(nome, args)
+
+def criar_servico_analise(processos=None):
+    processos = Config.ANALISE_PROCESSOS if processos is None else processos
+    if processos <= 0:
+        return ServicoAnaliseLocal()
+    return ServicoAnalise(processos)
+
 # ===== APLICAÇÃO FLASK PRINCIPAL =====
 def criar_app():
     """Factory para criar aplicação Flask"""
-    app = Flask(__name__)
-    app.config.from_object(Config)
+    with MEDIDOR_INICIO.etapa('app:flask'):
+        app = Flask(__name__)
+        app.config.from_object(Config)
+        if DefaultJSONProvider:
+            app.json = ProvedorJSONRapido(app)
+        app.after_request(CompressorResposta.aplicar)
+    
+    if ESTADO_CONFIG['recarregado_em'] is None:
+        recarregar_configuracao(inicial=True)
+    
+    # Inicializar componentes (em modo rápido, o banco só é aberto no primeiro uso)
+    modo_rapido = MODO_INICIO == 'rapido'
+    with MEDIDOR_INICIO.etapa('app:database_manager'):
+        db_manager = criar_armazenamento(adiar_inicializacao=modo_rapido)
+        # Em modo rápido o buffer é carregado no aquecimento (ou na primeira leitura)
+        recentes = BufferRecentes(db_manager).iniciar(carregar=not modo_rapido)
+    
+    # Templates compilados sob demanda e reaproveitados entre requisições
+    templates_compilados = {}
+    templates_lock = threading.Lock()
     
-    # Inicializar componentes
-    db_manager = DatabaseManager()
+    def compilar_template(nome, fonte):
+        template = templates_compilados.get(nome)
+        if template is None:
+            with templates_lock:
+                template = templates_compilados.get(nome)
+                if template is None:
+                    with MEDIDOR_INICIO.etapa(f'template:{nome}'):
+                        template = app.jinja_env.from_string(fonte)
+                    templates_compilados[nome] = template
+        return template
+    
+    def renderizar(nome, fonte, **contexto):
+        return render_template(compilar_template(nome, fonte), **contexto)
+    
+    if modo_rapido:
+        def aquecer():
+            db_manager.garantir_inicializado()
+            recentes.reconstruir()
+            compilar_template('dashboard', DASHBOARD_TEMPLATE)
+            compilar_template('dashboard_kpis', DASHBOARD_KPIS_TEMPLATE)
+            compilar_template('dashboard_sugestoes', DASHBOARD_SUGESTOES_TEMPLATE)
+            compilar_template('adicionar_dados', ADICIONAR_DADOS_TEMPLATE)
+        
+        # Aquecimento fora do caminho crítico: o servidor já aceita conexões
+        threading.Thread(target=aquecer, name='aquecimento', daemon=True).start()
+    
+    db_manager.iniciar_compactacao()
+    db_manager.iniciar_manutencao()
     
     @app.route('/')
     def index():
@@ -1138,32 +5238,242 @@ def criar_app():
         </div>
         """)
     
+    # Uma análise por (período, versão dos dados, dia), servida a HTML, JSON e alertas
+    cache_analises = CacheLRU(tamanho=Config.ANALISE_CACHE_TAMANHO)
+    # Dashboard: casca estática por período, fragmentos por versão dos dados e páginas já comprimidas
+    cache_cascas = CacheLRU(tamanho=16)
+    cache_fragmentos = CacheLRU(tamanho=Config.ANALISE_CACHE_TAMANHO)
+    cache_paginas = CacheLRU(tamanho=Config.ANALISE_CACHE_TAMANHO)
+    metricas_dashboard = {'paginas': 0, 'fragmentos': 0, 'renderizacoes': 0}
+    lock_metricas_dashboard = threading.Lock()
+    
+    def contar_dashboard(chave):
+        # Threads do servidor concorrem no mesmo dicionário: += fora do lock perde contagens
+        with lock_metricas_dashboard:
+            metricas_dashboard[chave] += 1
+    colapsador = ColapsadorRequisicoes()
+    limitador_escrita = LimitadorTaxa(Config.LIMITE_ESCRITA_CAPACIDADE, Config.LIMITE_ESCRITA_TAXA)
+    
+    agendador = AgendadorDashboards(db_manager).iniciar() if Config.AGENDADOR_ATIVO else None
+    
+    def ao_recarregar(alterados):
+        """Ajustes guardados em objetos já criados (os demais são lidos de Config a cada uso)"""
+        cache_analises.tamanho = Config.ANALISE_CACHE_TAMANHO
+        cache_fragmentos.tamanho = cache_paginas.tamanho = Config.ANALISE_CACHE_TAMANHO
+        limitador_escrita.capacidade = Config.LIMITE_ESCRITA_CAPACIDADE
+        limitador_escrita.taxa = Config.LIMITE_ESCRITA_TAXA
+        servico_analise.timeout = Config.ANALISE_TIMEOUT
+        servico_analise.redimensionar_cache(Config.ANALISE_CACHE_TAMANHO)
+        if 'RECENTES_CAPACIDADE' in alterados:
+            recentes.capacidade = Config.RECENTES_CAPACIDADE
+            recentes.reconstruir()
+        if 'PERIODOS' in alterados:
+            # Cascas trazem as opções do seletor de período
+            cache_cascas.limpar()
+            cache_analises.limpar()
+            cache_fragmentos.limpar()
+            cache_paginas.limpar()
+            if agendador:
+                agendador.periodos = list(PERIODOS)
+                agendador.recalcular()
+    
+    registrar_ouvinte_config(ao_recarregar)
+    servico_analise = criar_servico_analise()
+    
+    @app.errorhandler(ServicoSobrecarregado)
+    def analise_sobrecarregada(erro):
+        resposta = jsonify({'success': False, 'message': 'Serviço de análise ocupado. Tente novamente em instantes.'})
+        resposta.status_code = 503
+        resposta.headers['Retry-After'] = '1'
+        return resposta
+    
+    @app.errorhandler(AnaliseExpirada)
+    def analise_expirada(erro):
+        return jsonify({'success': False, 'message': 'A análise excedeu o tempo limite.'}), 504
+    
+    def versao_analise(dimensao=None):
+        # Análise por dimensão: versionada pelos fatos, sem pré-cálculo do agendador
+        return db_manager.get_versao_fatos() if dimensao else db_manager.get_versao_dados()
+    
+    def obter_analise(periodo, dimensao=None):
+        versao = versao_analise(dimensao)
+        if not dimensao:
+            if agendador:
+                pre_calculado = agendador.obter(periodo, versao)
+                if pre_calculado:
+                    return pre_calculado
+        
+        chave = (periodo, dimensao, versao, date.today())
+        resultado = cache_analises.obter(chave)
+        if resultado is None:
+            def calcular():
+                kpis = db_manager.get_kpis(periodo, dimensao=dimensao)
+                historico = db_manager.get_historico(dimensao=dimensao)
+                # Índices sazonais são globais; fatias por dimensão ficam sem padrão semanal
+                sazonalidade = db_manager.get_indices_sazonais() if dimensao is None else None
+                calculado = (kpis, servico_analise.executar('analisar', kpis, historico, sazonalidade,
+                                                            chave=chave if versao is not None else None))
+                if versao is not None:
+                    cache_analises.guardar(chave, calculado)
+                return calculado
+            
+            # Manada após uma escrita/deploy: uma única computação por chave
+            resultado = colapsador.executar(chave, calcular)
+        return resultado
+    
+    def ler_dimensao():
+        """?dimensao=tipo:nome -> (tipo, nome), ou None para o total"""
+        valor = request.args.get('dimensao', '')
+        if ':' not in valor:
+            return None
+        tipo, nome = valor.split(':', 1)
+        return (tipo, nome)
+    
+    MARCA_KPIS, MARCA_SUGESTOES = '\x00kpis\x00', '\x00sugestoes\x00'
+    
+    def casca_dashboard(periodo):
+        """Partes estáticas do dashboard em bytes: (antes dos KPIs, entre os blocos, depois)"""
+        casca = cache_cascas.obter(periodo)
+        if casca is None:
+            html = renderizar('dashboard', DASHBOARD_TEMPLATE,
+                              titulo="Dashboard Estratégico",
+                              periodo=periodo,
+                              periodos=opcoes_periodo(),
+                              kpis_html=MARCA_KPIS,
+                              sugestoes_html=MARCA_SUGESTOES)
+            antes, resto = html.split(MARCA_KPIS)
+            meio, depois = resto.split(MARCA_SUGESTOES)
+            casca = (antes.encode(), meio.encode(), depois.encode())
+            cache_cascas.guardar(periodo, casca)
+        return casca
+    
     @app.route('/dashboard')
     def dashboard():
         periodo = request.args.get('periodo', 'semana')
-        kpis = db_manager.get_kpis(periodo)
-        historico = db_manager.get_historico()
-        sugestoes = SugestaoIA.gerar_sugestao_completa(kpis, historico)
+        dimensao = ler_dimensao()
+        versao = versao_analise(dimensao)
+        chave = (periodo, dimensao, versao, date.today())
+        codificacao = CompressorResposta.negociar(request.accept_encodings)
+        
+        # Página completa já comprimida para esta versão: só copia bytes
+        if versao is not None:
+            guardada = cache_paginas.obter((chave, codificacao))
+            if guardada is not None:
+                pagina, comprimida = guardada
+                contar_dashboard('paginas')
+                return resposta_dashboard(pagina, codificacao if comprimida else None)
         
-        return render_template_string(DASHBOARD_TEMPLATE, 
-                                      titulo="Dashboard Estratégico",
-                                      kpis=kpis,
-                                      sugestoes=sugestoes,
-                                      periodo=periodo)
+        fragmentos = cache_fragmentos.obter(chave) if versao is not None else None
+        if fragmentos is None:
+            kpis, analise = obter_analise(periodo, dimensao)
+            fragmentos = (
+                renderizar('dashboard_kpis', DASHBOARD_KPIS_TEMPLATE, kpis=kpis).encode(),
+                renderizar('dashboard_sugestoes', DASHBOARD_SUGESTOES_TEMPLATE, sugestoes=analise.html()).encode(),
+            )
+            contar_dashboard('renderizacoes')
+            if versao is not None:
+                cache_fragmentos.guardar(chave, fragmentos)
+        else:
+            contar_dashboard('fragmentos')
+        
+        antes, meio, depois = casca_dashboard(periodo)
+        pagina = b''.join((antes, fragmentos[0], meio, fragmentos[1], depois))
+        comprimida = bool(codificacao) and len(pagina) >= Config.COMPRESSAO_MINIMO
+        if comprimida:
+            pagina = CompressorResposta.comprimir(pagina, codificacao)
+        if versao is not None:
+            # Abaixo de COMPRESSAO_MINIMO a página fica crua mesmo com codificação negociada
+            cache_paginas.guardar((chave, codificacao), (pagina, comprimida))
+        return resposta_dashboard(pagina, codificacao if comprimida else None)
+    
+    def resposta_dashboard(pagina, codificacao):
+        resposta = Response(pagina, mimetype='text/html')
+        resposta.vary.add('Accept-Encoding')
+        if codificacao:
+            # Content-Encoding presente: CompressorResposta.aplicar não comprime de novo
+            resposta.headers['Content-Encoding'] = codificacao
+        return resposta
+    
+    @app.route('/api/metricas/dashboard')
+    def metricas_dashboard_rota():
+        with lock_metricas_dashboard:
+            copia = dict(metricas_dashboard)
+        return jsonify(copia)
     
     @app.route('/api/atualizar-dados')
     def atualizar_dados():
         periodo = request.args.get('periodo', 'semana')
-        kpis = db_manager.get_kpis(periodo)
-        historico = db_manager.get_historico()
-        sugestoes = SugestaoIA.gerar_sugestao_completa(kpis, historico)
+        kpis, analise = obter_analise(periodo, ler_dimensao())
+        
+        # Modo compacto: códigos + parâmetros em vez de HTML pré-renderizado
+        if request.args.get('compacto') == '1':
+            return jsonify({
+                'kpis': kpis,
+                **analise.compacto(),
+                'status': 'success'
+            })
         
         return jsonify({
             'kpis': kpis,
-            'sugestoes': sugestoes,
+            'sugestoes': analise.html(),
             'status': 'success'
         })
     
+    @app.route('/api/sugestoes')
+    def sugestoes():
+        periodo = request.args.get('periodo', 'semana')
+        dimensao = ler_dimensao()
+        kpis, analise = obter_analise(periodo, dimensao)
+        return jsonify({'periodo': periodo, 'dimensao': dimensao, 'kpis': kpis, **analise.para_dict()})
+    
+    @app.route('/api/sugestoes/backtest')
+    def backtest_sugestoes():
+        """Quantas vezes cada alerta teria disparado, dia a dia, no histórico"""
+        periodo = request.args.get('periodo', 'semana')
+        inicio = request.args.get('inicio')
+        fim = request.args.get('fim')
+        try:
+            for data in (inicio, fim):
+                if data:
+                    datetime.strptime(data, '%Y-%m-%d')
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Datas devem estar no formato AAAA-MM-DD'}), 400
+        
+        detalhes = request.args.get('detalhes') == '1'
+        versao = db_manager.get_versao_dados()
+        chave = (versao, periodo, inicio, fim, detalhes) if versao is not None else None
+        resultado = servico_analise.obter_cache('backtest', chave)
+        if resultado is None:
+            # Linhas anteriores ao início entram na janela e nas tendências dos primeiros dias:
+            # só as da janela do período e os 7 registros antes dela
+            corte = None
+            if inicio:
+                corte = (datetime.strptime(inicio, '%Y-%m-%d')
+                         - timedelta(days=PERIODOS.get(periodo, 7))).strftime('%Y-%m-%d')
+            fonte = db_manager.caminho_leitura_externa()
+            if fonte is None:
+                # Motor em memória: outro processo não enxerga os dados, as linhas vão junto da tarefa
+                anteriores, fonte = deque(maxlen=7), []
+                for lote in db_manager.iterar_indicadores(fim=fim):
+                    for linha in lote:
+                        linha = linha[7:8] + linha[1:7]
+                        (anteriores if corte and linha[0] < corte else fonte).append(linha)
+                fonte = list(anteriores) + fonte
+            resultado = servico_analise.executar('backtest', fonte, corte, periodo, inicio, fim, detalhes,
+                                                 chave=chave)
+        return jsonify({'success': True, 'periodo': periodo, **resultado})
+    
+    @app.route('/api/sugestoes/catalogo')
+    def catalogo_sugestoes():
+        return jsonify({
+            'textos': TEXTOS_SUGESTAO,
+            'severidades': SEVERIDADES,
+            'regras': [
+                {'codigo': r.codigo, 'severidade': r.severidade, 'condicoes': r.condicoes}
+                for r in REGRAS + REGRAS_ESTRATEGICAS
+            ]
+        })
+    
     @app.route('/api/status')
     def status():
         return jsonify({
@@ -1173,11 +5483,132 @@ def criar_app():
             'company': 'InNovaIdeia'
         })
     
+    @app.route('/api/metricas/agendador')
+    def metricas_agendador():
+        if not agendador:
+            return jsonify({'ativo': False})
+        return jsonify({'ativo': True, **agendador.metricas()})
+    
+    @app.route('/api/dias-margem-baixa')
+    def dias_margem_baixa():
+        try:
+            limite = float(request.args.get('limite', 10))
+        except ValueError:
+            return jsonify({'success': False, 'message': 'limite deve ser numérico'}), 400
+        dias = db_manager.get_dias_margem_abaixo(limite, request.args.get('inicio'), request.args.get('fim'))
+        return jsonify({'success': True, 'limite': limite, 'total': len(dias), 'dados': dias})
+    
+    @app.route('/api/sync')
+    def sincronizar():
+        """Delta para o espelho do cliente: ?desde=<watermark>&limite=N (desde=0 = carga inicial)"""
+        try:
+            desde = max(int(request.args.get('desde', 0)), 0)
+            limite = min(max(int(request.args.get('limite', 500)), 1), 5000)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'desde e limite devem ser inteiros'}), 400
+        resposta = jsonify(db_manager.get_sincronizacao(desde, limite))
+        resposta.headers['Cache-Control'] = 'no-store'
+        return resposta
+    
+    def script_cliente(fonte):
+        resposta = Response(fonte, mimetype='application/javascript')
+        # Revalidado a cada carga: o navegador só troca o service worker se o conteúdo mudar
+        resposta.headers['Cache-Control'] = 'no-cache'
+        return resposta
+    
+    @app.route('/sync.js')
+    def sync_js():
+        return script_cliente(SYNC_CLIENTE_JS)
+    
+    @app.route('/sw.js')
+    def service_worker():
+        return script_cliente(SERVICE_WORKER_JS.replace('__VERSAO__', VERSAO_CLIENTE))
+    
+    @app.route('/api/changes')
+    def feed_alteracoes():
+        """Feed incremental do log de alterações: ?after=<seq>&limite=N"""
+        try:
+            apos = max(int(request.args.get('after', 0)), 0)
+            limite = min(max(int(request.args.get('limite', 500)), 1), 5000)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'after e limite devem ser inteiros'}), 400
+        return jsonify(db_manager.get_alteracoes(apos, limite))
+    
+    @app.route('/api/resumo')
+    def resumo_periodos():
+        """Série semanal ou mensal de longo prazo: ?granularidade=semana|mes&inicio=&fim="""
+        granularidade = request.args.get('granularidade', 'mes')
+        if granularidade not in GRANULARIDADES_RESUMO:
+            return jsonify({'success': False, 'message': 'granularidade deve ser dia, semana ou mes'}), 400
+        return jsonify({
+            'success': True,
+            'granularidade': granularidade,
+            'dados': db_manager.get_resumo(granularidade, request.args.get('inicio'), request.args.get('fim')),
+        })
+    
+    @app.route('/api/sazonalidade')
+    def sazonalidade():
+        """Índices sazonais de uma métrica: ?metrica=vendas"""
+        metrica = request.args.get('metrica', 'vendas')
+        if metrica not in METRICAS_SAZONAIS:
+            return jsonify({'success': False, 'message': f'Métrica sem sazonalidade: {metrica}'}), 400
+        indices = db_manager.get_indices_sazonais()
+        if indices is None:
+            return jsonify({'success': False, 'message': 'Índices sazonais indisponíveis neste armazenamento'})
+        por_tipo = indices.get(metrica, {})
+        dias = por_tipo.get('dia_semana', {})
+        return jsonify({
+            'success': True,
+            'metrica': metrica,
+            'dia_semana': {DIAS_NOME[d]: v for d, v in sorted(dias.items())},
+            'mes': dict(sorted(por_tipo.get('mes', {}).items())),
+            'feriado': {'sim' if k else 'nao': v for k, v in por_tipo.get('feriado', {}).items()},
+        })
+    
+    @app.route('/api/status/manutencao')
+    def status_manutencao():
+        return jsonify(db_manager.status_manutencao())
+    
+    @app.route('/api/status/esquema')
+    def status_esquema():
+        return jsonify(db_manager.status_esquema())
+    
+    def admin_autorizado():
+        if Config.ADMIN_TOKEN:
+            return hmac.compare_digest(request.headers.get('X-Admin-Token', ''), Config.ADMIN_TOKEN)
+        return request.remote_addr in ('127.0.0.1', '::1')
+    
+    @app.route('/api/admin/config', methods=['GET', 'POST'])
+    def admin_config():
+        """GET: valores efetivos; POST {ajuste: valor}: sobrepõe e recarrega (corpo vazio relê o arquivo)"""
+        if not admin_autorizado():
+            return jsonify({'success': False, 'message': 'Acesso administrativo negado'}), 403
+        if request.method == 'GET':
+            return jsonify(configuracao_atual())
+        sobreposicoes = request.get_json(silent=True) or {}
+        if not isinstance(sobreposicoes, dict):
+            return jsonify({'success': False, 'message': 'Envie um objeto {ajuste: valor}'}), 400
+        resultado = recarregar_configuracao(sobreposicoes)
+        return jsonify(resultado), 200 if resultado['success'] else 400
+    
+    @app.route('/api/metricas/recentes')
+    def metricas_recentes():
+        return jsonify(recentes.metricas())
+    
+    @app.route('/api/metricas/analise')
+    def metricas_analise():
+        return jsonify(servico_analise.metricas())
+    
+    @app.route('/api/status/inicializacao')
+    def status_inicializacao():
+        return jsonify(MEDIDOR_INICIO.relatorio())
+    
     @app.route('/adicionar-dados')
     def adicionar_dados():
-        return render_template_string(ADICIONAR_DADOS_TEMPLATE)
+        return renderizar('adicionar_dados', ADICIONAR_DADOS_TEMPLATE)
     
     @app.route('/api/salvar-dados', methods=['POST'])
+    @limitar_taxa(limitador_escrita)
     def salvar_dados():
         try:
             dados = request.get_json()
@@ -1186,7 +5617,7 @@ def criar_app():
             campos_obrigatorios = ['vendas', 'despesas']
             for campo in campos_obrigatorios:
                 if campo not in dados or dados[campo] == '':
-                    return jsonify({'success': False, 'message': f'Campo {campo} é obrigatório'})
+                    return jsonify({'success': False, 'message': f'Campo {campo} é obrigatório'}), 400
             
             # Converter e calcular valores
             vendas = float(dados['vendas'])
@@ -1196,38 +5627,118 @@ def criar_app():
             ticket_medio = float(dados.get('ticket_medio', vendas / max(1, int(dados.get('clientes_ativos', 1)))))
             clientes_ativos = int(dados.get('clientes_ativos', 1))
             data_registro = dados.get('data_registro', datetime.now().strftime('%Y-%m-%d'))
+            try:
+                datetime.strptime(data_registro, '%Y-%m-%d')
+            except (TypeError, ValueError):
+                return jsonify({'success': False, 'message': 'data_registro deve estar no formato AAAA-MM-DD'}), 400
+            upsert = dados.get('upsert', Config.UPSERT_DIARIO)
+            if isinstance(upsert, str) and upsert.lower() in ('1', '0', 'true', 'false'):
+                upsert = upsert.lower() in ('1', 'true')
+            elif upsert in (0, 1) and not isinstance(upsert, float):
+                upsert = bool(upsert)
+            else:
+                return jsonify({'success': False, 'message': 'upsert deve ser booleano'}), 400
+            chave = request.headers.get('Idempotency-Key') or dados.get('chave_idempotencia')
             
             # Salvar no banco
-            resultado = db_manager.inserir_dados(
+            status, registro_id = db_manager.registrar_dados(
                 vendas, despesas, lucro, crescimento, 
-                ticket_medio, clientes_ativos, data_registro
+                ticket_medio, clientes_ativos, data_registro,
+                upsert=upsert, chave_idempotencia=chave
             )
             
-            if resultado:
+            if status == 'conflito':
+                return jsonify({'success': False, 'message': 'Chave de idempotência já usada com outros dados'}), 409
+            if status == 'indisponivel':
+                return jsonify({'success': False, 'message': 'Upsert diário indisponível: ative INSIGHTPRO_UPSERT_DIARIO=1 e reinicie'}), 409
+            if status != 'erro':
                 return jsonify({
                     'success': True, 
                     'message': 'Dados salvos com sucesso!',
+                    'id': registro_id,
+                    'status': status,
                     'dados': {
                         'vendas': vendas,
                         'despesas': despesas,
                         'lucro': lucro,
-                        'margem': round((lucro/vendas)*100, 2) if vendas > 0 else 0
+                        'margem': round(calcular_derivadas(vendas, despesas, lucro, clientes_ativos)[0], 2)
                     }
                 })
             else:
                 return jsonify({'success': False, 'message': 'Erro ao salvar dados'})
                 
         except ValueError as e:
-            return jsonify({'success': False, 'message': 'Valores inválidos. Use apenas números.'})
+            return jsonify({'success': False, 'message': 'Valores inválidos. Use apenas números.'}), 400
         except Exception as e:
             return jsonify({'success': False, 'message': f'Erro interno: {str(e)}'})
     
+    @app.route('/api/fatos', methods=['POST'])
+    @limitar_taxa(limitador_escrita)
+    def salvar_fatos():
+        dados = request.get_json(silent=True) or {}
+        fatos = dados.get('fatos') or []
+        
+        try:
+            for fato in fatos:
+                datetime.strptime(fato['data_registro'], '%Y-%m-%d')
+                fato['valor'] = float(fato['valor'])
+                if not (fato['tipo'] and fato['nome'] and fato['metrica']):
+                    raise ValueError
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'Cada fato precisa de data_registro (AAAA-MM-DD), tipo, nome, metrica e valor numérico'}), 400
+        
+        gravados = db_manager.registrar_fatos(fatos)
+        if gravados < 0:
+            return jsonify({'success': False, 'message': 'Erro ao gravar fatos'})
+        return jsonify({'success': True, 'gravados': gravados})
+    
+    @app.route('/api/fatos/agregado')
+    def agregar_fatos():
+        agrupar_por = request.args.get('agrupar_por')
+        granularidade = request.args.get('granularidade', 'total')
+        if not agrupar_por or granularidade not in ('total', 'mes', 'dia'):
+            return jsonify({'success': False, 'message': 'Informe agrupar_por e granularidade em total, mes ou dia'}), 400
+        
+        dados = db_manager.agregar_fatos(
+            request.args.get('metrica', 'vendas'), agrupar_por,
+            request.args.get('inicio'), request.args.get('fim'), granularidade
+        )
+        return jsonify({'success': True, 'dados': dados})
+    
+    @app.route('/api/dimensoes')
+    def listar_dimensoes():
+        return jsonify({'dados': db_manager.listar_dimensoes(request.args.get('tipo'))})
+    
     @app.route('/api/dados-recentes')
     def dados_recentes():
-        dados = db_manager.get_dados_recentes(limite=10)
-        return jsonify({'dados': dados})
+        return jsonify({'dados': recentes.obter(limite=Config.RECENTES_LIMITE)})
+    
+    @app.route('/api/deletar-dados', methods=['POST'])
+    @limitar_taxa(limitador_escrita)
+    def deletar_dados_lote():
+        dados = request.get_json(silent=True) or {}
+        ids = dados.get('ids') or []
+        inicio = dados.get('inicio')
+        fim = dados.get('fim')
+        
+        try:
+            ids = [int(i) for i in ids]
+            for data in (inicio, fim):
+                if data:
+                    datetime.strptime(data, '%Y-%m-%d')
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'Use ids inteiros e datas no formato AAAA-MM-DD'}), 400
+        
+        if not (ids or inicio or fim):
+            return jsonify({'success': False, 'message': 'Informe ids ou intervalo (inicio/fim)'}), 400
+        
+        removidos = db_manager.deletar_lote(ids=ids, inicio=inicio, fim=fim)
+        if removidos < 0:
+            return jsonify({'success': False, 'message': 'Erro ao remover dados'})
+        return jsonify({'success': True, 'removidos': removidos, 'message': f'{removidos} registro(s) removido(s)'})
     
     @app.route('/api/deletar-dados/<int:id>', methods=['DELETE'])
+    @limitar_taxa(limitador_escrita)
     def deletar_dados(id):
         resultado = db_manager.deletar_dados(id)
         if resultado:
@@ -1235,15 +5746,131 @@ def criar_app():
         else:
             return jsonify({'success': False, 'message': 'Erro ao remover dados'})
     
+    @app.route('/api/exportar/<formato>')
+    def exportar(formato):
+        if formato not in ExportadorDados.FORMATOS:
+            return jsonify({'success': False, 'message': f'Formato inválido. Use: {", ".join(ExportadorDados.FORMATOS)}'}), 400
+        
+        inicio = request.args.get('inicio')
+        fim = request.args.get('fim')
+        try:
+            for data in (inicio, fim):
+                if data:
+                    datetime.strptime(data, '%Y-%m-%d')
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Datas devem estar no formato AAAA-MM-DD'}), 400
+        
+        if formato in ('parquet', 'arrow') and not ExportadorDados.colunar_disponivel():
+            return jsonify({'success': False, 'message': 'Formato colunar requer pyarrow (pip install pyarrow)'}), 501
+        
+        # ?origem=arquivo lê os arquivos anuais da retenção em vez da tabela quente
+        if request.args.get('origem') == 'arquivo':
+            lotes = db_manager.consultar_arquivo(inicio, fim)
+        else:
+            lotes = db_manager.iterar_indicadores(inicio, fim)
+        gerador = getattr(ExportadorDados, formato)(lotes)
+        nome_arquivo = f"indicadores_{inicio or 'inicio'}_{fim or 'fim'}.{formato}"
+        
+        return Response(
+            stream_with_context(gerador),
+            mimetype=ExportadorDados.FORMATOS[formato],
+            headers={'Content-Disposition': f'attachment; filename={nome_arquivo}'}
+        )
+    
     return app
 
+# ===== LINHA DE COMANDO =====
+def executar_cli(argv):
+    """Comandos utilitários; retorna False quando nenhum foi pedido (sobe o servidor)"""
+    parser = argparse.ArgumentParser(description='InsightPro AI')
+    comandos = parser.add_subparsers(dest='comando')
+    
+    gerar = comandos.add_parser('gerar-dados', help='Gera dados sintéticos para testes de carga')
+    gerar.add_argument('--linhas', type=int, default=1_000_000)
+    gerar.add_argument('--dias', type=int, default=730, help='Período coberto (linhas distribuídas por dia)')
+    gerar.add_argument('--inicio', help='Data inicial AAAA-MM-DD (padrão: hoje - dias)')
+    gerar.add_argument('--semente', type=int, default=None)
+    gerar.add_argument('--lote', type=int, default=50000)
+    gerar.add_argument('--outliers', type=float, default=0.01, help='Probabilidade de outlier por linha')
+    gerar.add_argument('--db', help='Banco de destino (padrão: Config.DB_PATH)')
+    
+    migrar = comandos.add_parser('migrar', help='Aplica todas as migrações pendentes (inclusive backfills)')
+    migrar.add_argument('--db', help='Banco de destino (padrão: Config.DB_PATH)')
+    
+    retencao = comandos.add_parser('aplicar-retencao', help='Arquiva e resume registros fora da janela de retenção')
+    retencao.add_argument('--meses', type=int, default=None, help='Meses de dados brutos (padrão: INSIGHTPRO_RETENCAO_MESES)')
+    retencao.add_argument('--db', help='Banco de destino (padrão: Config.DB_PATH)')
+    
+    feriados = comandos.add_parser('atualizar-feriados', help='Reaplica o arquivo de feriados e recalcula a sazonalidade')
+    feriados.add_argument('--db', help='Banco de destino (padrão: Config.DB_PATH)')
+    
+    manutencao = comandos.add_parser('manutencao', help='PRAGMA optimize + checkpoint do WAL (e ANALYZE)')
+    manutencao.add_argument('--analyze', action='store_true', help='Inclui ANALYZE completo')
+    manutencao.add_argument('--vacuum', action='store_true',
+                            help='VACUUM único para ativar auto_vacuum=INCREMENTAL em bancos antigos')
+    manutencao.add_argument('--db', help='Banco de destino (padrão: Config.DB_PATH)')
+    
+    perfis = comandos.add_parser('comparar-perfis', help='Compara os perfis de PRAGMA do SQLite')
+    perfis.add_argument('--linhas', type=int, default=200000)
+    perfis.add_argument('--repeticoes', type=int, default=200)
+    
+    comparar = comandos.add_parser('comparar-armazenamentos', help='Compara os motores de armazenamento')
+    comparar.add_argument('--linhas', type=int, default=100000)
+    comparar.add_argument('--repeticoes', type=int, default=20)
+    
+    args = parser.parse_args(argv)
+    if args.comando is None:
+        return False
+    
+    if args.comando == 'gerar-dados':
+        inicio = (datetime.strptime(args.inicio, '%Y-%m-%d').date() if args.inicio
+                  else date.today() - timedelta(days=args.dias))
+        gerador = GeradorDados(
+            semente=args.semente, inicio=inicio,
+            linhas_por_dia=math.ceil(args.linhas / max(args.dias, 1)),
+            prob_outlier=args.outliers
+        )
+        print(f"📊 Gerando {args.linhas:,} registros ({'numpy' if gerador.usar_numpy else 'python puro'})...")
+        gerador.popular(DatabaseManager(args.db), args.linhas, args.lote)
+    elif args.comando == 'migrar':
+        db_manager = DatabaseManager(args.db)
+        if db_manager._thread_migracoes:
+            db_manager._thread_migracoes.join()
+        print(f"✅ Esquema na versão {db_manager.status_esquema()['versao']}")
+    elif args.comando == 'aplicar-retencao':
+        movidos = DatabaseManager(args.db).aplicar_retencao(args.meses)
+        print(f"✅ {movidos} registros movidos para resumos/arquivo" if movidos >= 0 else "❌ Retenção falhou")
+    elif args.comando == 'atualizar-feriados':
+        DatabaseManager(args.db).atualizar_calendario()
+    elif args.comando == 'manutencao':
+        resultado = DatabaseManager(args.db).manutencao(args.analyze, args.vacuum)
+        print(f"✅ Manutenção concluída: {resultado}" if resultado else "❌ Manutenção falhou")
+    elif args.comando in ('comparar-armazenamentos', 'comparar-perfis'):
+        if args.comando == 'comparar-perfis':
+            resultados = comparar_perfis_pragma(args.linhas, args.repeticoes)
+        else:
+            resultados = comparar_armazenamentos(args.linhas, args.repeticoes)
+        metricas = list(next(iter(resultados.values())))
+        print(f"{'métrica':<24}" + ''.join(f"{tipo:>16}" for tipo in resultados))
+        for metrica in metricas:
+            print(f"{metrica:<24}" + ''.join(f"{resultados[tipo][metrica]:>16}" for tipo in resultados))
+    return True
+
 # ===== EXECUÇÃO PRINCIPAL =====
 if __name__ == '__main__':
+    recarregar_configuracao(inicial=True)
+    # kill -HUP <pid>: relê o arquivo de configuração sem reiniciar
+    instalar_recarga_por_sinal()
+    
+    if executar_cli(sys.argv[1:]):
+        sys.exit(0)
+    
     print("🚀 Iniciando InsightPro AI - Versão Portável")
     print(f"📱 Ambiente detectado: {'Termux' if os.getenv('TERMUX_VERSION') else 'Padrão'}")
     print(f"💾 Banco de dados: {Config.DB_PATH}")
     
     app = criar_app()
+    MEDIDOR_INICIO.imprimir()
     
     try:
         print(f"🌐 Servidor rodando em http://{Config.HOST}:{Config.PORT}")